@@ -1,7 +1,8 @@
 from django.contrib import admin
 
 # Register your models here.
-from webapp.models import Synagogue, Person
+from webapp.models import Synagogue, Person, OutgoingEmail
 
 admin.site.register(Synagogue)
 admin.site.register(Person)
+admin.site.register(OutgoingEmail)
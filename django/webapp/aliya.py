@@ -0,0 +1,116 @@
+from datetime import date
+import math
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from pyluach.dates import HebrewDate
+
+from .family import FamilyGraph, get_family_graph, install_family_graph
+from .lib.date_utils import to_hebrew_ymd, anniversary_keys_between, has_anniversary_in
+from .lib.parasha_index import get_parasha_index
+from .lib.hebrew_calendar import HebrewYMD
+from .models import Synagogue, Person, AliyaPrecedenceReason
+
+Suggestion = Tuple[Person, Optional[int]]
+
+
+class AliyaPrecedenceEngine:
+    """
+    Evaluates aliya precedence for all of a synagogue's members at once.
+
+    All of the synagogue's people are loaded in a single query, and the family relations are computed in memory, so
+    the cost in queries doesn't grow with the size of the synagogue. The calendar math is done with integer Hebrew
+    dates: every date of birth and death is converted once, and then checking for a yahrzeit or birthday on a given
+    date is a lookup of its anniversary key. The results are the same as calling Person.get_aliya_precedence for every
+    member, given that family members belong to the same synagogue.
+    """
+
+    def __init__(self, synagogue: Synagogue, person_ids: Optional[Set[int]] = None) -> None:
+        """
+        If person_ids are given, only those people are candidates, and only they and their family are loaded (with the
+        family relations from the synagogue's cached family graph).
+        """
+        self.synagogue = synagogue
+        # like HebrewDate.today()
+        self.today = date.today()
+
+        self.people: Dict[int, Person] = {}
+        self.hebrew_dates_of_birth: Dict[int, HebrewYMD] = {}
+        self.hebrew_dates_of_death: Dict[int, HebrewYMD] = {}
+        # whether each of them can get an aliya is computed by the same query, from the bar mitzvah date column
+        people = Person.objects.filter(synagogue=synagogue).with_aliya_eligibility(self.today)
+        if person_ids is not None:
+            self.family_graph = get_family_graph(synagogue.pk)
+            loaded_ids = set(person_ids)
+            for person_id in person_ids:
+                loaded_ids |= self.family_graph.family_member_ids(person_id)
+            people = people.filter(pk__in=loaded_ids)
+        for person in people.order_by('pk'):
+            self.people[person.pk] = person
+            hebrew_date_of_birth = to_hebrew_ymd(person.date_of_birth, person.date_of_birth_after_sunset)
+            if hebrew_date_of_birth is not None:
+                self.hebrew_dates_of_birth[person.pk] = hebrew_date_of_birth
+            hebrew_date_of_death = to_hebrew_ymd(person.date_of_death, person.date_of_death_after_sunset)
+            if hebrew_date_of_death is not None:
+                self.hebrew_dates_of_death[person.pk] = hebrew_date_of_death
+        if person_ids is None:
+            # the people are already loaded, so the synagogue's family graph is rebuilt from them, which also warms it
+            # for the Person properties. The synagogue was loaded before them, so the graph is at least as new as its
+            # state.
+            self.family_graph = FamilyGraph(synagogue.pk, (synagogue.version, synagogue.modified_at),
+                                            ((person.pk, person.father_id, person.mother_id, person.wife_id)
+                                             for person in self.people.values()))
+            install_family_graph(self.family_graph)
+
+        self.members = [person for person in self.people.values()
+                        if person.is_member and (person_ids is None or person.pk in person_ids)]
+        # as of today, like Person.can_get_aliya
+        self.candidates = [person for person in self.members if person.is_eligible_for_aliya]
+
+        self._family_members: Dict[int, Set[int]] = {}
+
+    def family_member_ids(self, person: Person) -> Set[int]:
+        if person.pk not in self._family_members:
+            self._family_members[person.pk] = self.family_graph.family_member_ids(person.pk)
+        return self._family_members[person.pk]
+
+    def get_olim(self, on_date: HebrewDate) -> List[Suggestion]:
+        suggested_olim = self.get_precedence_reasons(on_date, self.candidates)
+        suggested_olim.sort(key=lambda suggestion: (suggestion[1] or math.inf,
+                                                    suggestion[0].last_aliya_date or date.min))
+        return suggested_olim
+
+    def get_precedence_reasons(self, on_date: HebrewDate, candidates: Iterable[Person]) -> List[Suggestion]:
+        """
+        Return the given candidates with their precedence reasons on the date (or None), in the same order. The ones
+        without a date of birth are left out, since their stored bar mitzvah date (which made them candidates) is stale.
+        """
+        if on_date.weekday() == 7:
+            # the custom is to get an aliya the shabbat preceding the yahrzeit or birthday
+            anniversary_keys = anniversary_keys_between(on_date, on_date + 6)
+            parshiot = get_parasha_index(self.synagogue.in_israel, on_date.year).parshiot_on(on_date)
+        else:
+            # bo b'yom
+            anniversary_keys = anniversary_keys_between(on_date, on_date)
+            parshiot = None
+
+        yahrzeits: Dict[int, bool] = {}
+        suggested_olim: List[Suggestion] = []
+        for candidate in candidates:
+            hebrew_date_of_birth = self.hebrew_dates_of_birth.get(candidate.pk)
+            if hebrew_date_of_birth is None:
+                continue
+            reason = None
+            for family_member_id in self.family_member_ids(candidate):
+                if family_member_id not in yahrzeits:
+                    date_of_death = self.hebrew_dates_of_death.get(family_member_id)
+                    yahrzeits[family_member_id] = (date_of_death is not None and
+                                                   has_anniversary_in(date_of_death, anniversary_keys))
+                if yahrzeits[family_member_id]:
+                    reason = AliyaPrecedenceReason.YAHRZEIT
+                    break
+            if reason is None and has_anniversary_in(hebrew_date_of_birth, anniversary_keys):
+                reason = AliyaPrecedenceReason.BIRTHDAY
+            if reason is None and parshiot is not None and candidate.bar_mitzvah_parasha in parshiot:
+                reason = AliyaPrecedenceReason.BAR_MITZVAH_PARASHA
+            suggested_olim.append((candidate, reason))
+        return suggested_olim
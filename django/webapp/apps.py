@@ -1,4 +1,9 @@
+import os
+
 from django.apps import AppConfig
+from django.conf import settings
+
+from .lib.occasion_index import load_occasion_indexes
 
 
 class WebappConfig(AppConfig):
@@ -7,3 +12,7 @@ class WebappConfig(AppConfig):
     def ready(self):
         # so the decorators there will run
         from . import signals  # noqa: F401
+
+        # so workers don't each have to recompute the Torah reading occasions
+        if os.path.exists(settings.TORAH_READING_OCCASION_INDEX_FILE):
+            load_occasion_indexes(settings.TORAH_READING_OCCASION_INDEX_FILE)
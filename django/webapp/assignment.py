@@ -0,0 +1,160 @@
+"""
+Assigning the aliyot of a Torah reading occasion to the suggested olim.
+
+The first aliya of a service is for a Cohen and the second for a Levi, and the rest of the regular aliyot are for
+Israelim. The maftir (and the aliyot added after the seven of Shabbat) may go to anyone. Everyone gets at most one
+aliya per occasion.
+
+The olim are taken in order of precedence (as returned by get_olim), and each one is added to a bipartite matching of
+olim to aliyot if an augmenting path exists, which may move the olim assigned earlier to other aliyot they can take.
+Adding in order of precedence this way gives the matching in which the set of olim is the best possible in order of
+precedence (the olim who can be matched form a matroid, for which the greedy choice is optimal), without trying out
+combinations. When there is no Cohen or no Levi, their aliyot are repaired afterwards according to the custom.
+"""
+from typing import List, NamedTuple, Optional, Sequence, Set
+
+from pyluach.dates import HebrewDate
+
+from .aliya import Suggestion
+from .lib.date_utils import TorahReadingOccasion
+from .models import Person, Synagogue, Yichus
+
+SHACHARIT = 'shacharit'
+MINCHA = 'mincha'
+
+# the number of regular aliyot on Shabbat, after which any aliya may go to a Cohen or a Levi as well
+SHABBAT_ALIYOT = 7
+
+
+class Aliya(NamedTuple):
+    service: str
+    # starting with 1, with the maftir last
+    number: int
+    # the yichus required, or None if anyone may get it
+    yichus: Optional[int]
+    is_maftir: bool = False
+
+    @property
+    def name(self) -> str:
+        return '{} maftir'.format(self.service) if self.is_maftir else '{} {}'.format(self.service, self.number)
+
+
+class Assignment(NamedTuple):
+    aliya: Aliya
+    person: Optional[Person]
+    reason: Optional[int]
+
+
+def aliyot_of(occasion: TorahReadingOccasion) -> List[Aliya]:
+    aliyot = []
+    for service, number_of_aliyot, has_maftir in ((SHACHARIT, occasion.shacharit_aliyot, occasion.has_maftir),
+                                                  (MINCHA, occasion.mincha_aliyot, False)):
+        for number in range(1, number_of_aliyot + 1):
+            if number == 1:
+                yichus: Optional[int] = Yichus.COHEN
+            elif number == 2:
+                yichus = Yichus.LEVI
+            elif number <= SHABBAT_ALIYOT:
+                yichus = Yichus.ISRAEL
+            else:
+                yichus = None
+            aliyot.append(Aliya(service, number, yichus))
+        if has_maftir:
+            aliyot.append(Aliya(service, number_of_aliyot + 1, None, is_maftir=True))
+    return aliyot
+
+
+def _yichus(person: Person) -> int:
+    # people without a known yichus are Israelim
+    return person.yichus if person.yichus is not None else Yichus.ISRAEL
+
+
+class _Matching:
+    def __init__(self, aliyot: Sequence[Aliya]) -> None:
+        self.aliyot = aliyot
+        self.olim: List[Optional[int]] = [None] * len(aliyot)
+
+    def can_get(self, person: Person, aliya_index: int) -> bool:
+        yichus = self.aliyot[aliya_index].yichus
+        return yichus is None or yichus == _yichus(person)
+
+    def add(self, candidate: int, people: Sequence[Person]) -> bool:
+        """Try to match the candidate (an index into people), moving the matched olim if needed (Kuhn's algorithm)."""
+        visited: Set[int] = set()
+
+        def augment(candidate: int) -> bool:
+            aliyot = [i for i in range(len(self.aliyot)) if i not in visited and self.can_get(people[candidate], i)]
+            # a free aliya is taken before moving anyone, so the olim stay in the earlier aliyot where possible
+            for aliya_index in aliyot:
+                if self.olim[aliya_index] is None:
+                    self.olim[aliya_index] = candidate
+                    return True
+            for aliya_index in aliyot:
+                if aliya_index in visited:
+                    continue
+                visited.add(aliya_index)
+                current = self.olim[aliya_index]
+                if current is not None and augment(current):
+                    self.olim[aliya_index] = candidate
+                    return True
+            return False
+
+        return augment(candidate)
+
+    @property
+    def full(self) -> bool:
+        return all(oleh is not None for oleh in self.olim)
+
+
+def assign_aliyot(occasion: TorahReadingOccasion, suggestions: Sequence[Suggestion]) -> List[Assignment]:
+    """
+    Assign the aliyot of the occasion to the suggested olim, given in order of precedence.
+
+    Aliyot which nobody can get are assigned to None.
+    """
+    aliyot = aliyot_of(occasion)
+    people = [person for person, reason in suggestions]
+    matching = _Matching(aliyot)
+    # the aliyot a candidate can get depend only on their yichus, so once a candidate can't be added, nobody else with
+    # the same yichus can be either (a failed search doesn't change the matching)
+    blocked: Set[int] = set()
+    for candidate in range(len(people)):
+        if matching.full or len(blocked) == len(Yichus.values):
+            break
+        yichus = _yichus(people[candidate])
+        if yichus not in blocked and not matching.add(candidate, people):
+            blocked.add(yichus)
+
+    # repairs for missing Cohanim and Leviim, service by service
+    assigned = {oleh for oleh in matching.olim if oleh is not None}
+    for service in (SHACHARIT, MINCHA):
+        indexes = {aliya.number: i for i, aliya in enumerate(aliyot) if aliya.service == service}
+        if 1 in indexes and matching.olim[indexes[1]] is None:
+            # an Israeli takes the place of the Cohen
+            matching.olim[indexes[1]] = _first_unassigned_israeli(people, assigned)
+        if 2 in indexes and matching.olim[indexes[2]] is None:
+            cohen = matching.olim[indexes[1]]
+            if cohen is not None and _yichus(people[cohen]) == Yichus.COHEN:
+                # the Cohen gets the Levi's aliya as well
+                matching.olim[indexes[2]] = cohen
+            else:
+                matching.olim[indexes[2]] = _first_unassigned_israeli(people, assigned)
+
+    return [Assignment(aliya, None, None) if oleh is None else Assignment(aliya, people[oleh], suggestions[oleh][1])
+            for aliya, oleh in zip(aliyot, matching.olim)]
+
+
+def _first_unassigned_israeli(people: Sequence[Person], assigned: Set[int]) -> Optional[int]:
+    for i, person in enumerate(people):
+        if i not in assigned and _yichus(person) == Yichus.ISRAEL:
+            assigned.add(i)
+            return i
+    return None
+
+
+def assign_aliyot_on(synagogue: Synagogue, on_date: HebrewDate) -> List[Assignment]:
+    """Assign the aliyot of the Torah reading occasion on the date, or return an empty list if there is none."""
+    occasion = synagogue.get_torah_reading_occasions_table(on_date.year).get(on_date)
+    if occasion is None:
+        return []
+    return assign_aliyot(occasion, synagogue.get_olim(on_date))
@@ -0,0 +1,157 @@
+import hashlib
+import hmac
+import os
+from typing import NamedTuple
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from rest_framework import exceptions
+from rest_framework.authentication import BasicAuthentication, TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+from webapp.lib.ttl_cache import TTLCache
+from webapp.models import UserToSynagogue
+from webapp.utils import set_request_synagogue
+
+# how long, and for how many users, a successful password check is remembered
+CREDENTIALS_CACHE_TTL = 5 * 60
+CREDENTIALS_CACHE_SIZE = 1000
+
+# how long, and for how many users, the keys of tokens are remembered
+TOKEN_CACHE_TTL = 5 * 60
+TOKEN_CACHE_SIZE = 10000
+
+# the key of the digests, which is never stored, so the cached digests can't be checked against guessed passwords
+# outside of this process
+_DIGEST_KEY = os.urandom(32)
+
+
+class CachedCredentials(NamedTuple):
+    digest: str
+    user_pk: int
+    # the user's password hash when the password was checked, so changing the password (even in another process)
+    # makes the entry useless
+    password_hash: str
+
+
+_credentials: TTLCache[str, CachedCredentials] = TTLCache(CREDENTIALS_CACHE_SIZE, CREDENTIALS_CACHE_TTL)
+
+
+def _digest(userid, password):
+    return hmac.new(_DIGEST_KEY, '{}\0{}'.format(userid, password).encode(), hashlib.sha256).hexdigest()
+
+
+def invalidate_credentials(username):
+    _credentials.delete(username)
+
+
+class CachedBasicAuthentication(BasicAuthentication):
+    """
+    Basic authentication which runs the (deliberately slow) password hasher only the first time a password is used.
+
+    A successful check is remembered as a keyed digest of the username and password. A request with the same
+    credentials then only loads the user, and is accepted if the user is still active and their username and password
+    hash didn't change since.
+    """
+
+    def authenticate_credentials(self, userid, password, request=None):
+        digest = _digest(userid, password)
+        cached = _credentials.get(userid)
+        if cached is not None and hmac.compare_digest(cached.digest, digest):
+            user_model = get_user_model()
+            user = user_model._default_manager.filter(pk=cached.user_pk).first()
+            if (user is not None and user.is_active and user.get_username() == userid and
+                    user.password == cached.password_hash):
+                return user, None
+            invalidate_credentials(userid)
+
+        user, auth = super().authenticate_credentials(userid, password, request)
+        _credentials.set(userid, CachedCredentials(digest, user.pk, user.password))
+        return user, auth
+
+
+class TokenCache:
+    """
+    The ids of users to the keys of their tokens, which is all that is cached of a token.
+
+    The entries are kept in the Django cache named by the TOKEN_CACHE_ALIAS setting if there is one, which the
+    processes of a deployment share, so an entry invalidated by one of them isn't used by the others. Otherwise they
+    are kept in process, which only invalidates them everywhere with a single process.
+    """
+
+    def __init__(self, max_size, ttl):
+        self.ttl = ttl
+        self._local: TTLCache[int, str] = TTLCache(max_size, ttl)
+
+    @property
+    def _shared(self):
+        return None if settings.TOKEN_CACHE_ALIAS is None else caches[settings.TOKEN_CACHE_ALIAS]
+
+    @staticmethod
+    def _shared_key(user_pk):
+        return 'webapp.token.{}'.format(user_pk)
+
+    def get(self, user_pk):
+        shared = self._shared
+        if shared is not None:
+            return shared.get(self._shared_key(user_pk))
+        return self._local.get(user_pk)
+
+    def set(self, user_pk, key):
+        shared = self._shared
+        if shared is not None:
+            shared.set(self._shared_key(user_pk), key, self.ttl)
+        else:
+            self._local.set(user_pk, key)
+
+    def delete(self, user_pk):
+        self._local.delete(user_pk)
+        shared = self._shared
+        if shared is not None:
+            shared.delete(self._shared_key(user_pk))
+
+
+# the ids of the synagogues' member creators to their tokens' keys
+_member_creator_tokens = TokenCache(TOKEN_CACHE_SIZE, TOKEN_CACHE_TTL)
+
+
+def invalidate_token(token):
+    _member_creator_tokens.delete(token.user_id)
+
+
+class SynagogueTokenAuthentication(TokenAuthentication):
+    """
+    Token authentication which loads the token's user along with their synagogue, in a single query.
+
+    Nothing of the user is cached, so a change to them (such as being deactivated or losing is_staff, even by update()
+    or in another process) applies to their next request.
+    """
+
+    def authenticate(self, request):
+        # authenticate_credentials isn't given the request, which it sets the synagogue of
+        self._request = request
+        return super().authenticate(request)
+
+    def authenticate_credentials(self, key):
+        token = Token.objects.select_related('user__usertosynagogue__synagogue').filter(key=key).first()
+        if token is None:
+            raise exceptions.AuthenticationFailed('Invalid token.')
+        if not token.user.is_active:
+            raise exceptions.AuthenticationFailed('User inactive or deleted.')
+        try:
+            synagogue = token.user.usertosynagogue.synagogue
+        except UserToSynagogue.DoesNotExist:
+            synagogue = None
+        set_request_synagogue(self._request, synagogue, token.user)
+        return token.user, token
+
+
+def get_member_creator_token(synagogue):
+    """Return the key of the token which adds members to the synagogue, creating it the first time."""
+    key = _member_creator_tokens.get(synagogue.member_creator_id)
+    if key is None:
+        token, created = Token.objects.get_or_create(user_id=synagogue.member_creator_id)
+        key = token.key
+        _member_creator_tokens.set(synagogue.member_creator_id, key)
+    return key
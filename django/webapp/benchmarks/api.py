@@ -0,0 +1,34 @@
+"""
+Request the person list and detail endpoints of a synagogue, as a logged in user of the React frontend would.
+"""
+from django.contrib.auth.models import User
+from django.test import Client
+
+from webapp.models import UserToSynagogue
+
+from .olim import create_synagogue
+from .suite import Benchmark
+
+SIZE = 1000
+
+
+def benchmarks():
+    synagogue = create_synagogue(SIZE, seed=1)
+    user = User.objects.create_user('benchmark_api')
+    UserToSynagogue.objects.create(user=user, synagogue=synagogue)
+    client = Client()
+    client.force_login(user)
+    person = synagogue.people.order_by('pk').first()
+
+    def get(url):
+        response = client.get(url)
+        assert response.status_code == 200, response.status_code
+        return response
+
+    yield Benchmark('person list[{}]'.format(SIZE), lambda: get('/person'))
+    yield Benchmark('person list page[100]', lambda: get('/person?page_size=100'))
+    yield Benchmark('person list fields[{}]'.format(SIZE), lambda: get('/person?fields=pk,first_name,last_name'))
+    yield Benchmark('person detail', lambda: get('/person/{}'.format(person.pk)), repeat=100)
+    # a refetch of an unchanged list
+    etag = get('/person')['ETag']
+    yield Benchmark('person list not modified', lambda: client.get('/person', HTTP_IF_NONE_MATCH=etag), repeat=100)
@@ -0,0 +1,37 @@
+"""
+Measure assigning the aliyot of a Shabbat (with maftir and mincha) in synthetic synagogues of growing sizes.
+"""
+import random
+from datetime import date, timedelta
+
+from webapp.assignment import assign_aliyot
+from webapp.lib.date_utils import TorahReadingOccasion
+from webapp.models import Person, Yichus, AliyaPrecedenceReason
+
+from .suite import Benchmark
+
+SHABBAT = TorahReadingOccasion('Shabbat', 7, 3)
+SIZES = (100, 1000, 10000, 100000)
+
+
+def synthetic_suggestions(size, seed=0):
+    """Suggestions like get_olim's for a synagogue of the given size: mostly Israelim, few with a reason."""
+    rng = random.Random(seed)
+    suggestions = []
+    for i in range(size):
+        yichus = rng.choices([Yichus.COHEN, Yichus.LEVI, Yichus.ISRAEL, None], [5, 5, 80, 10])[0]
+        reason = rng.choices([AliyaPrecedenceReason.YAHRZEIT, AliyaPrecedenceReason.BIRTHDAY,
+                              AliyaPrecedenceReason.BAR_MITZVAH_PARASHA, None], [1, 1, 1, 97])[0]
+        person = Person(pk=i, first_name=str(i), yichus=yichus,
+                        last_aliya_date=date(2020, 1, 1) + timedelta(days=rng.randrange(365)))
+        suggestions.append((person, reason))
+    # in the order of get_olim
+    suggestions.sort(key=lambda suggestion: (suggestion[1] or float('inf'), suggestion[0].last_aliya_date))
+    return suggestions
+
+
+def benchmarks():
+    for size in SIZES:
+        suggestions = synthetic_suggestions(size)
+        yield Benchmark('assign_aliyot[{}]'.format(size),
+                        lambda suggestions=suggestions: assign_aliyot(SHABBAT, suggestions))
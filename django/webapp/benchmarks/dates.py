@@ -0,0 +1,43 @@
+"""
+Sweep the date_utils functions over the dates of several centuries, a date a week.
+"""
+from datetime import date, timedelta
+
+from webapp.lib.date_utils import to_hebrew_date, nth_anniversary_of, next_anniversary_of, nth_anniversaries_of, \
+    next_anniversaries_of
+
+from .suite import Benchmark
+
+START = date(1800, 1, 1)
+END = date(2100, 1, 1)
+STEP = timedelta(days=7)
+
+
+def sweep():
+    dates = []
+    day = START
+    while day < END:
+        dates.append(day)
+        day += STEP
+    return dates
+
+
+def benchmarks():
+    gregorian_dates = sweep()
+    # every other one after sunset
+    hebrew_dates = [to_hebrew_date(day, i % 2 == 1) for i, day in enumerate(gregorian_dates)]
+    reference = to_hebrew_date(END, False)
+    years = [hebrew_date.year for hebrew_date in hebrew_dates]
+    months = [hebrew_date.month for hebrew_date in hebrew_dates]
+    days = [hebrew_date.day for hebrew_date in hebrew_dates]
+    size = len(gregorian_dates)
+
+    yield Benchmark('to_hebrew_date[{}]'.format(size),
+                    lambda: [to_hebrew_date(day, i % 2 == 1) for i, day in enumerate(gregorian_dates)])
+    yield Benchmark('nth_anniversary_of[{}]'.format(size),
+                    lambda: [nth_anniversary_of(hebrew_date, 13) for hebrew_date in hebrew_dates])
+    yield Benchmark('next_anniversary_of[{}]'.format(size),
+                    lambda: [next_anniversary_of(hebrew_date, reference) for hebrew_date in hebrew_dates])
+    yield Benchmark('nth_anniversaries_of[{}]'.format(size), lambda: nth_anniversaries_of(years, months, days, 13))
+    yield Benchmark('next_anniversaries_of[{}]'.format(size),
+                    lambda: next_anniversaries_of(years, months, days, reference))
@@ -0,0 +1,28 @@
+"""
+Rank the olim of a Shabbat in synthetic synagogues of growing sizes.
+"""
+from django.contrib.auth.models import User
+from pyluach.dates import HebrewDate
+
+from webapp.generator import generate_people, DEFAULT_TODAY
+from webapp.models import Synagogue
+
+from .suite import Benchmark
+
+SHABBAT = HebrewDate(5780, 10, 21)
+SIZES = (100, 1000, 10000)
+
+
+def create_synagogue(size, seed=0):
+    name = 'benchmark_{}_{}'.format(size, seed)
+    synagogue = Synagogue.objects.create(name=name, member_creator=User.objects.create(username=name))
+    # generated as of the fixed default day, so the people are the same in every run
+    generate_people(synagogue, size, seed, today=DEFAULT_TODAY)
+    return synagogue
+
+
+def benchmarks():
+    for size in SIZES:
+        synagogue = create_synagogue(size)
+        yield Benchmark('get_olim[{}]'.format(size), lambda synagogue=synagogue: synagogue.get_olim(SHABBAT),
+                        repeat=3 if size >= 10000 else 10)
@@ -0,0 +1,43 @@
+"""
+Compare the cost of checking the bar mitzvah parasha of a synagogue's members with pyluach's tables and with the
+parasha index.
+"""
+from itertools import cycle
+
+from pyluach.dates import HebrewDate
+from pyluach.parshios import getparsha
+
+from webapp.lib.parasha_index import get_parasha_index
+
+from .suite import Benchmark
+
+SHABBAT = HebrewDate(5780, 10, 21)
+# how many members are checked
+MEMBERS = 1000
+
+
+def with_getparsha() -> bool:
+    parshiot = getparsha(SHABBAT, israel=True)
+    return parshiot is not None and 12 in parshiot
+
+
+_years = cycle(range(5700, 5760))
+
+
+def with_table_build() -> bool:
+    # cycling through more years than pyluach memoizes, so every call builds a parasha table
+    year = next(_years)
+    parshiot = getparsha(HebrewDate(year, 10, 21), israel=True)
+    return parshiot is not None and 12 in parshiot
+
+
+def with_index() -> bool:
+    return get_parasha_index(True, SHABBAT.year).is_read_on(12, SHABBAT)
+
+
+def benchmarks():
+    # building a table for every member is slow enough to be measured fewer times
+    for name, function, repeat in (('table_build', with_table_build, 3), ('getparsha', with_getparsha, 10),
+                                   ('index', with_index, 10)):
+        yield Benchmark('parasha[{}]'.format(name), lambda function=function: [function() for i in range(MEMBERS)],
+                        repeat)
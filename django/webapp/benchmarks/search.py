@@ -0,0 +1,21 @@
+"""
+Search the names of a large synthetic synagogue, as its type-ahead would with every keystroke.
+"""
+from webapp.models import Person
+from webapp.search import search
+
+from .olim import create_synagogue
+from .suite import Benchmark
+
+SIZE = 50000
+QUERIES = ('c', 'coh', 'cohen avr', 'sh le')
+
+
+def benchmarks():
+    synagogue = create_synagogue(SIZE, seed=2)
+    people = Person.objects.filter(synagogue=synagogue)
+    for query in QUERIES:
+        # a page of results, as the search view returns
+        yield Benchmark('search {!r}[{}]'.format(query, SIZE),
+                        lambda query=query: list(search(people, query).order_by('last_name', 'first_name', 'pk')[:20]),
+                        repeat=20)
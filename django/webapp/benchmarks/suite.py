@@ -0,0 +1,127 @@
+"""
+The benchmark suite, which records the wall time, SQL queries and peak memory of each benchmark, and compares them to
+a baseline saved by an earlier run.
+
+Every module in MODULES has a benchmarks() function, which sets up what its benchmarks need (in the database the suite
+runs in) and yields them. Run with: python manage.py benchmark
+"""
+import importlib
+import json
+import platform
+import tracemalloc
+from statistics import median
+from time import perf_counter
+from typing import Any, Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional
+
+from django.db import connection
+
+MODULES = ('dates', 'parasha', 'olim', 'assignment', 'api', 'search')
+
+# how much slower (or bigger) than the baseline a benchmark may get before it counts as a regression, since timings
+# vary between runs
+DEFAULT_TOLERANCE = 0.25
+
+
+class Benchmark(NamedTuple):
+    name: str
+    function: Callable[[], Any]
+    # how many times the function is timed
+    repeat: int = 10
+
+
+class Result(NamedTuple):
+    name: str
+    # per call
+    best_seconds: float
+    median_seconds: float
+    queries: int
+    # the peak of the memory allocated during a call, in bytes
+    peak_memory: int
+
+
+def _count_queries(counter: List[int]) -> Callable[..., Any]:
+    def execute(execute: Callable[..., Any], sql: str, params: Any, many: bool, context: Dict[str, Any]) -> Any:
+        counter[0] += 1
+        return execute(sql, params, many, context)
+
+    return execute
+
+
+def measure(benchmark: Benchmark) -> Result:
+    # once to warm the caches up, as in a worker which has been running for a while
+    benchmark.function()
+
+    times = []
+    queries = [0]
+    with connection.execute_wrapper(_count_queries(queries)):
+        for i in range(benchmark.repeat):
+            start = perf_counter()
+            benchmark.function()
+            times.append(perf_counter() - start)
+
+    # measured separately, since tracing the allocations slows everything down
+    tracemalloc.start()
+    try:
+        benchmark.function()
+        peak_memory = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return Result(benchmark.name, min(times), median(times), queries[0] // benchmark.repeat, peak_memory)
+
+
+def benchmarks(modules: Iterable[str] = MODULES) -> Iterator[Benchmark]:
+    for module in modules:
+        yield from importlib.import_module('{}.{}'.format(__package__, module)).benchmarks()
+
+
+def run(modules: Iterable[str] = MODULES, only: Optional[str] = None,
+        progress: Optional[Callable[[Result], None]] = None) -> List[Result]:
+    """Measure the benchmarks of the modules, or only the ones whose name contains the given string."""
+    results = []
+    for benchmark in benchmarks(modules):
+        if only is not None and only not in benchmark.name:
+            continue
+        result = measure(benchmark)
+        results.append(result)
+        if progress is not None:
+            progress(result)
+    return results
+
+
+def to_json(results: Iterable[Result]) -> Dict[str, Any]:
+    return {
+        'python': platform.python_version(),
+        'database': connection.vendor,
+        'results': {result.name: result._asdict() for result in results},
+    }
+
+
+def save(results: Iterable[Result], path: str) -> None:
+    with open(path, 'w') as f:
+        json.dump(to_json(results), f, indent=2, sort_keys=True)
+
+
+def load(path: str) -> Dict[str, Result]:
+    with open(path) as f:
+        return {name: Result(**result) for name, result in json.load(f)['results'].items()}
+
+
+def compare(results: Iterable[Result], baseline: Dict[str, Result],
+            tolerance: float = DEFAULT_TOLERANCE) -> List[str]:
+    """Return a description of every regression of the results from the baseline. New benchmarks are not compared."""
+    regressions = []
+    for result in results:
+        base = baseline.get(result.name)
+        if base is None:
+            continue
+        # the best time is the least noisy one
+        if result.best_seconds > base.best_seconds * (1 + tolerance):
+            regressions.append('{}: {:.3f} ms, was {:.3f} ms'.format(
+                result.name, result.best_seconds * 1e3, base.best_seconds * 1e3))
+        if result.queries > base.queries:
+            regressions.append('{}: {} queries, was {}'.format(result.name, result.queries, base.queries))
+        if result.peak_memory > base.peak_memory * (1 + tolerance):
+            regressions.append('{}: {} KiB peak memory, was {}'.format(
+                result.name, result.peak_memory // 1024, base.peak_memory // 1024))
+    return regressions
@@ -0,0 +1,72 @@
+"""
+Streaming export of a synagogue's people.
+
+The rows are read with a server-side iterator and written out as they are read, so the people aren't all kept in
+memory, and the CSV header goes out before the database is even queried. What is kept is a map of every person's id
+to their name, for the names of the relatives, so the memory use still grows with the number of people (if much
+slower), and the map is read in full before the first row is written.
+"""
+import csv
+import json
+from typing import Any, Callable, Dict, Iterator, Tuple
+
+from .models import Person, Synagogue, Gender, Yichus
+
+# the Person fields which are exported as they are
+FIELDS = ('id', 'external_id', 'first_name', 'last_name', 'maiden_name', 'gender', 'date_of_birth',
+          'date_of_birth_after_sunset', 'date_of_death', 'date_of_death_after_sunset', 'is_member', 'email', 'address',
+          'phone_number', 'yichus', 'bar_mitzvah_parasha', 'last_aliya_date', 'father_id', 'mother_id', 'wife_id')
+# the relatives whose names are exported next to their ids
+RELATIVES = ('father', 'mother', 'wife')
+COLUMNS = FIELDS + tuple(relative + '_name' for relative in RELATIVES)
+
+CHUNK_SIZE = 2000
+
+ENUMS = {'gender': Gender, 'yichus': Yichus}
+
+
+def _full_name(first_name: str, last_name: str) -> str:
+    # like Person.full_name
+    return first_name + ' ' + last_name if last_name else first_name
+
+
+def _export_values(synagogue: Synagogue) -> Iterator[Dict[str, Any]]:
+    people = Person.objects.filter(synagogue=synagogue).order_by('pk')
+    # the names of the relatives are looked up here instead of joining three times or querying for every row
+    names = {pk: _full_name(first_name, last_name)
+             for pk, first_name, last_name in people.values_list('pk', 'first_name', 'last_name').iterator(CHUNK_SIZE)}
+    for values in people.values_list(*FIELDS).iterator(CHUNK_SIZE):
+        row = dict(zip(FIELDS, values))
+        for field, enum in ENUMS.items():
+            if row[field] is not None:
+                row[field] = enum.label(row[field])
+        for relative in RELATIVES:
+            row[relative + '_name'] = names.get(row[relative + '_id'])
+        yield row
+
+
+class _Echo:
+    """A file-like object which returns what is written to it, so csv.writer can be used for a single row."""
+
+    def write(self, value: str) -> str:
+        return value
+
+
+def export_csv(synagogue: Synagogue) -> Iterator[str]:
+    writer = csv.writer(_Echo())
+    # the byte order mark makes Excel open the Hebrew correctly
+    yield '\ufeff' + writer.writerow(COLUMNS)
+    for row in _export_values(synagogue):
+        yield writer.writerow(['' if row[column] is None else row[column] for column in COLUMNS])
+
+
+def export_jsonl(synagogue: Synagogue) -> Iterator[str]:
+    for row in _export_values(synagogue):
+        yield json.dumps(row, ensure_ascii=False, default=str) + '\n'
+
+
+# format: (content type, exporter)
+EXPORT_FORMATS: Dict[str, Tuple[str, Callable[[Synagogue], Iterator[str]]]] = {
+    'csv': ('text/csv; charset=utf-8', export_csv),
+    'jsonl': ('application/x-ndjson; charset=utf-8', export_jsonl),
+}
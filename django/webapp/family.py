@@ -0,0 +1,203 @@
+from collections import defaultdict
+from datetime import datetime
+from threading import RLock
+from typing import Callable, Dict, Iterable, Optional, Set, Tuple
+
+from django.db import transaction
+
+from .models import Person, Synagogue
+
+# person id, father id, mother id, wife id
+FamilyLinks = Tuple[int, Optional[int], Optional[int], Optional[int]]
+# the version and modification time of a synagogue, which change together on every change of its people (see
+# Synagogue.touch), and which tell a synagogue apart from an earlier one with the same id
+SynagogueState = Tuple[int, datetime]
+
+
+class FamilyGraph:
+    """
+    The parent, spouse and child relations between a synagogue's people, by id.
+
+    The graph is built from a single query, and is labeled with the state of the synagogue it was built at, which
+    must be read before the links. A cached graph is only used while the synagogue is still in that state, so a graph
+    which another process (or a bulk update, which sends no signals) made stale is rebuilt. Within the process, the
+    Person signal handlers in webapp.signals patch the graph once a save or delete is committed, and move it to the
+    state the change brought the synagogue to.
+    """
+
+    def __init__(self, synagogue_id: int, state: Optional[SynagogueState], links: Iterable[FamilyLinks]) -> None:
+        self.synagogue_id = synagogue_id
+        self.state = state
+        self._lock = RLock()
+        self.fathers: Dict[int, int] = {}
+        self.mothers: Dict[int, int] = {}
+        self.wives: Dict[int, int] = {}
+        self.husbands: Dict[int, int] = {}
+        self.children: Dict[int, Set[int]] = defaultdict(set)
+        self.people: Set[int] = set()
+        for person_id, father_id, mother_id, wife_id in links:
+            self._link(person_id, father_id, mother_id, wife_id)
+
+    @classmethod
+    def build(cls, synagogue_id: int, state: Optional[SynagogueState]) -> 'FamilyGraph':
+        links = Person.objects.filter(synagogue_id=synagogue_id).values_list('pk', 'father_id', 'mother_id', 'wife_id')
+        return cls(synagogue_id, state, links)
+
+    def _link(self, person_id: int, father_id: Optional[int], mother_id: Optional[int],
+              wife_id: Optional[int]) -> None:
+        self.people.add(person_id)
+        if father_id is not None:
+            self.fathers[person_id] = father_id
+            self.children[father_id].add(person_id)
+        if mother_id is not None:
+            self.mothers[person_id] = mother_id
+            self.children[mother_id].add(person_id)
+        if wife_id is not None:
+            self.wives[person_id] = wife_id
+            self.husbands[wife_id] = person_id
+
+    def _unlink(self, person_id: int) -> None:
+        self.people.discard(person_id)
+        father_id = self.fathers.pop(person_id, None)
+        if father_id is not None:
+            self.children[father_id].discard(person_id)
+        mother_id = self.mothers.pop(person_id, None)
+        if mother_id is not None:
+            self.children[mother_id].discard(person_id)
+        wife_id = self.wives.pop(person_id, None)
+        if wife_id is not None and self.husbands.get(wife_id) == person_id:
+            del self.husbands[wife_id]
+
+    def update(self, links: FamilyLinks) -> None:
+        """Replace the links of a person with the ones it was saved with."""
+        with self._lock:
+            self._unlink(links[0])
+            self._link(*links)
+
+    def remove(self, person_id: int) -> None:
+        """Remove a deleted person, and the links to it (which the database sets to null)."""
+        with self._lock:
+            self._unlink(person_id)
+            for child_id in self.children.pop(person_id, set()):
+                if self.fathers.get(child_id) == person_id:
+                    del self.fathers[child_id]
+                if self.mothers.get(child_id) == person_id:
+                    del self.mothers[child_id]
+            husband_id = self.husbands.pop(person_id, None)
+            if husband_id is not None:
+                del self.wives[husband_id]
+
+    def children_of(self, person_id: int) -> Set[int]:
+        return set(self.children.get(person_id, ()))
+
+    def husband_of(self, person_id: int) -> Optional[int]:
+        return self.husbands.get(person_id)
+
+    def family_member_ids(self, person_id: int) -> Set[int]:
+        """The ids of the people in Person.immediate_family_members."""
+        with self._lock:
+            family_members = set()
+            # parents and siblings
+            for parents in (self.fathers, self.mothers):
+                parent_id = parents.get(person_id)
+                if parent_id is not None:
+                    family_members.add(parent_id)
+                    family_members.update(self.children.get(parent_id, ()))
+            # remove self (was added as a sibling)
+            family_members.discard(person_id)
+            # spouse
+            for spouses in (self.wives, self.husbands):
+                spouse_id = spouses.get(person_id)
+                if spouse_id is not None:
+                    family_members.add(spouse_id)
+            # children
+            family_members.update(self.children.get(person_id, ()))
+            return family_members
+
+
+_graphs: Dict[int, FamilyGraph] = {}
+
+
+def synagogue_state(synagogue_id: int) -> Optional[SynagogueState]:
+    return Synagogue.objects.filter(pk=synagogue_id).values_list('version', 'modified_at').first()
+
+
+def install_family_graph(graph: FamilyGraph) -> None:
+    # a graph built inside a transaction may include changes which are rolled back
+    transaction.on_commit(lambda: _graphs.__setitem__(graph.synagogue_id, graph))
+
+
+def get_family_graph(synagogue_id: int) -> FamilyGraph:
+    """Return the synagogue's family graph, building it if the cached one is missing or stale."""
+    state = synagogue_state(synagogue_id)
+    graph = _graphs.get(synagogue_id)
+    if graph is None or graph.state != state:
+        graph = FamilyGraph.build(synagogue_id, state)
+        install_family_graph(graph)
+    return graph
+
+
+def cached_family_graph(synagogue_id: int, state: SynagogueState) -> Optional[FamilyGraph]:
+    """Return the synagogue's family graph only if it is already cached, as of the given state of the synagogue."""
+    graph = _graphs.get(synagogue_id)
+    if graph is None or graph.state != state:
+        return None
+    return graph
+
+
+def drop_family_graph(synagogue_id: int) -> None:
+    _graphs.pop(synagogue_id, None)
+
+
+def _patch_on_commit(synagogue_id: int, state_before: Optional[SynagogueState],
+                     patch: Callable[[FamilyGraph], None]) -> None:
+    """
+    Patch the cached graph once the change is committed, if it was in the synagogue's state from right before it.
+
+    Called after the change touched the synagogue, which keeps other writers from changing it until the commit.
+    """
+    state_after = synagogue_state(synagogue_id)
+    # otherwise someone else changed the synagogue in between
+    consecutive = (state_before is not None and state_after is not None and state_after[0] == state_before[0] + 1)
+
+    def apply() -> None:
+        graph = _graphs.get(synagogue_id)
+        if graph is None:
+            return
+        if not consecutive or graph.state != state_before:
+            drop_family_graph(synagogue_id)
+            return
+        patch(graph)
+        graph.state = state_after
+
+    transaction.on_commit(apply)
+
+
+def person_changing(person: Person) -> None:
+    """Remember the state of the synagogue before a save or delete touches it, if its graph is cached."""
+    if person.synagogue_id in _graphs:
+        person._family_graph_state = synagogue_state(person.synagogue_id)
+
+
+def person_saved(person: Person) -> None:
+    """Patch the graph of the person's synagogue with their links. Must be called after the synagogue was touched."""
+    old_synagogue_id = person.loaded_values.get('synagogue_id')
+    if old_synagogue_id is not None and old_synagogue_id != person.synagogue_id:
+        # the person moved to another synagogue
+        transaction.on_commit(lambda: drop_family_graph(old_synagogue_id))
+    if not hasattr(person, '_family_graph_state'):
+        return
+    state_before = person._family_graph_state
+    del person._family_graph_state
+    links = (person.pk, person.father_id, person.mother_id, person.wife_id)
+    _patch_on_commit(person.synagogue_id, state_before, lambda graph: graph.update(links))
+
+
+def person_deleted(person: Person) -> None:
+    """Remove the person from the graph of their synagogue. Must be called after the synagogue was touched."""
+    if not hasattr(person, '_family_graph_state'):
+        return
+    state_before = person._family_graph_state
+    del person._family_graph_state
+    person_id = person.pk
+    _patch_on_commit(person.synagogue_id, state_before, lambda graph: graph.remove(person_id))
@@ -0,0 +1,226 @@
+"""
+Synthetic synagogues, for load tests and benchmarks.
+
+The people are generated as families several generations deep: founding couples, their children, and the spouses the
+children marry (who come from outside the synagogue), down to the children born until the day they are generated as
+of. The dates of birth and death include the after sunset flags and the dates whose anniversaries are irregular
+(30 Cheshvan, 30 Kislev and the Adars of leap years). The same seed and day always generate the same people, and the
+day is a fixed one unless another is given, so they don't change from one day to the next.
+
+The people get their primary keys up front, from a range after the largest existing one, so their family links can be
+set before they are inserted with bulk_create, which doesn't return the keys on every database.
+"""
+import random
+from datetime import date, timedelta
+from typing import List, Sequence, Tuple, TypeVar
+
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import Max
+
+from .family import drop_family_graph
+from .lib import hebrew_calendar
+from .lib.date_utils import hebrew_date_of
+from .lib.parasha_index import ParashaIndex
+from .models import Gender, Person, Synagogue, Yichus
+
+MALE_NAMES = ('Avraham', 'Yitzchak', 'Yaakov', 'Moshe', 'Aharon', 'David', 'Shlomo', 'Yosef', 'Reuven', 'Shimon',
+              'Levi', 'Yehuda', 'Binyamin', 'Eliyahu', 'Shmuel', 'Natan', 'Menachem', 'Chaim')
+FEMALE_NAMES = ('Sarah', 'Rivkah', 'Rachel', 'Leah', 'Miriam', 'Devorah', 'Esther', 'Chana', 'Yael', 'Tamar',
+                'Naomi', 'Ruth', 'Batsheva', 'Michal')
+LAST_NAMES = ('Cohen', 'Levi', 'Mizrahi', 'Peretz', 'Biton', 'Friedman', 'Katz', 'Shapira', 'Goldberg', 'Azulay',
+              'Dahan', 'Avraham', 'Ohayon', 'Weiss', 'Rosenberg', 'Ben David')
+
+YICHUS_WEIGHTS = ((Yichus.COHEN, 5), (Yichus.LEVI, 4), (Yichus.ISRAEL, 86), (None, 5))
+# how many children a couple has
+CHILDREN_WEIGHTS = ((0, 5), (1, 10), (2, 25), (3, 25), (4, 15), (5, 10), (6, 6), (7, 4))
+
+YEAR = 365
+# the years between the generations, and the range of the mothers' ages
+GENERATION_YEARS = 28
+MOTHER_AGES = (20, 42)
+MARRIAGE_AGE = 20
+MARRIAGE_RATE = 0.85
+# the share of the dates of birth and death after sunset, and on a date with an irregular anniversary
+AFTER_SUNSET_RATE = 0.1
+IRREGULAR_DATE_RATE = 0.05
+# the share of the living people who are members, and of the members who got an aliya in the last two years
+MEMBER_RATE = 0.85
+ALIYA_RATE = 0.7
+
+DEFAULT_BATCH_SIZE = 2000
+# the day the people are generated as of, unless another is given
+DEFAULT_TODAY = date(2020, 1, 1)
+
+T = TypeVar('T')
+
+
+class SynagogueGenerator:
+    def __init__(self, synagogue: Synagogue, seed: int = 0, generations: int = 4, today: date = DEFAULT_TODAY,
+                 first_pk: int = 1) -> None:
+        self.synagogue = synagogue
+        self.rng = random.Random(seed)
+        self.generations = generations
+        self.today = today
+        self.next_pk = first_pk
+        self.people: List[Person] = []
+
+    def _weighted(self, weights: Sequence[Tuple[T, int]]) -> T:
+        return self.rng.choices([value for value, weight in weights], [weight for value, weight in weights])[0]
+
+    def _day_between(self, first: int, last: int) -> Tuple[date, bool]:
+        """Return a date (and whether it was after sunset) on one of the days numbered first to last."""
+        day_number = self.rng.randint(first, last)
+        if self.rng.random() < IRREGULAR_DATE_RATE:
+            irregular = self._irregular_day(hebrew_calendar.from_day_number(day_number)[0])
+            if first <= irregular <= last:
+                day_number = irregular
+        if self.rng.random() < AFTER_SUNSET_RATE:
+            # the Hebrew date starts at sunset of the day before
+            return date.fromordinal(day_number - 1), True
+        return date.fromordinal(day_number), False
+
+    def _irregular_day(self, year: int) -> int:
+        """Return a day of the year whose anniversaries don't always fall on the same Hebrew date."""
+        days = [(month, 30) for month in (8, 9) if hebrew_calendar.month_length(year, month) == 30]
+        if hebrew_calendar.is_leap(year):
+            # 30 Adar Rishon, and any day of both Adars
+            days += [(12, 30), (12, self.rng.randint(1, 29)), (13, self.rng.randint(1, 29))]
+        if not days:
+            days = [(12, self.rng.randint(1, 29))]
+        return hebrew_calendar.to_day_number(year, *self.rng.choice(days))
+
+    def _person(self, gender: int, born_from: int, born_to: int, **kwargs: object) -> Person:
+        date_of_birth, after_sunset = self._day_between(born_from, born_to)
+        person = Person(pk=self.next_pk, synagogue=self.synagogue, gender=gender, date_of_birth=date_of_birth,
+                        date_of_birth_after_sunset=after_sunset,
+                        first_name=self.rng.choice(MALE_NAMES if gender == Gender.MALE else FEMALE_NAMES), **kwargs)
+        self.next_pk += 1
+        age = (self.today - date_of_birth).days / YEAR
+        # the older, the likelier to have died
+        if age > 60 and self.rng.random() < min((age - 60) / 40, 0.95):
+            person.date_of_death, person.date_of_death_after_sunset = self._day_between(
+                date_of_birth.toordinal() + 60 * YEAR, self.today.toordinal())
+        elif self.rng.random() < MEMBER_RATE:
+            person.is_member = True
+            if gender == Gender.MALE and age > 13:
+                if self.rng.random() < ALIYA_RATE:
+                    person.last_aliya_date = self.today - timedelta(days=self.rng.randrange(2 * YEAR))
+                person.cannot_get_aliya = self.rng.random() < 0.01
+                person.can_read_torah = self.rng.random() < 0.2
+                person.can_read_haftarah = self.rng.random() < 0.3
+                person.can_be_hazan = self.rng.random() < 0.1
+        self.people.append(person)
+        return person
+
+    def _spouse(self, person: Person) -> Person:
+        """Marry the person to someone from outside the synagogue's families, of about the same age."""
+        born = person.date_of_birth.toordinal()
+        if person.gender == Gender.MALE:
+            wife = self._person(Gender.FEMALE, born - 2 * YEAR, born + 5 * YEAR, last_name=person.last_name,
+                                maiden_name=self.rng.choice(LAST_NAMES), yichus=self._weighted(YICHUS_WEIGHTS))
+            person.wife_id = wife.pk
+            return wife
+        husband = self._person(Gender.MALE, born - 5 * YEAR, born + 2 * YEAR, last_name=self.rng.choice(LAST_NAMES),
+                               yichus=self._weighted(YICHUS_WEIGHTS), wife_id=person.pk)
+        person.maiden_name, person.last_name = person.last_name, husband.last_name
+        return husband
+
+    def _children(self, father: Person, mother: Person) -> List[Person]:
+        mother_born = mother.date_of_birth.toordinal()
+        first = mother_born + MOTHER_AGES[0] * YEAR
+        last = min(mother_born + MOTHER_AGES[1] * YEAR, self.today.toordinal())
+        if first > last:
+            return []
+        return [self._person(self.rng.choice((Gender.MALE, Gender.FEMALE)), first, last, last_name=father.last_name,
+                             yichus=father.yichus, father_id=father.pk, mother_id=mother.pk)
+                for i in range(self._weighted(CHILDREN_WEIGHTS))]
+
+    def _family(self) -> None:
+        """Add a founding couple and their descendants."""
+        today = self.today.toordinal()
+        founded = today - (self.generations * GENERATION_YEARS + MARRIAGE_AGE) * YEAR
+        couples = []
+        founder = self._person(Gender.MALE, founded - 10 * YEAR, founded, last_name=self.rng.choice(LAST_NAMES),
+                               yichus=self._weighted(YICHUS_WEIGHTS))
+        couples.append((founder, self._spouse(founder)))
+        for generation in range(self.generations):
+            children = []
+            for father, mother in couples:
+                children.extend(self._children(father, mother))
+            couples = []
+            for child in children:
+                if (self.today - child.date_of_birth).days > MARRIAGE_AGE * YEAR and self.rng.random() < MARRIAGE_RATE:
+                    spouse = self._spouse(child)
+                    couples.append((child, spouse) if child.gender == Gender.MALE else (spouse, child))
+
+    def generate(self, size: int) -> List[Person]:
+        """Generate families until there are the given number of people, and return them in the order of their keys."""
+        first_pk = self.next_pk
+        while len(self.people) < size:
+            self._family()
+        # the last family is cut short, along with the links to the people who were cut
+        del self.people[size:]
+        self.next_pk = end = first_pk + size
+        for person in self.people:
+            for link in ('father_id', 'mother_id', 'wife_id'):
+                if getattr(person, link) is not None and getattr(person, link) >= end:
+                    setattr(person, link, None)
+        self._set_bar_mitzvah_parashot()
+        for person in self.people:
+            # bulk_create doesn't call save()
+            person.update_derived_fields()
+        return self.people
+
+    def _set_bar_mitzvah_parashot(self) -> None:
+        """Set the parasha read on the Shabbat after the bar mitzvah of every living man."""
+        men = [person for person in self.people if person.gender == Gender.MALE and person.date_of_death is None]
+        bar_mitzvahs = []
+        for man in men:
+            year, month, day = hebrew_calendar.from_day_number(man.date_of_birth.toordinal() +
+                                                               man.date_of_birth_after_sunset)
+            key = hebrew_calendar.anniversary_key(year, month, day)
+            bar_mitzvahs.append(hebrew_calendar.to_day_number(*hebrew_calendar.anniversary_in_year(key, year + 13)))
+        if not men:
+            return
+        first_year = hebrew_calendar.from_day_number(min(bar_mitzvahs))[0]
+        last_year = hebrew_calendar.from_day_number(max(bar_mitzvahs))[0] + 1
+        index = ParashaIndex(first_year, last_year, self.synagogue.in_israel)
+        for man, bar_mitzvah in zip(men, bar_mitzvahs):
+            if bar_mitzvah > self.today.toordinal():
+                continue
+            shabbat = hebrew_calendar.shabbat_on_or_after(bar_mitzvah)
+            # on a holiday there is no parasha, and it is read the Shabbat after
+            parshiot = index.parshiot_on(hebrew_date_of(shabbat))
+            while parshiot is None and shabbat < bar_mitzvah + 4 * 7:
+                shabbat += 7
+                parshiot = index.parshiot_on(hebrew_date_of(shabbat))
+            if parshiot is not None:
+                man.bar_mitzvah_parasha = parshiot[0]
+
+
+def _reset_sequences() -> None:
+    # the keys were chosen explicitly, so the database's sequence (where it has one) is behind them
+    with connection.cursor() as cursor:
+        for sql in connection.ops.sequence_reset_sql(no_style(), [Person]):
+            cursor.execute(sql)
+
+
+def generate_people(synagogue: Synagogue, size: int, seed: int = 0, generations: int = 4,
+                    batch_size: int = DEFAULT_BATCH_SIZE, today: date = DEFAULT_TODAY) -> List[Person]:
+    """
+    Add the given number of generated people to the synagogue, and return them.
+
+    Nothing else should add people while they are generated, since their keys are allocated in advance.
+    """
+    with transaction.atomic():
+        first_pk = (Person.objects.aggregate(max_pk=Max('pk'))['max_pk'] or 0) + 1
+        people = SynagogueGenerator(synagogue, seed, generations, today, first_pk).generate(size)
+        # the foreign keys are only checked on commit, so the links may point at the later batches
+        for start in range(0, len(people), batch_size):
+            Person.objects.bulk_create(people[start:start + batch_size])
+        _reset_sequences()
+        # bulk_create doesn't send the signals which keep these up to date
+        Synagogue.touch(synagogue.pk)
+    drop_family_graph(synagogue.pk)
+    return people
@@ -0,0 +1,244 @@
+"""
+Bulk import of members from a legacy database export.
+
+The rows are streamed (from a CSV file or from a DB-API cursor) and inserted in batches, each in its own transaction,
+so the memory use doesn't depend on the size of the export. The people are inserted in a first pass, and their
+father, mother and wife links, which refer to other rows by their external id, are set in a second pass over the
+same rows. The progress is saved in a checkpoint file after every batch, so an interrupted import can be resumed.
+Once the links are set, the imported people's entries in the synagogue's aliya schedules are queued for recomputation.
+"""
+import csv
+import json
+import os
+from datetime import date
+from itertools import islice
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
+
+from django.db import models, transaction
+from django_enumfield.db.fields import EnumField
+
+from .family import drop_family_graph
+from .models import Person, Synagogue
+from .schedule import queue_aliya_schedule_updates
+
+Row = Dict[str, str]
+
+# the columns which refer to other rows by their external id
+LINK_COLUMNS = ('father', 'mother', 'wife')
+
+PEOPLE_PHASE = 'people'
+LINKS_PHASE = 'links'
+DONE_PHASE = 'done'
+
+DEFAULT_BATCH_SIZE = 1000
+
+# the values which the legacy database uses for true (Access uses -1)
+TRUE_VALUES = {'1', '-1', 'true', 't', 'yes', 'y'}
+
+
+def rows_from_csv(path: str) -> Iterator[Row]:
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        yield from csv.DictReader(f)
+
+
+def rows_from_cursor(cursor: Any, chunk_size: int = DEFAULT_BATCH_SIZE) -> Iterator[Row]:
+    """Stream the rows of an executed DB-API cursor, as dicts of the column names to their values as strings."""
+    columns = [column[0] for column in cursor.description]
+    while True:
+        chunk = cursor.fetchmany(chunk_size)
+        if not chunk:
+            return
+        for values in chunk:
+            yield {column: '' if value is None else str(value) for column, value in zip(columns, values)}
+
+
+def _parse_date(value: str) -> date:
+    # exports include a time of day, which is always midnight
+    return date.fromisoformat(value[:10])
+
+
+def _parse_bool(value: str) -> bool:
+    return value.strip().lower() in TRUE_VALUES
+
+
+def _field_parser(field: models.Field) -> Callable[[str], Any]:
+    if isinstance(field, EnumField):
+        enum = field.enum
+
+        def parse_enum(value: str) -> int:
+            if value.isdigit() and int(value) in enum.values:
+                return int(value)
+            if hasattr(enum, value.upper()):
+                return getattr(enum, value.upper())
+            raise ValueError('{!r} is not a {}'.format(value, enum.__name__))
+        return parse_enum
+    elif isinstance(field, models.DateField):
+        return _parse_date
+    elif isinstance(field, models.BooleanField):
+        return _parse_bool
+    elif isinstance(field, models.IntegerField):
+        return int
+    else:
+        return str
+
+
+class MemberImportError(Exception):
+    pass
+
+
+class MemberImporter:
+    """
+    Imports the rows of a members export into a synagogue.
+
+    Every row must have an external_id column (after renaming the columns with column_map), which identifies the
+    person so they can be linked to, and which must be unique in the synagogue. The only batch which may already have
+    been inserted is the first one of a resumed import (which was interrupted before saving its checkpoint). The father,
+    mother and wife columns are the external ids of the relatives, and the rest of the columns which are named like
+    Person fields are parsed according to the field's type. Other columns are ignored.
+    """
+
+    def __init__(self, synagogue: Synagogue, column_map: Optional[Dict[str, str]] = None,
+                 batch_size: int = DEFAULT_BATCH_SIZE, checkpoint_path: Optional[str] = None,
+                 progress: Optional[Callable[[str, int], None]] = None) -> None:
+        self.synagogue = synagogue
+        self.column_map = column_map or {}
+        self.batch_size = batch_size
+        self.checkpoint_path = checkpoint_path
+        self.progress = progress
+        self.checkpoint = self._load_checkpoint()
+        self.parsers = {field.name: _field_parser(field) for field in Person._meta.concrete_fields
+                        if field.editable and not field.is_relation and not field.primary_key}
+
+    def _load_checkpoint(self) -> Dict[str, Any]:
+        if self.checkpoint_path is not None and os.path.exists(self.checkpoint_path):
+            with open(self.checkpoint_path) as f:
+                checkpoint: Dict[str, Any] = json.load(f)
+            if checkpoint['synagogue'] != self.synagogue.pk:
+                raise MemberImportError('the checkpoint is of an import into another synagogue')
+            return checkpoint
+        return {'synagogue': self.synagogue.pk, 'phase': PEOPLE_PHASE, 'rows': 0}
+
+    def _save_checkpoint(self, phase: str, rows: int) -> None:
+        self.checkpoint.update(phase=phase, rows=rows)
+        if self.checkpoint_path is not None:
+            # written to a temporary file and renamed, so a crash doesn't leave a truncated checkpoint
+            with open(self.checkpoint_path + '.tmp', 'w') as f:
+                json.dump(self.checkpoint, f)
+            os.replace(self.checkpoint_path + '.tmp', self.checkpoint_path)
+
+    def _rename(self, row: Row) -> Row:
+        return {self.column_map.get(column, column): value for column, value in row.items()}
+
+    def _batches(self, rows: Iterable[Row], phase: str) -> Iterator[List[Row]]:
+        # skip the rows which were already done in this phase by an interrupted import
+        rows_done = self.checkpoint['rows'] if self.checkpoint['phase'] == phase else 0
+        rows = iter(rows)
+        for _ in islice(rows, rows_done):
+            pass
+        while True:
+            batch = [self._rename(row) for row in islice(rows, self.batch_size)]
+            if not batch:
+                return
+            yield batch
+            rows_done += len(batch)
+            self._save_checkpoint(phase, rows_done)
+            if self.progress is not None:
+                self.progress(phase, rows_done)
+
+    def _external_id(self, row: Row, line: int) -> str:
+        external_id = row.get('external_id', '').strip()
+        if not external_id:
+            raise MemberImportError('row {} has no external_id'.format(line))
+        return external_id
+
+    def _to_person(self, row: Row, line: int) -> Person:
+        person = Person(synagogue=self.synagogue, external_id=self._external_id(row, line))
+        for column, value in row.items():
+            parse = self.parsers.get(column)
+            if parse is None or value == '':
+                continue
+            try:
+                setattr(person, column, parse(value))
+            except ValueError as e:
+                raise MemberImportError('row {}, column {}: {}'.format(line, column, e))
+        # bulk_create doesn't call save()
+        person.update_derived_fields()
+        return person
+
+    def _new_people(self, people: List[Person], first_line: int, first_batch: bool) -> List[Person]:
+        """Return the people of a batch who weren't inserted yet, and fail on the duplicate external ids."""
+        lines: Dict[str, int] = {}
+        for line, person in enumerate(people, first_line):
+            if person.external_id in lines:
+                raise MemberImportError('rows {} and {} have the same external_id {}'.format(
+                    lines[person.external_id], line, person.external_id))
+            lines[person.external_id] = line
+        existing = set(Person.objects.filter(synagogue=self.synagogue, external_id__in=list(lines))
+                       .values_list('external_id', flat=True))
+        if first_batch and len(existing) == len(lines):
+            # inserted by the interrupted import
+            return []
+        if existing:
+            external_id = min(existing, key=lines.__getitem__)
+            raise MemberImportError('row {}: there is already a person with the external_id {}'.format(
+                lines[external_id], external_id))
+        return people
+
+    def import_people(self, rows: Iterable[Row]) -> None:
+        """The first pass, which inserts the people."""
+        if self.checkpoint['phase'] != PEOPLE_PHASE:
+            return
+        line = self.checkpoint['rows']
+        first_batch = True
+        for batch in self._batches(rows, PEOPLE_PHASE):
+            people = []
+            for row in batch:
+                line += 1
+                people.append(self._to_person(row, line))
+            people = self._new_people(people, line - len(batch) + 1, first_batch)
+            first_batch = False
+            with transaction.atomic():
+                Person.objects.bulk_create(people)
+                # nor the ones which change the synagogue's version, and every batch is seen by the clients
+                Synagogue.touch(self.synagogue.pk)
+        self._save_checkpoint(LINKS_PHASE, 0)
+        # bulk_create doesn't send the signals which keep the family graph up to date
+        drop_family_graph(self.synagogue.pk)
+
+    def link_family(self, rows: Iterable[Row]) -> None:
+        """The second pass, which sets the family links of the people inserted by the first one."""
+        if self.checkpoint['phase'] != LINKS_PHASE:
+            return
+        line = self.checkpoint['rows']
+        for batch in self._batches(rows, LINKS_PHASE):
+            first_line = line + 1
+            line += len(batch)
+            external_ids = [self._external_id(row, row_line) for row_line, row in enumerate(batch, first_line)]
+            # only the ids of the batch's people and of their relatives are kept in memory
+            wanted = set(external_ids)
+            wanted.update(row.get(column, '').strip() for row in batch for column in LINK_COLUMNS)
+            wanted.discard('')
+            ids = dict(Person.objects.filter(synagogue=self.synagogue, external_id__in=wanted)
+                       .values_list('external_id', 'pk'))
+            people = []
+            for row_line, (row, external_id) in enumerate(zip(batch, external_ids), first_line):
+                if external_id not in ids:
+                    raise MemberImportError('row {}: no person with the external id {}'.format(row_line, external_id))
+                if not any(row.get(column) for column in LINK_COLUMNS):
+                    continue
+                person = Person(pk=ids[external_id])
+                for column in LINK_COLUMNS:
+                    relative_id = row.get(column, '').strip()
+                    if relative_id and relative_id not in ids:
+                        raise MemberImportError('row {}, column {}: no person with the external id {}'.format(
+                            row_line, column, relative_id))
+                    setattr(person, column + '_id', ids.get(relative_id))
+                people.append(person)
+            with transaction.atomic():
+                Person.objects.bulk_update(people, LINK_COLUMNS)
+                Synagogue.touch(self.synagogue.pk)
+                # bulk_update doesn't send the signals which queue the changed people's aliya schedule entries, so
+                # the people of this import are queued here, with the batch which linked them
+                queue_aliya_schedule_updates(self.synagogue.pk, [ids[external_id] for external_id in external_ids])
+        self._save_checkpoint(DONE_PHASE, 0)
+        drop_family_graph(self.synagogue.pk)
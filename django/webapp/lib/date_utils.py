@@ -1,80 +1,182 @@
-from contextlib import suppress
+from array import array
+from collections import defaultdict
 from datetime import date
 from functools import lru_cache
-from itertools import chain
-from typing import Optional, NamedTuple, Dict
+from types import MappingProxyType
+from typing import Optional, NamedTuple, Dict, Tuple, Set, Iterable, Sequence, Mapping
 
 from pyluach.dates import HebrewDate
-from pyluach.hebrewcal import Month, Year, _adjust_postponed
-from pyluach.parshios import parshatable
+
+from . import hebrew_calendar
+from .hebrew_calendar import HebrewYMD, to_day_number, from_day_number, adjust_postponed
+from .timing import timed
+
+HebrewYMDArrays = Tuple['array[int]', 'array[int]', 'array[int]']
+
+# the julian day (as used by pyluach, starting at midnight) of day number 0 in hebrew_calendar
+_JULIAN_DAY_OF_DAY_NUMBER_ZERO = 1721424.5
+
+
+def day_number_of(hebrew_date: HebrewDate) -> int:
+    return int(hebrew_date.jd - _JULIAN_DAY_OF_DAY_NUMBER_ZERO)
+
+
+def hebrew_date_of(day_number: int, hebrew_ymd: Optional[HebrewYMD] = None) -> HebrewDate:
+    if hebrew_ymd is None:
+        hebrew_ymd = from_day_number(day_number)
+    # passing the julian day saves pyluach from calculating it again when comparing dates
+    return HebrewDate(*hebrew_ymd, jd=day_number + _JULIAN_DAY_OF_DAY_NUMBER_ZERO)
+
+
+def to_hebrew_ymd(gregorian_date: Optional[date], after_sunset: bool) -> Optional[HebrewYMD]:
+    if gregorian_date is None:
+        return None
+    return from_day_number(gregorian_date.toordinal() + (1 if after_sunset else 0))
 
 
 def to_hebrew_date(gregorian_date: Optional[date], after_sunset: bool) -> Optional[HebrewDate]:
     if gregorian_date is None:
         return None
-    hebrew_date = HebrewDate.from_pydate(gregorian_date)
+    day_number = gregorian_date.toordinal()
     if after_sunset:
-        hebrew_date += 1
-    return hebrew_date
+        day_number += 1
+    return hebrew_date_of(day_number)
+
+
+# the length of each month in the longest year it can have, starting with Nissan as 1 (and Tishrei as 7)
+MAX_MONTH_LENGTHS = {1: 30, 2: 29, 3: 30, 4: 29, 5: 30, 6: 29, 7: 30, 8: 30, 9: 30, 10: 29, 11: 30, 12: 30, 13: 29}
+
+
+def anniversary_key(original_date: HebrewDate) -> int:
+    return hebrew_calendar.anniversary_key(original_date.year, original_date.month, original_date.day)
+
+
+def anniversary_in_year(key: int, year: int) -> HebrewDate:
+    hebrew_ymd = hebrew_calendar.anniversary_in_year(key, year)
+    return hebrew_date_of(to_day_number(*hebrew_ymd), hebrew_ymd)
 
 
 def nth_anniversary_of(original_date: HebrewDate, number_of_years: int) -> HebrewDate:
-    original_year = Year(original_date.year)
-    anniversary_year = Year(original_date.year + number_of_years)
-    anniversary_month = None
-    if not original_year.leap and anniversary_year.leap:
-        if original_date.month == 12:
-            # the original date was in Adar in a regular year, so the
-            # anniversary is in Adar Sheni in a leap year
-            anniversary_month = Month(anniversary_year.year, 13)
-    elif original_year.leap and not anniversary_year.leap:
-        if original_date.month == 13:
-            # the original date was in Adar Sheni in a leap year, so the
-            # anniversary is in Adar in a regular year
-            anniversary_month = Month(anniversary_year.year, 12)
-    if anniversary_month is None:
-        # otherwise, use the same month as in the original year
-        anniversary_month = Month(anniversary_year.year, original_date.month)
-
-    if original_date.day > len(anniversary_month):
-        # the original date doesn't exist in the anniversary year (either 30
-        # Cheshvan, 30 Kislev, or 30 Adar Rishon if the anniversary year is not
-        # a leap year), so we go to the first day of the next month
-        if anniversary_month.month == 12:
-            # the anniversary of 30 Adar Rishon in a non-leap year is the
-            # 1st of Nissan
-            return HebrewDate(anniversary_month.year, 1, 1)
-        else:
-            return HebrewDate(anniversary_month.year,
-                              anniversary_month.month + 1, 1)
-    else:
-        return HebrewDate(anniversary_month.year, anniversary_month.month,
-                          original_date.day)
+    return anniversary_in_year(anniversary_key(original_date), original_date.year + number_of_years)
+
+
+def nth_gregorian_anniversary_of(gregorian_date: Optional[date], after_sunset: bool,
+                                 number_of_years: int) -> Optional[date]:
+    """Like nth_anniversary_of, for a Gregorian date (and sunset flag), returning the day of the Hebrew anniversary."""
+    hebrew_ymd = to_hebrew_ymd(gregorian_date, after_sunset)
+    if hebrew_ymd is None:
+        return None
+    year, month, day = hebrew_ymd
+    key = hebrew_calendar.anniversary_key(year, month, day)
+    return date.fromordinal(to_day_number(*hebrew_calendar.anniversary_in_year(key, year + number_of_years)))
+
 
+@lru_cache(50)
+def _anniversary_keys_by_day_number(year: int) -> Dict[int, Tuple[int, ...]]:
+    keys_by_day_number: Dict[int, Tuple[int, ...]] = defaultdict(tuple)
+    for month, max_length in MAX_MONTH_LENGTHS.items():
+        for day in range(1, max_length + 1):
+            key = month * 100 + day
+            keys_by_day_number[to_day_number(*hebrew_calendar.anniversary_in_year(key, year))] += (key,)
+    return dict(keys_by_day_number)
+
+
+def anniversary_keys_between(start: HebrewDate, end: HebrewDate) -> Dict[int, Set[int]]:
+    """
+    Return the anniversary keys of all the dates whose anniversary falls between start and end (inclusive).
+
+    The keys are grouped by the Hebrew year of the anniversary, since only dates from earlier years have an
+    anniversary in that year.
+    """
+    keys_by_year: Dict[int, Set[int]] = defaultdict(set)
+    for day_number in range(day_number_of(start), day_number_of(end) + 1):
+        year = from_day_number(day_number)[0]
+        keys_by_year[year].update(_anniversary_keys_by_day_number(year).get(day_number, ()))
+    return dict(keys_by_year)
+
+
+def has_anniversary_in(original_date: HebrewYMD, keys_by_year: Dict[int, Set[int]]) -> bool:
+    """Return whether the original date has an anniversary on one of the dates given by anniversary_keys_between."""
+    key = hebrew_calendar.anniversary_key(*original_date)
+    return any(year > original_date[0] and key in keys for year, keys in keys_by_year.items())
 
+
+@timed('next_anniversary_of')
 def next_anniversary_of(original_date: HebrewDate, reference_date: Optional[HebrewDate] = None) -> HebrewDate:
     if reference_date is None:
         reference_date = HebrewDate.today()
     if not reference_date > original_date:
         raise ValueError('reference date must be after original date')
-    years_ago = reference_date.year - original_date.year
-    next_anniversary = nth_anniversary_of(original_date, years_ago)
-    if next_anniversary < reference_date:
-        # this is a lot easier than trying to figure out if the N is years_ago
-        # or years_ago + 1, because of the leap year edge cases
-        next_anniversary = nth_anniversary_of(original_date, years_ago + 1)
-    return next_anniversary
+    original_ymd = (original_date.year, original_date.month, original_date.day)
+    return hebrew_date_of(hebrew_calendar.next_anniversary(original_ymd, day_number_of(reference_date)))
+
+
+def _hebrew_ymd_arrays(hebrew_ymds: Iterable[HebrewYMD]) -> HebrewYMDArrays:
+    years, months, days = array('i'), array('i'), array('i')
+    for year, month, day in hebrew_ymds:
+        years.append(year)
+        months.append(month)
+        days.append(day)
+    return years, months, days
+
+
+def nth_anniversaries_of(years: Sequence[int], months: Sequence[int], days: Sequence[int],
+                         number_of_years: int) -> HebrewYMDArrays:
+    """
+    Like nth_anniversary_of, for many dates given as parallel sequences of Hebrew years, months and days.
+
+    Any sequence of ints will do, such as array.array or a NumPy array. The anniversaries are returned as three
+    array.array('i') of years, months and days. Each distinct (anniversary key, year) is only computed once.
+    """
+    anniversaries: Dict[Tuple[int, int], HebrewYMD] = {}
+
+    def anniversary(year: int, month: int, day: int) -> HebrewYMD:
+        key = (hebrew_calendar.anniversary_key(year, month, day), year + number_of_years)
+        if key not in anniversaries:
+            anniversaries[key] = hebrew_calendar.anniversary_in_year(*key)
+        return anniversaries[key]
+
+    return _hebrew_ymd_arrays(anniversary(int(year), int(month), int(day)) for year, month, day in
+                              zip(years, months, days))
+
+
+def next_anniversaries_of(years: Sequence[int], months: Sequence[int], days: Sequence[int],
+                          reference_date: Optional[HebrewDate] = None) -> HebrewYMDArrays:
+    """
+    Like next_anniversary_of, for many dates given as parallel sequences of Hebrew years, months and days.
+
+    Any sequence of ints will do, such as array.array or a NumPy array. The anniversaries are returned as three
+    array.array('i') of years, months and days. Since there is one reference date, the anniversary of each key is
+    only computed once for its year and the following one.
+    """
+    if reference_date is None:
+        reference_date = HebrewDate.today()
+    reference_day_number = day_number_of(reference_date)
+    reference_year = reference_date.year
+    anniversaries: Dict[int, HebrewYMD] = {}
+
+    def anniversary(year: int, month: int, day: int) -> HebrewYMD:
+        if not reference_day_number > to_day_number(year, month, day):
+            raise ValueError('reference date must be after original date')
+        key = hebrew_calendar.anniversary_key(year, month, day)
+        if key not in anniversaries:
+            next_anniversary = hebrew_calendar.anniversary_in_year(key, reference_year)
+            if to_day_number(*next_anniversary) < reference_day_number:
+                next_anniversary = hebrew_calendar.anniversary_in_year(key, reference_year + 1)
+            anniversaries[key] = next_anniversary
+        return anniversaries[key]
+
+    return _hebrew_ymd_arrays(anniversary(int(year), int(month), int(day)) for year, month, day in
+                              zip(years, months, days))
 
 
 def next_reading_of_parasha(parasha_number: int, reference_date: Optional[HebrewDate] = None,
-                            israel: bool = True) -> HebrewDate:
+                            israel: bool = True) -> Optional[HebrewDate]:
+    # imported here since the index is built on top of this module
+    from .parasha_index import get_parasha_index
     if reference_date is None:
         reference_date = HebrewDate.today()
-    this_year_table = parshatable(reference_date.year, israel=israel)
-    next_year_table = parshatable(reference_date.year + 1, israel=israel)
-    for shabbat_date, parasha_numbers in chain(this_year_table.items(), next_year_table.items()):
-        if shabbat_date >= reference_date and parasha_numbers is not None and parasha_number in parasha_numbers:
-            return shabbat_date
+    return get_parasha_index(israel, reference_date.year).next_reading(parasha_number, reference_date)
 
 
 class TorahReadingOccasion(NamedTuple):
@@ -88,75 +190,79 @@ class TorahReadingOccasion(NamedTuple):
         return self.shacharit_aliyot >= 5
 
 
+@timed('make_torah_reading_occasions_table')
 @lru_cache(50)
-def make_torah_reading_occasions_table(year: int, israel: bool, jerusalem: bool) -> Dict[HebrewDate,
-                                                                                         TorahReadingOccasion]:
-    table = {}
+def make_torah_reading_occasions_table(year: int, israel: bool, jerusalem: bool) -> Mapping[HebrewDate,
+                                                                                            TorahReadingOccasion]:
+    # the table is cached and shared by all callers, so it is read-only
+    table: Dict[int, TorahReadingOccasion] = {}
+
+    def day(month: int, day_of_month: int) -> int:
+        return to_day_number(year, month, day_of_month)
 
     # holidays
-    table[HebrewDate(year, 7, 1)] = TorahReadingOccasion('Rosh Hashana', 5)
-    table[HebrewDate(year, 7, 2)] = TorahReadingOccasion('Rosh Hashana', 5)
-    table[HebrewDate(year, 7, 10)] = TorahReadingOccasion('Yom Kippur', 6, 3)
-    table[HebrewDate(year, 7, 15)] = TorahReadingOccasion('Sukkot', 5)
+    table[day(7, 1)] = TorahReadingOccasion('Rosh Hashana', 5)
+    table[day(7, 2)] = TorahReadingOccasion('Rosh Hashana', 5)
+    table[day(7, 10)] = TorahReadingOccasion('Yom Kippur', 6, 3)
+    table[day(7, 15)] = TorahReadingOccasion('Sukkot', 5)
     if israel:
-        table[HebrewDate(year, 7, 16)] = TorahReadingOccasion('Chol Hamoed Sukkot', 4)
+        table[day(7, 16)] = TorahReadingOccasion('Chol Hamoed Sukkot', 4)
     else:
-        table[HebrewDate(year, 7, 16)] = TorahReadingOccasion('Sukkot', 5)
-    table[HebrewDate(year, 7, 17)] = TorahReadingOccasion('Chol Hamoed Sukkot', 4)
-    table[HebrewDate(year, 7, 18)] = TorahReadingOccasion('Chol Hamoed Sukkot', 4)
-    table[HebrewDate(year, 7, 19)] = TorahReadingOccasion('Chol Hamoed Sukkot', 4)
-    table[HebrewDate(year, 7, 20)] = TorahReadingOccasion('Chol Hamoed Sukkot', 4)
-    table[HebrewDate(year, 7, 21)] = TorahReadingOccasion('Chol Hamoed Sukkot', 4)
-    table[HebrewDate(year, 7, 22)] = TorahReadingOccasion('Shmini Atzeret', 5)
+        table[day(7, 16)] = TorahReadingOccasion('Sukkot', 5)
+    table[day(7, 17)] = TorahReadingOccasion('Chol Hamoed Sukkot', 4)
+    table[day(7, 18)] = TorahReadingOccasion('Chol Hamoed Sukkot', 4)
+    table[day(7, 19)] = TorahReadingOccasion('Chol Hamoed Sukkot', 4)
+    table[day(7, 20)] = TorahReadingOccasion('Chol Hamoed Sukkot', 4)
+    table[day(7, 21)] = TorahReadingOccasion('Chol Hamoed Sukkot', 4)
+    table[day(7, 22)] = TorahReadingOccasion('Shmini Atzeret', 5)
     if not israel:
-        table[HebrewDate(year, 7, 23)] = TorahReadingOccasion('Simchat Torah', 5)
+        table[day(7, 23)] = TorahReadingOccasion('Simchat Torah', 5)
 
-    for day in (HebrewDate(year, 9, 25) + i for i in range(8)):
-        table[day] = TorahReadingOccasion('Chanukah', 3)
+    for day_number in range(day(9, 25), day(9, 25) + 8):
+        table[day_number] = TorahReadingOccasion('Chanukah', 3)
 
-    purim_month = 13 if Year(year).leap else 12
+    purim_month = 13 if hebrew_calendar.is_leap(year) else 12
     purim_date = HebrewDate(year, purim_month, 15 if jerusalem else 14)
     if not purim_date.shabbos():
-        table[purim_date] = TorahReadingOccasion('Shushan Purim' if jerusalem else 'Purim', 3)
+        table[day_number_of(purim_date)] = TorahReadingOccasion('Shushan Purim' if jerusalem else 'Purim', 3)
 
-    table[HebrewDate(year, 1, 15)] = TorahReadingOccasion('Pesach', 5)
+    table[day(1, 15)] = TorahReadingOccasion('Pesach', 5)
     if israel:
-        table[HebrewDate(year, 1, 16)] = TorahReadingOccasion('Chol Hamoed Pesach', 4)
+        table[day(1, 16)] = TorahReadingOccasion('Chol Hamoed Pesach', 4)
     else:
-        table[HebrewDate(year, 1, 16)] = TorahReadingOccasion('Pesach', 5)
-    table[HebrewDate(year, 1, 17)] = TorahReadingOccasion('Chol Hamoed Pesach', 4)
-    table[HebrewDate(year, 1, 18)] = TorahReadingOccasion('Chol Hamoed Pesach', 4)
-    table[HebrewDate(year, 1, 19)] = TorahReadingOccasion('Chol Hamoed Pesach', 4)
-    table[HebrewDate(year, 1, 20)] = TorahReadingOccasion('Chol Hamoed Pesach', 4)
-    table[HebrewDate(year, 1, 21)] = TorahReadingOccasion('Pesach', 5)
+        table[day(1, 16)] = TorahReadingOccasion('Pesach', 5)
+    table[day(1, 17)] = TorahReadingOccasion('Chol Hamoed Pesach', 4)
+    table[day(1, 18)] = TorahReadingOccasion('Chol Hamoed Pesach', 4)
+    table[day(1, 19)] = TorahReadingOccasion('Chol Hamoed Pesach', 4)
+    table[day(1, 20)] = TorahReadingOccasion('Chol Hamoed Pesach', 4)
+    table[day(1, 21)] = TorahReadingOccasion('Pesach', 5)
     if not israel:
-        table[HebrewDate(year, 1, 22)] = TorahReadingOccasion('Pesach', 5)
+        table[day(1, 22)] = TorahReadingOccasion('Pesach', 5)
 
-    table[HebrewDate(year, 3, 6)] = TorahReadingOccasion('Shavuot', 5)
+    table[day(3, 6)] = TorahReadingOccasion('Shavuot', 5)
     if not israel:
-        table[HebrewDate(year, 3, 7)] = TorahReadingOccasion('Shavuot', 5)
+        table[day(3, 7)] = TorahReadingOccasion('Shavuot', 5)
 
     # rosh chodesh (overrides other occasions)
+    months = hebrew_calendar.months_of_year(year)
     for month in range(1, 14):
-        if month == 7:
-            # Rosh Hashana
+        if month == 7 or month not in months:
+            # Rosh Hashana, or Adar Sheni in a regular year
             continue
-        with suppress(ValueError):
-            table[HebrewDate(year, month, 1)] = TorahReadingOccasion('Rosh Chodesh', 4)
-        with suppress(ValueError):
-            table[HebrewDate(year, month, 30)] = TorahReadingOccasion('Rosh Chodesh', 4)
+        table[day(month, 1)] = TorahReadingOccasion('Rosh Chodesh', 4)
+        if hebrew_calendar.month_length(year, month) == 30:
+            table[day(month, 30)] = TorahReadingOccasion('Rosh Chodesh', 4)
 
     # shabbat (overrides other occasions)
-    shabbat = HebrewDate(year, 7, 1).shabbos()
-    while shabbat.year == year:
+    next_year_start = hebrew_calendar.year_start(year + 1)
+    for shabbat in range(hebrew_calendar.shabbat_on_or_after(day(7, 1)), next_year_start, 7):
         table[shabbat] = TorahReadingOccasion('Shabbat', 7, 3)
-        shabbat += 7
 
     # fast days
-    table[_adjust_postponed(HebrewDate(year, 7, 3))] = TorahReadingOccasion('Tzom Gedalia', 3, 3)
-    table[_adjust_postponed(HebrewDate(year, 10, 10))] = TorahReadingOccasion('10 of Tevet', 3, 3)
-    table[_adjust_postponed(HebrewDate(year, purim_month, 13))] = TorahReadingOccasion('Taanit Esther', 3, 3)
-    table[_adjust_postponed(HebrewDate(year, 4, 17))] = TorahReadingOccasion('17 of Tamuz', 3, 3)
-    table[_adjust_postponed(HebrewDate(year, 5, 9))] = TorahReadingOccasion('9 of Av', 3, 3)
+    table[adjust_postponed(day(7, 3), 7)] = TorahReadingOccasion('Tzom Gedalia', 3, 3)
+    table[adjust_postponed(day(10, 10), 10)] = TorahReadingOccasion('10 of Tevet', 3, 3)
+    table[adjust_postponed(day(purim_month, 13), purim_month)] = TorahReadingOccasion('Taanit Esther', 3, 3)
+    table[adjust_postponed(day(4, 17), 4)] = TorahReadingOccasion('17 of Tamuz', 3, 3)
+    table[adjust_postponed(day(5, 9), 5)] = TorahReadingOccasion('9 of Av', 3, 3)
 
-    return table
+    return MappingProxyType({hebrew_date_of(day_number): occasion for day_number, occasion in table.items()})
@@ -0,0 +1,189 @@
+"""
+A compact Hebrew calendar working on integer day numbers.
+
+Day numbers are proleptic Gregorian ordinals (as returned by date.toordinal()), so converting to and from python
+dates is free, and the day of the week is just the day number modulo 7. The first day of every year in a wide range
+is computed once and kept in an array, which gives the length and leap status of the year without re-running the
+molad calculation. The results are the same as pyluach's, which is what the rest of the code uses for its API.
+"""
+from array import array
+from bisect import bisect_right
+from functools import lru_cache
+from typing import NamedTuple, Tuple
+
+HebrewYMD = Tuple[int, int, int]
+
+# the day number of 1 Tishrei of a year is the number of days elapsed until it (as computed by _elapsed_days) plus
+# this offset
+_EPOCH = -1373428
+
+# years outside of this range are computed on demand instead of being read from the array
+FIRST_CACHED_YEAR = 5000
+LAST_CACHED_YEAR = 6500
+
+_REGULAR_YEAR_MONTHS = (7, 8, 9, 10, 11, 12, 1, 2, 3, 4, 5, 6)
+_LEAP_YEAR_MONTHS = (7, 8, 9, 10, 11, 12, 13, 1, 2, 3, 4, 5, 6)
+
+SHABBAT = 7
+
+
+def is_leap(year: int) -> bool:
+    return (7 * year + 1) % 19 < 7
+
+
+def _elapsed_days(year: int) -> int:
+    # the molad of Tishrei and the postponements (dechiyot), as in pyluach
+    months_elapsed = 235 * ((year - 1) // 19) + 12 * ((year - 1) % 19) + (7 * ((year - 1) % 19) + 1) // 19
+    parts_elapsed = 204 + 793 * (months_elapsed % 1080)
+    hours_elapsed = 5 + 12 * months_elapsed + 793 * (months_elapsed // 1080) + parts_elapsed // 1080
+    conjunction_day = 1 + 29 * months_elapsed + hours_elapsed // 24
+    conjunction_parts = 1080 * (hours_elapsed % 24) + parts_elapsed % 1080
+
+    if (conjunction_parts >= 19440 or
+            (conjunction_day % 7 == 2 and conjunction_parts >= 9924 and not is_leap(year)) or
+            (conjunction_day % 7 == 1 and conjunction_parts >= 16789 and is_leap(year - 1))):
+        conjunction_day += 1
+    if conjunction_day % 7 in (0, 3, 5):
+        conjunction_day += 1
+    return conjunction_day
+
+
+_YEAR_STARTS = array('l', (_EPOCH + _elapsed_days(year) for year in range(FIRST_CACHED_YEAR, LAST_CACHED_YEAR + 2)))
+
+
+def year_start(year: int) -> int:
+    """Return the day number of 1 Tishrei of the given year."""
+    if FIRST_CACHED_YEAR <= year <= LAST_CACHED_YEAR + 1:
+        return _YEAR_STARTS[year - FIRST_CACHED_YEAR]
+    return _EPOCH + _elapsed_days(year)
+
+
+def year_length(year: int) -> int:
+    return year_start(year + 1) - year_start(year)
+
+
+def months_of_year(year: int) -> Tuple[int, ...]:
+    """Return the months of the year in order, starting with Tishrei."""
+    return _LEAP_YEAR_MONTHS if is_leap(year) else _REGULAR_YEAR_MONTHS
+
+
+def _month_length(year: int, month: int) -> int:
+    if month in (1, 3, 5, 7, 11):
+        return 30
+    elif month in (2, 4, 6, 10, 13):
+        return 29
+    elif month == 12:
+        return 30 if is_leap(year) else 29
+    elif month == 8:
+        # Cheshvan has 30 days in a complete year
+        return 30 if year_length(year) % 10 == 5 else 29
+    else:
+        # Kislev has 29 days in a deficient year
+        return 29 if year_length(year) % 10 == 3 else 30
+
+
+class _YearTable(NamedTuple):
+    # indexed by month number (Nissan is 1 and Tishrei is 7), with 0 for Adar Sheni in a regular year
+    month_starts: Tuple[int, ...]
+    month_lengths: Tuple[int, ...]
+    # the months of the year in order starting with Tishrei, and the day numbers on which they start
+    months: Tuple[int, ...]
+    ordered_month_starts: Tuple[int, ...]
+
+
+@lru_cache(maxsize=None)
+def _year_table(year: int) -> _YearTable:
+    months = months_of_year(year)
+    month_starts = [0] * 14
+    month_lengths = [0] * 14
+    day_number = year_start(year)
+    for month in months:
+        month_starts[month] = day_number
+        month_lengths[month] = _month_length(year, month)
+        day_number += month_lengths[month]
+    return _YearTable(tuple(month_starts), tuple(month_lengths), months, tuple(month_starts[m] for m in months))
+
+
+def month_length(year: int, month: int) -> int:
+    """Months start with Nissan (Nissan is 1 and Tishrei is 7)"""
+    return _year_table(year).month_lengths[month]
+
+
+def to_day_number(year: int, month: int, day: int) -> int:
+    return _year_table(year).month_starts[month] + day - 1
+
+
+def from_day_number(day_number: int) -> HebrewYMD:
+    # 19 years (a full leap year cycle) are almost exactly 6940 days, so the estimate is off by a year at most
+    year = (day_number - _EPOCH) * 19 // 6940 + 1
+    while year_start(year) > day_number:
+        year -= 1
+    while year_start(year + 1) <= day_number:
+        year += 1
+    table = _year_table(year)
+    index = bisect_right(table.ordered_month_starts, day_number) - 1
+    return year, table.months[index], day_number - table.ordered_month_starts[index] + 1
+
+
+def weekday(day_number: int) -> int:
+    """Return the day of the week, starting with Sunday as 1 through Shabbat as 7 (like pyluach)."""
+    return day_number % 7 + 1
+
+
+def shabbat_on_or_after(day_number: int) -> int:
+    return day_number + SHABBAT - weekday(day_number)
+
+
+def adjust_postponed(day_number: int, month: int) -> int:
+    """Return the day on which a fast that falls on the given day is actually observed."""
+    if weekday(day_number) == SHABBAT:
+        if month in (12, 13):
+            # Taanit Esther is moved to the Thursday before
+            return day_number - 2
+        else:
+            return day_number + 1
+    return day_number
+
+
+def anniversary_key(year: int, month: int, day: int) -> int:
+    """
+    Return an integer identifying the dates on which the anniversaries of the given date fall.
+
+    The key is month * 100 + day. Adar in a regular year is keyed as Adar Sheni (13), since their anniversaries
+    always fall on the same dates, which leaves 12 to mean Adar Rishon in a leap year.
+    """
+    if month == 12 and not is_leap(year):
+        month = 13
+    return month * 100 + day
+
+
+def anniversary_in_year(key: int, year: int) -> HebrewYMD:
+    month, day = divmod(key, 100)
+    if month == 13 and not is_leap(year):
+        # the original date was in Adar Sheni in a leap year (or in Adar in a regular year), so the anniversary
+        # is in Adar in a regular year (and in Adar Sheni in a leap year)
+        month = 12
+    # otherwise, use the same month as in the original year
+
+    if day > month_length(year, month):
+        # the original date doesn't exist in the anniversary year (either 30
+        # Cheshvan, 30 Kislev, or 30 Adar Rishon if the anniversary year is not
+        # a leap year), so we go to the first day of the next month
+        if month == 12:
+            # the anniversary of 30 Adar Rishon in a non-leap year is the
+            # 1st of Nissan
+            return year, 1, 1
+        else:
+            return year, month + 1, 1
+    else:
+        return year, month, day
+
+
+def next_anniversary(original_date: HebrewYMD, reference_day_number: int) -> int:
+    """Return the day number of the first anniversary of the original date on or after the reference day."""
+    key = anniversary_key(*original_date)
+    reference_year = from_day_number(reference_day_number)[0]
+    next_anniversary_day_number = to_day_number(*anniversary_in_year(key, reference_year))
+    if next_anniversary_day_number < reference_day_number:
+        next_anniversary_day_number = to_day_number(*anniversary_in_year(key, reference_year + 1))
+    return next_anniversary_day_number
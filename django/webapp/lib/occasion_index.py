@@ -0,0 +1,164 @@
+import json
+from array import array
+from bisect import bisect_left, bisect_right
+from operator import itemgetter
+from types import MappingProxyType
+from typing import Dict, List, Mapping, Optional, Tuple
+
+from pyluach.dates import HebrewDate
+
+from . import hebrew_calendar
+from .date_utils import TorahReadingOccasion, make_torah_reading_occasions_table, day_number_of, hebrew_date_of
+
+DatedOccasion = Tuple[HebrewDate, TorahReadingOccasion]
+
+# how many years around a requested year are indexed when the index has to be built on demand
+DEFAULT_YEARS_BEFORE = 10
+DEFAULT_YEARS_AFTER = 20
+
+
+class TorahReadingOccasionIndex:
+    """
+    A read-only, sorted index of the Torah reading occasions over a range of Hebrew years.
+
+    The occasions are kept sorted by day number, so range and next-occasion queries are a binary search. An index can
+    be serialized to a JSON file and loaded back, so it doesn't have to be recomputed by every process. The occasions
+    of the years outside of the range are computed when they are queried, rather than kept.
+    """
+
+    __slots__ = ('first_year', 'last_year', 'israel', 'jerusalem', '_day_numbers', '_occasions', '_tables')
+
+    def __init__(self, first_year: int, last_year: int, israel: bool, jerusalem: bool,
+                 occasions: List[Tuple[int, TorahReadingOccasion]]) -> None:
+        self.first_year = first_year
+        self.last_year = last_year
+        self.israel = israel
+        self.jerusalem = jerusalem
+        occasions = sorted(occasions)
+        self._day_numbers = array('l', (day_number for day_number, _ in occasions))
+        self._occasions = tuple(occasion for _, occasion in occasions)
+        self._tables: Dict[int, Mapping[HebrewDate, TorahReadingOccasion]] = {}
+
+    @classmethod
+    def build(cls, first_year: int, last_year: int, israel: bool, jerusalem: bool) -> 'TorahReadingOccasionIndex':
+        occasions = []
+        for year in range(first_year, last_year + 1):
+            for day, occasion in make_torah_reading_occasions_table(year, israel, jerusalem).items():
+                occasions.append((day_number_of(day), occasion))
+        return cls(first_year, last_year, israel, jerusalem, occasions)
+
+    def covers(self, year: int) -> bool:
+        return self.first_year <= year <= self.last_year
+
+    def _occasions_in_range(self, start: int, end: int) -> List[DatedOccasion]:
+        # day numbers are in [start, end)
+        first = bisect_left(self._day_numbers, start)
+        last = bisect_left(self._day_numbers, end)
+        return [(hebrew_date_of(self._day_numbers[i]), self._occasions[i]) for i in range(first, last)]
+
+    def _computed_occasions(self, year: int, start: int, end: int) -> List[DatedOccasion]:
+        # for a year outside of the index, computed like it was built; day numbers are in [start, end)
+        table = make_torah_reading_occasions_table(year, self.israel, self.jerusalem)
+        return sorted(((day, occasion) for day, occasion in table.items() if start <= day_number_of(day) < end),
+                      key=itemgetter(0))
+
+    def occasions_between(self, start: HebrewDate, end: HebrewDate) -> List[DatedOccasion]:
+        """Return the occasions from start to end (inclusive), in order."""
+        start_day, end_day = day_number_of(start), day_number_of(end) + 1
+        occasions = []
+        for year in range(start.year, min(end.year, self.first_year - 1) + 1):
+            occasions.extend(self._computed_occasions(year, start_day, end_day))
+        occasions.extend(self._occasions_in_range(start_day, end_day))
+        for year in range(max(start.year, self.last_year + 1), end.year + 1):
+            occasions.extend(self._computed_occasions(year, start_day, end_day))
+        return occasions
+
+    def next_occasion(self, after_date: HebrewDate) -> DatedOccasion:
+        """Return the first occasion after the given date."""
+        after_day = day_number_of(after_date)
+        for year in range(after_date.year, self.first_year):
+            occasions = self._computed_occasions(year, after_day + 1, hebrew_calendar.year_start(year + 1))
+            if occasions:
+                return occasions[0]
+        i = bisect_right(self._day_numbers, after_day)
+        if i < len(self._day_numbers):
+            return hebrew_date_of(self._day_numbers[i]), self._occasions[i]
+        # past the end of the index; every year has occasions, so at most the next one is searched too
+        year = max(after_date.year, self.last_year + 1)
+        while True:
+            occasions = self._computed_occasions(year, after_day + 1, hebrew_calendar.year_start(year + 1))
+            if occasions:
+                return occasions[0]
+            year += 1
+
+    def table_for_year(self, year: int) -> Mapping[HebrewDate, TorahReadingOccasion]:
+        """Return a read-only mapping of the occasions in the year, like make_torah_reading_occasions_table."""
+        if year not in self._tables:
+            start, end = hebrew_calendar.year_start(year), hebrew_calendar.year_start(year + 1)
+            if not self.covers(year):
+                # not kept, since make_torah_reading_occasions_table caches the recently used years itself
+                return MappingProxyType(dict(self._computed_occasions(year, start, end)))
+            self._tables[year] = MappingProxyType(dict(self._occasions_in_range(start, end)))
+        return self._tables[year]
+
+    def to_json(self) -> Dict:
+        return {
+            'first_year': self.first_year,
+            'last_year': self.last_year,
+            'israel': self.israel,
+            'jerusalem': self.jerusalem,
+            'occasions': [[day_number, occasion.description, occasion.shacharit_aliyot, occasion.mincha_aliyot]
+                          for day_number, occasion in zip(self._day_numbers, self._occasions)],
+        }
+
+    @classmethod
+    def from_json(cls, data: Dict) -> 'TorahReadingOccasionIndex':
+        occasions = [(day_number, TorahReadingOccasion(description, shacharit_aliyot, mincha_aliyot))
+                     for day_number, description, shacharit_aliyot, mincha_aliyot in data['occasions']]
+        return cls(data['first_year'], data['last_year'], data['israel'], data['jerusalem'], occasions)
+
+
+_indexes: Dict[Tuple[bool, bool], TorahReadingOccasionIndex] = {}
+
+
+def install_occasion_index(index: TorahReadingOccasionIndex) -> None:
+    _indexes[(index.israel, index.jerusalem)] = index
+
+
+def get_occasion_index(israel: bool, jerusalem: bool, year: Optional[int] = None) -> TorahReadingOccasionIndex:
+    """
+    Return the installed index for the given customs, building one if there is none or it doesn't cover the year.
+    """
+    index = _indexes.get((israel, jerusalem))
+    if year is None:
+        year = HebrewDate.today().year
+    if index is None or not index.covers(year):
+        first_year = year - DEFAULT_YEARS_BEFORE
+        last_year = year + DEFAULT_YEARS_AFTER
+        if index is not None:
+            first_year = min(first_year, index.first_year)
+            last_year = max(last_year, index.last_year)
+        index = TorahReadingOccasionIndex.build(first_year, last_year, israel, jerusalem)
+        install_occasion_index(index)
+    return index
+
+
+def precompute_occasion_indexes(first_year: int, last_year: int) -> List[TorahReadingOccasionIndex]:
+    indexes = []
+    for israel in (True, False):
+        for jerusalem in (True, False):
+            index = TorahReadingOccasionIndex.build(first_year, last_year, israel, jerusalem)
+            install_occasion_index(index)
+            indexes.append(index)
+    return indexes
+
+
+def dump_occasion_indexes(path: str, indexes: List[TorahReadingOccasionIndex]) -> None:
+    with open(path, 'w') as f:
+        json.dump([index.to_json() for index in indexes], f)
+
+
+def load_occasion_indexes(path: str) -> None:
+    with open(path) as f:
+        for data in json.load(f):
+            install_occasion_index(TorahReadingOccasionIndex.from_json(data))
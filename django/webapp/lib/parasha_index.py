@@ -0,0 +1,78 @@
+from array import array
+from bisect import bisect_left
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+from pyluach.dates import HebrewDate
+from pyluach.parshios import parshatable
+
+from .date_utils import day_number_of, hebrew_date_of
+
+# how many years around a requested year are indexed when the index has to be built on demand
+DEFAULT_YEARS_BEFORE = 10
+DEFAULT_YEARS_AFTER = 20
+
+
+class ParashaIndex:
+    """
+    An index from each parasha to the sorted dates of the Shabbatot on which it is read, over a range of years.
+
+    Looking up a reading is a binary search, instead of building (or scanning) a parasha table per query.
+    """
+
+    __slots__ = ('first_year', 'last_year', 'israel', '_readings', '_parshiot')
+
+    def __init__(self, first_year: int, last_year: int, israel: bool) -> None:
+        self.first_year = first_year
+        self.last_year = last_year
+        self.israel = israel
+        readings: Dict[int, List[int]] = defaultdict(list)
+        self._parshiot: Dict[int, Tuple[int, ...]] = {}
+        for year in range(first_year, last_year + 1):
+            for shabbat, parasha_numbers in parshatable(year, israel=israel).items():
+                if parasha_numbers is None:
+                    continue
+                shabbat_day_number = day_number_of(shabbat)
+                self._parshiot[shabbat_day_number] = tuple(parasha_numbers)
+                for parasha_number in parasha_numbers:
+                    readings[parasha_number].append(shabbat_day_number)
+        # the tables are built in order, so the readings are already sorted
+        self._readings = {parasha_number: array('l', day_numbers) for parasha_number, day_numbers in readings.items()}
+
+    def covers(self, year: int) -> bool:
+        return self.first_year <= year <= self.last_year
+
+    def parshiot_on(self, shabbat: HebrewDate) -> Optional[Tuple[int, ...]]:
+        """Return the parshiot read on the given date, or None if it isn't a Shabbat with a parasha."""
+        return self._parshiot.get(day_number_of(shabbat))
+
+    def is_read_on(self, parasha_number: int, on_date: HebrewDate) -> bool:
+        readings = self._readings.get(parasha_number, array('l'))
+        day_number = day_number_of(on_date)
+        i = bisect_left(readings, day_number)
+        return i < len(readings) and readings[i] == day_number
+
+    def next_reading(self, parasha_number: int, reference_date: HebrewDate) -> Optional[HebrewDate]:
+        """Return the first Shabbat on or after the reference date on which the parasha is read."""
+        readings = self._readings.get(parasha_number, array('l'))
+        i = bisect_left(readings, day_number_of(reference_date))
+        if i == len(readings):
+            return None
+        return hebrew_date_of(readings[i])
+
+
+_indexes: Dict[bool, ParashaIndex] = {}
+
+
+def get_parasha_index(israel: bool, year: int) -> ParashaIndex:
+    """Return the index for the given customs, making sure that it covers the given year and the one after it."""
+    index = _indexes.get(israel)
+    if index is None or not (index.covers(year) and index.covers(year + 1)):
+        first_year = year - DEFAULT_YEARS_BEFORE
+        last_year = year + DEFAULT_YEARS_AFTER
+        if index is not None:
+            first_year = min(first_year, index.first_year)
+            last_year = max(last_year, index.last_year)
+        index = ParashaIndex(first_year, last_year, israel)
+        _indexes[israel] = index
+    return index
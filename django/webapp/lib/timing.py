@@ -0,0 +1,177 @@
+"""
+Cheap per-request timing: named spans, SQL statements, and rolling percentiles per view.
+
+The timings of a request are kept in a thread local while it is handled (see webapp.middleware.TimingMiddleware).
+Outside of a request, a span costs a single thread local lookup, so the hot functions can stay decorated.
+"""
+import heapq
+from collections import deque
+from contextlib import contextmanager
+from functools import wraps
+from threading import Lock, local
+from time import perf_counter
+from typing import Any, Callable, Deque, Dict, Iterator, List, NamedTuple, Optional, Tuple, TypeVar, cast
+
+F = TypeVar('F', bound=Callable[..., Any])
+
+# how many of the slowest statements are kept, per request and per view
+SLOWEST_STATEMENTS = 5
+# how many of the latest requests of each view the percentiles are computed over
+WINDOW = 1000
+# long statements are cut, so keeping the slowest ones doesn't keep large strings around
+MAX_STATEMENT_LENGTH = 500
+
+
+class RequestTimings:
+    def __init__(self) -> None:
+        self.start = perf_counter()
+        self.queries = 0
+        self.db_seconds = 0.0
+        # the span names to their total time
+        self.spans: Dict[str, float] = {}
+        # a min-heap of (seconds, statement), so the fastest of the slowest is replaced first
+        self.slowest: List[Tuple[float, str]] = []
+
+    def add_span(self, name: str, seconds: float) -> None:
+        self.spans[name] = self.spans.get(name, 0.0) + seconds
+
+    def add_query(self, sql: str, seconds: float) -> None:
+        self.queries += 1
+        self.db_seconds += seconds
+        if len(self.slowest) < SLOWEST_STATEMENTS:
+            heapq.heappush(self.slowest, (seconds, sql[:MAX_STATEMENT_LENGTH]))
+        elif seconds > self.slowest[0][0]:
+            heapq.heapreplace(self.slowest, (seconds, sql[:MAX_STATEMENT_LENGTH]))
+
+    def server_timing(self, total_seconds: float) -> str:
+        """Return the value of a Server-Timing header, with the durations in milliseconds."""
+        metrics = [
+            'total;dur={:.1f}'.format(total_seconds * 1e3),
+            'db;dur={:.1f};desc="{} queries"'.format(self.db_seconds * 1e3, self.queries),
+            'python;dur={:.1f}'.format((total_seconds - self.db_seconds) * 1e3),
+        ]
+        metrics.extend('{};dur={:.1f}'.format(name, seconds * 1e3) for name, seconds in self.spans.items())
+        return ', '.join(metrics)
+
+
+_local = local()
+
+
+def start_request() -> RequestTimings:
+    timings = RequestTimings()
+    _local.timings = timings
+    return timings
+
+
+def finish_request() -> Optional[RequestTimings]:
+    timings = current()
+    _local.timings = None
+    return timings
+
+
+def current() -> Optional[RequestTimings]:
+    return getattr(_local, 'timings', None)
+
+
+@contextmanager
+def span(name: str) -> Iterator[None]:
+    timings = current()
+    if timings is None:
+        yield
+        return
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        timings.add_span(name, perf_counter() - start)
+
+
+def timed(name: str) -> Callable[[F], F]:
+    """Decorate a function to time its calls as a span of the given name."""
+    def decorator(function: F) -> F:
+        @wraps(function)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            timings = current()
+            if timings is None:
+                return function(*args, **kwargs)
+            start = perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                timings.add_span(name, perf_counter() - start)
+
+        return cast(F, wrapper)
+
+    return decorator
+
+
+class Sample(NamedTuple):
+    total_seconds: float
+    db_seconds: float
+    queries: int
+
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    """The nearest-rank percentile of the sorted values."""
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, max(0, int(fraction * len(sorted_values) + 0.5) - 1))]
+
+
+class ViewStats:
+    def __init__(self, window: int = WINDOW) -> None:
+        self.count = 0
+        self.samples: Deque[Sample] = deque(maxlen=window)
+        self.slowest: List[Tuple[float, str]] = []
+
+    def add(self, sample: Sample, slowest: List[Tuple[float, str]]) -> None:
+        self.count += 1
+        self.samples.append(sample)
+        for statement in slowest:
+            if len(self.slowest) < SLOWEST_STATEMENTS:
+                heapq.heappush(self.slowest, statement)
+            elif statement[0] > self.slowest[0][0]:
+                heapq.heapreplace(self.slowest, statement)
+
+    def summary(self) -> Dict[str, Any]:
+        """The percentiles of the latest requests, in milliseconds."""
+        summary: Dict[str, Any] = {'count': self.count}
+        for field in ('total_seconds', 'db_seconds'):
+            values = sorted(getattr(sample, field) for sample in self.samples)
+            name = field.replace('_seconds', '_ms')
+            summary[name] = {'p50': percentile(values, 0.5) * 1e3, 'p95': percentile(values, 0.95) * 1e3,
+                             'p99': percentile(values, 0.99) * 1e3}
+        queries = sorted(float(sample.queries) for sample in self.samples)
+        summary['queries'] = {'p50': percentile(queries, 0.5), 'p95': percentile(queries, 0.95),
+                              'p99': percentile(queries, 0.99)}
+        summary['slowest_statements'] = [{'ms': seconds * 1e3, 'sql': sql}
+                                         for seconds, sql in sorted(self.slowest, reverse=True)]
+        return summary
+
+
+class Aggregate:
+    """The rolling statistics of every view, shared by the threads of the process."""
+
+    def __init__(self, window: int = WINDOW) -> None:
+        self.window = window
+        self._lock = Lock()
+        self._views: Dict[str, ViewStats] = {}
+
+    def add(self, view: str, timings: RequestTimings, total_seconds: float) -> None:
+        sample = Sample(total_seconds, timings.db_seconds, timings.queries)
+        with self._lock:
+            stats = self._views.get(view)
+            if stats is None:
+                stats = self._views[view] = ViewStats(self.window)
+            stats.add(sample, timings.slowest)
+
+    def summary(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return {view: stats.summary() for view, stats in sorted(self._views.items())}
+
+    def clear(self) -> None:
+        with self._lock:
+            self._views.clear()
+
+
+aggregate = Aggregate()
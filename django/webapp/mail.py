@@ -1,12 +1,105 @@
 import logging
+import uuid
+from datetime import timedelta
 
-from django.core.mail import send_mail as django_send_mail
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db import transaction
 from django.template.loader import render_to_string
+from django.utils import timezone
+
+from webapp.models import OutgoingEmail
 
 logger = logging.getLogger('yaamod.webapp.mail')
 
+# how many emails are sent over one connection
+BATCH_SIZE = 100
+# the delay before retrying a failed email doubles with every attempt, up to the maximum, until giving up
+RETRY_DELAY = timedelta(minutes=1)
+MAX_RETRY_DELAY = timedelta(hours=6)
+MAX_ATTEMPTS = 10
+# how long a sender has to send the emails it claimed, before they are due again (as if it had died)
+CLAIM_DURATION = timedelta(minutes=15)
+
 
 def send_mail(email, title, html, context, from_email='noreply@yaamod.co.il'):
-    logger.info('sending email to {0}'.format(email))
+    """
+    Queue an email, to be sent by the send_queued_mail command.
+
+    The email is only rendered and saved here, so the request which sends it doesn't wait for the SMTP server.
+    """
+    logger.info('queueing email to {0}'.format(email))
     email_html_message = render_to_string(html, context)
-    django_send_mail(title, '', from_email, [email], html_message=email_html_message)
+    return OutgoingEmail.objects.create(to_email=email, from_email=from_email, subject=title,
+                                        html_message=email_html_message)
+
+
+def _retry_delay(attempts):
+    return min(RETRY_DELAY * 2 ** (attempts - 1), MAX_RETRY_DELAY)
+
+
+def _claim(batch_size):
+    """
+    Claim a batch of the emails which are due, and return them.
+
+    A claim is a lease: it puts the emails' next attempt off until the claim expires, so if the sender dies before
+    marking them, they are due again then. The claim is made in a short transaction of its own, and the update checks
+    again that the emails are due, so two senders never claim the same email.
+    """
+    claimed_by = uuid.uuid4().hex
+    now = timezone.now()
+    due = OutgoingEmail.objects.filter(sent_at=None, next_attempt_at__lte=now, attempts__lt=MAX_ATTEMPTS)
+    with transaction.atomic():
+        # the rows being claimed by another sender are skipped, where the database supports it
+        email_ids = list(due.select_for_update(skip_locked=True).order_by('next_attempt_at')
+                         .values_list('pk', flat=True)[:batch_size])
+        due.filter(pk__in=email_ids).update(claimed_by=claimed_by, next_attempt_at=now + CLAIM_DURATION)
+    return list(OutgoingEmail.objects.filter(claimed_by=claimed_by).order_by('pk'))
+
+
+def send_queued_mail(batch_size=BATCH_SIZE):
+    """
+    Send a batch of the queued emails which are due, over a single connection. Return how many were sent.
+
+    Several senders can run at once, since every one of them sends only the emails it claimed. They are sent outside of
+    any transaction, and each one is marked as sent or failed on its own, so no lock is held while talking to the SMTP
+    server.
+    """
+    emails = _claim(batch_size)
+    if not emails:
+        return 0
+
+    sent = 0
+    connection = get_connection()
+    try:
+        connection.open()
+    except Exception as e:
+        logger.exception('could not connect to send {0} emails'.format(len(emails)))
+        for email in emails:
+            _failed(email, e)
+        return 0
+
+    try:
+        for email in emails:
+            message = EmailMultiAlternatives(email.subject, '', email.from_email, [email.to_email],
+                                             connection=connection)
+            message.attach_alternative(email.html_message, 'text/html')
+            try:
+                message.send()
+            except Exception as e:
+                logger.exception('sending email {0} to {1} failed'.format(email.pk, email.to_email))
+                _failed(email, e)
+            else:
+                email.sent_at = timezone.now()
+                email.attempts += 1
+                email.save(update_fields=['sent_at', 'attempts'])
+                sent += 1
+    finally:
+        connection.close()
+    return sent
+
+
+def _failed(email, error):
+    email.attempts += 1
+    email.next_attempt_at = timezone.now() + _retry_delay(email.attempts)
+    email.last_error = repr(error)
+    email.save(update_fields=['attempts', 'next_attempt_at', 'last_error'])
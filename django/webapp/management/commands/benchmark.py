@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from webapp.benchmarks import suite
+
+
+class Command(BaseCommand):
+    help = 'Run the benchmark suite in a throwaway test database, and compare the results to a saved baseline'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--only', help='only run the benchmarks whose name contains this')
+        parser.add_argument('--module', action='append', dest='modules', choices=suite.MODULES,
+                            help='only run the benchmarks of this module (may be repeated)')
+        parser.add_argument('--save', metavar='PATH', help='save the results as JSON, e.g. as a new baseline')
+        parser.add_argument('--compare', metavar='PATH', help='fail if the results regressed from this baseline')
+        parser.add_argument('--tolerance', type=float, default=suite.DEFAULT_TOLERANCE,
+                            help='the fraction by which a time or peak memory may exceed the baseline')
+
+    def handle(self, *args, **options):
+        baseline = suite.load(options['compare']) if options['compare'] else None
+
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            results = suite.run(options['modules'] or suite.MODULES, options['only'], self.write_result)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        if options['save']:
+            suite.save(results, options['save'])
+        if baseline is not None:
+            regressions = suite.compare(results, baseline, options['tolerance'])
+            if regressions:
+                raise CommandError('regressions from {}:\n{}'.format(options['compare'], '\n'.join(regressions)))
+            self.stdout.write(self.style.SUCCESS('no regressions from {}'.format(options['compare'])))
+
+    def write_result(self, result):
+        self.stdout.write('{:<32} {:10.3f} ms {:10.3f} ms median {:6} queries {:9} KiB'.format(
+            result.name, result.best_seconds * 1e3, result.median_seconds * 1e3, result.queries,
+            result.peak_memory // 1024))
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+from pyluach.dates import HebrewDate
+
+from webapp.models import Synagogue
+from webapp.schedule import build_aliya_schedule
+
+
+class Command(BaseCommand):
+    help = 'Build the aliya schedules of the synagogues for a year (meant to run periodically, e.g. nightly)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--year', type=int, help='the Hebrew year, by default the current one')
+        parser.add_argument('--synagogue', type=int, action='append', dest='synagogues',
+                            help='the id of a synagogue to build the schedule of, by default all of them')
+
+    def handle(self, *args, **options):
+        year = options['year'] or HebrewDate.today().year
+        synagogues = Synagogue.objects.order_by('pk')
+        if options['synagogues']:
+            synagogues = synagogues.filter(pk__in=options['synagogues'])
+        for synagogue in synagogues:
+            schedule = build_aliya_schedule(synagogue, year)
+            self.stdout.write('built the {} schedule of {} ({} entries)'.format(
+                year, synagogue, schedule.entries.count()))
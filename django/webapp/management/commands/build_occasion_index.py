@@ -0,0 +1,20 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from pyluach.dates import HebrewDate
+
+from webapp.lib.occasion_index import precompute_occasion_indexes, dump_occasion_indexes
+
+
+class Command(BaseCommand):
+    help = 'Precompute the Torah reading occasion indexes and save them to a file which is loaded on startup'
+
+    def add_arguments(self, parser):
+        this_year = HebrewDate.today().year
+        parser.add_argument('--first-year', type=int, default=this_year - 10)
+        parser.add_argument('--last-year', type=int, default=this_year + 50)
+        parser.add_argument('--output', default=settings.TORAH_READING_OCCASION_INDEX_FILE)
+
+    def handle(self, *args, **options):
+        indexes = precompute_occasion_indexes(options['first_year'], options['last_year'])
+        dump_occasion_indexes(options['output'], indexes)
+        self.stdout.write('saved the occasions of {first_year}-{last_year} to {output}'.format(**options))
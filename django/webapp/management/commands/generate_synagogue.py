@@ -0,0 +1,43 @@
+from datetime import date
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from webapp.generator import generate_people, DEFAULT_BATCH_SIZE, DEFAULT_TODAY
+from webapp.models import Synagogue
+
+
+class Command(BaseCommand):
+    help = 'Generate a synagogue of synthetic families, for load tests and benchmarks'
+
+    def add_arguments(self, parser):
+        parser.add_argument('size', type=int, help='how many people to generate')
+        parser.add_argument('--seed', type=int, default=0, help='the same seed generates the same people')
+        parser.add_argument('--generations', type=int, default=4)
+        parser.add_argument('--today', type=date.fromisoformat, default=DEFAULT_TODAY,
+                            help='the day to generate the people as of, in YYYY-MM-DD format, by default {}'.format(
+                                DEFAULT_TODAY))
+        parser.add_argument('--synagogue', type=int, help='the id of a synagogue to add the people to, instead of a '
+                                                          'new one')
+        parser.add_argument('--name', help='the name of the new synagogue')
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        if options['synagogue'] is not None:
+            try:
+                synagogue = Synagogue.objects.get(pk=options['synagogue'])
+            except Synagogue.DoesNotExist:
+                raise CommandError('there is no synagogue {}'.format(options['synagogue']))
+        else:
+            name = options['name'] or 'generated_{}_{}'.format(options['size'], options['seed'])
+            if User.objects.filter(username='{}_member_creator'.format(name)).exists():
+                raise CommandError('there is already a synagogue named {}'.format(name))
+            synagogue = Synagogue.objects.create(
+                name=name, member_creator=User.objects.create_user('{}_member_creator'.format(name)))
+
+        start = time.monotonic()
+        people = generate_people(synagogue, options['size'], options['seed'], options['generations'],
+                                 options['batch_size'], options['today'])
+        self.stdout.write('generated {} people in synagogue {} ({}) with seed {} as of {} in {:.1f}s'.format(
+            len(people), synagogue.pk, synagogue.name, options['seed'], options['today'], time.monotonic() - start))
@@ -0,0 +1,48 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from webapp.importer import MemberImporter, MemberImportError, rows_from_csv, DEFAULT_BATCH_SIZE
+from webapp.models import Synagogue
+
+
+class Command(BaseCommand):
+    help = "Import the members exported from the legacy database (by scripts/msaccess_to_csv.py) into a synagogue"
+
+    def add_arguments(self, parser):
+        parser.add_argument('synagogue', type=int, help='the id of the synagogue to import into')
+        parser.add_argument('csv', help='the exported members')
+        parser.add_argument('--map', action='append', default=[], metavar='COLUMN=FIELD',
+                            help='rename a column of the export to a Person field (or external_id, father, mother '
+                                 'or wife), may be given more than once')
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+        parser.add_argument('--checkpoint', help='where to save the progress, by default next to the csv')
+
+    def handle(self, *args, **options):
+        try:
+            synagogue = Synagogue.objects.get(pk=options['synagogue'])
+        except Synagogue.DoesNotExist:
+            raise CommandError('there is no synagogue {}'.format(options['synagogue']))
+        try:
+            column_map = dict(mapping.split('=', 1) for mapping in options['map'])
+        except ValueError:
+            raise CommandError('--map should be given as COLUMN=FIELD')
+        checkpoint_path = options['checkpoint'] or options['csv'] + '.checkpoint'
+
+        start = time.monotonic()
+
+        def progress(phase, rows):
+            self.stdout.write('{}: {} rows ({:.0f} rows/s)'.format(phase, rows, rows / (time.monotonic() - start)))
+
+        importer = MemberImporter(synagogue, column_map, options['batch_size'], checkpoint_path, progress)
+        try:
+            # the csv is read twice, since the links can only be set once everyone was inserted
+            importer.import_people(rows_from_csv(options['csv']))
+            start = time.monotonic()
+            importer.link_family(rows_from_csv(options['csv']))
+        except MemberImportError as e:
+            raise CommandError('{} (run the command again to resume after fixing it)'.format(e))
+
+        os.remove(checkpoint_path)
+        self.stdout.write('imported {} in {:.1f}s'.format(options['csv'], time.monotonic() - start))
@@ -0,0 +1,27 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from webapp.mail import send_queued_mail, BATCH_SIZE
+
+
+class Command(BaseCommand):
+    help = 'Send the queued emails, once or (with --interval) continuously'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+        parser.add_argument('--interval', type=float,
+                            help='keep running, and check for new emails every this many seconds')
+
+    def handle(self, *args, **options):
+        while True:
+            # send full batches right away, until the queue is drained
+            while True:
+                sent = send_queued_mail(options['batch_size'])
+                if sent:
+                    self.stdout.write('sent {} emails'.format(sent))
+                if sent < options['batch_size']:
+                    break
+            if options['interval'] is None:
+                return
+            time.sleep(options['interval'])
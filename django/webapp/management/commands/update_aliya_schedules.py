@@ -0,0 +1,27 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from webapp.schedule import process_aliya_schedule_updates, BATCH_SIZE
+
+
+class Command(BaseCommand):
+    help = 'Recompute the aliya schedule entries of the changed people, once or (with --interval) continuously'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+        parser.add_argument('--interval', type=float,
+                            help='keep running, and check for new changes every this many seconds')
+
+    def handle(self, *args, **options):
+        while True:
+            # process full batches right away, until the queue is drained
+            while True:
+                processed = process_aliya_schedule_updates(options['batch_size'])
+                if processed:
+                    self.stdout.write('recomputed {} changes'.format(processed))
+                if processed < options['batch_size']:
+                    break
+            if options['interval'] is None:
+                return
+            time.sleep(options['interval'])
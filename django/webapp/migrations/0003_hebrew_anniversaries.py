@@ -0,0 +1,80 @@
+# Generated by Django 2.2.28 on 2026-10-17 19:37
+
+from datetime import timedelta
+
+from django.db import migrations, models
+from pyluach.dates import HebrewDate
+from pyluach.hebrewcal import Year
+
+# the conversions as they were when the fields were added (like webapp.lib.date_utils), so later changes to the app's
+# code don't change what this migration does
+
+
+def to_hebrew_date(gregorian_date, after_sunset):
+    if gregorian_date is None:
+        return None
+    if after_sunset:
+        gregorian_date += timedelta(days=1)
+    return HebrewDate.from_pydate(gregorian_date)
+
+
+def anniversary_key(hebrew_date):
+    month = hebrew_date.month
+    # Adar in a regular year is keyed as Adar Sheni
+    if month == 12 and not Year(hebrew_date.year).leap:
+        month = 13
+    return month * 100 + hebrew_date.day
+
+
+def fill_hebrew_anniversaries(apps, schema_editor):
+    Person = apps.get_model('webapp', 'Person')
+    for person in Person.objects.exclude(date_of_birth=None, date_of_death=None).iterator():
+        hebrew_date_of_birth = to_hebrew_date(person.date_of_birth, person.date_of_birth_after_sunset)
+        if hebrew_date_of_birth is not None:
+            person.hebrew_birth_year = hebrew_date_of_birth.year
+            person.hebrew_birth_anniversary = anniversary_key(hebrew_date_of_birth)
+        hebrew_date_of_death = to_hebrew_date(person.date_of_death, person.date_of_death_after_sunset)
+        if hebrew_date_of_death is not None:
+            person.hebrew_death_year = hebrew_date_of_death.year
+            person.hebrew_death_anniversary = anniversary_key(hebrew_date_of_death)
+        person.save(update_fields=['hebrew_birth_year', 'hebrew_birth_anniversary',
+                                   'hebrew_death_year', 'hebrew_death_anniversary'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('webapp', '0002_auto_20200125_2049'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='person',
+            name='hebrew_birth_anniversary',
+            field=models.IntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='person',
+            name='hebrew_birth_year',
+            field=models.IntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='person',
+            name='hebrew_death_anniversary',
+            field=models.IntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='person',
+            name='hebrew_death_year',
+            field=models.IntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='person',
+            index=models.Index(fields=['synagogue', 'hebrew_birth_anniversary'], name='person_birth_anniversary_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='person',
+            index=models.Index(fields=['synagogue', 'hebrew_death_anniversary'], name='person_death_anniversary_idx'),
+        ),
+        migrations.RunPython(fill_hebrew_anniversaries, migrations.RunPython.noop),
+    ]
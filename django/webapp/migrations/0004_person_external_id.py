@@ -0,0 +1,22 @@
+# Generated by Django 2.2.28 on 2026-10-17 19:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('webapp', '0003_hebrew_anniversaries'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='person',
+            name='external_id',
+            field=models.TextField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddConstraint(
+            model_name='person',
+            constraint=models.UniqueConstraint(fields=('synagogue', 'external_id'), name='person_unique_external_id'),
+        ),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 2.2.28 on 2026-10-17 19:57
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django_enumfield.db.fields
+import webapp.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('webapp', '0005_outgoing_email'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AliyaSchedule',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('year', models.IntegerField()),
+                ('built_at', models.DateTimeField(auto_now=True)),
+                ('synagogue', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='webapp.Synagogue')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='AliyaScheduleEntry',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('reason', django_enumfield.db.fields.EnumField(default=1, enum=webapp.models.AliyaPrecedenceReason)),
+                ('person', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='webapp.Person')),
+                ('schedule', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='entries', to='webapp.AliyaSchedule')),
+            ],
+            options={
+                'verbose_name_plural': 'aliya schedule entries',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='aliyascheduleentry',
+            index=models.Index(fields=['schedule', 'date'], name='aliya_schedule_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='aliyascheduleentry',
+            index=models.Index(fields=['schedule', 'person'], name='aliya_schedule_person_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='aliyaschedule',
+            constraint=models.UniqueConstraint(fields=('synagogue', 'year'), name='aliya_schedule_unique_year'),
+        ),
+    ]
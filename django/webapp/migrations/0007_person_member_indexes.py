@@ -0,0 +1,21 @@
+# Generated by Django 2.2.28 on 2026-10-17 20:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('webapp', '0006_aliya_schedule'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='person',
+            index=models.Index(fields=['synagogue', 'is_member', 'gender', 'last_aliya_date'], name='person_member_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='person',
+            index=models.Index(condition=models.Q(('cannot_get_aliya', False), ('is_member', True)), fields=['synagogue', 'last_aliya_date'], name='person_aliya_candidates_idx'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 2.2.28 on 2026-10-17 20:02
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('webapp', '0007_person_member_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='synagogue',
+            name='modified_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+        migrations.AddField(
+            model_name='synagogue',
+            name='version',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    ]
@@ -0,0 +1,66 @@
+# Generated by Django 2.2.28 on 2026-10-17 20:12
+
+from datetime import timedelta
+
+from django.db import migrations, models
+from pyluach.dates import HebrewDate
+from pyluach.hebrewcal import Year
+
+# Gender.MALE
+MALE = 1
+BATCH_SIZE = 1000
+
+# the calculation as it was when the field was added (like webapp.lib.date_utils.nth_gregorian_anniversary_of), so
+# later changes to the app's code don't change what this migration does
+
+
+def nth_gregorian_anniversary_of(gregorian_date, after_sunset, number_of_years):
+    if after_sunset:
+        gregorian_date += timedelta(days=1)
+    hebrew_date = HebrewDate.from_pydate(gregorian_date)
+    year, month, day = hebrew_date.year + number_of_years, hebrew_date.month, hebrew_date.day
+    # Adar of a regular year and Adar Sheni of a leap one have their anniversaries on the same dates
+    if month == 12 and not Year(hebrew_date.year).leap:
+        month = 13
+    if month == 13 and not Year(year).leap:
+        month = 12
+    try:
+        anniversary = HebrewDate(year, month, day)
+    except ValueError:
+        # 30 Cheshvan, 30 Kislev or 30 Adar Rishon, which the year doesn't have, so the first of the next month (and
+        # Nissan after Adar)
+        anniversary = HebrewDate(year, 1 if month == 12 else month + 1, 1)
+    return anniversary.to_pydate()
+
+
+def fill_bar_mitzvah_dates(apps, schema_editor):
+    Person = apps.get_model('webapp', 'Person')
+    people = []
+    for person in Person.objects.filter(gender=MALE).exclude(date_of_birth=None).iterator():
+        person.gregorian_bar_mitzvah_date = nth_gregorian_anniversary_of(person.date_of_birth,
+                                                                         person.date_of_birth_after_sunset, 13)
+        people.append(person)
+        if len(people) == BATCH_SIZE:
+            Person.objects.bulk_update(people, ['gregorian_bar_mitzvah_date'])
+            people = []
+    Person.objects.bulk_update(people, ['gregorian_bar_mitzvah_date'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('webapp', '0008_synagogue_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='person',
+            name='gregorian_bar_mitzvah_date',
+            field=models.DateField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='person',
+            index=models.Index(condition=models.Q(('cannot_get_aliya', False), ('date_of_death__isnull', True), ('is_member', True)), fields=['synagogue', 'gregorian_bar_mitzvah_date'], name='person_bar_mitzvah_idx'),
+        ),
+        migrations.RunPython(fill_bar_mitzvah_dates, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,63 @@
+# Generated by Django 2.2.28 on 2026-10-17 21:05
+
+from django.db import DatabaseError, migrations, transaction
+
+# the SQL is repeated here rather than imported from webapp.search, so the migration doesn't change with it
+COLUMNS = 'first_name, last_name, maiden_name, manual_paternal_name, manual_maternal_name'
+OLD_COLUMNS = 'old.first_name, old.last_name, old.maiden_name, old.manual_paternal_name, old.manual_maternal_name'
+NEW_COLUMNS = 'new.first_name, new.last_name, new.maiden_name, new.manual_paternal_name, new.manual_maternal_name'
+DELETE = ("INSERT INTO webapp_person_search(webapp_person_search, rowid, {}) VALUES ('delete', old.id, {});"
+          .format(COLUMNS, OLD_COLUMNS))
+INSERT = 'INSERT INTO webapp_person_search(rowid, {}) VALUES (new.id, {});'.format(COLUMNS, NEW_COLUMNS)
+
+SQLITE = [
+    "CREATE VIRTUAL TABLE webapp_person_search USING fts5({}, content='webapp_person', content_rowid='id', "
+    "tokenize='unicode61 remove_diacritics 2', prefix='1 2 3')".format(COLUMNS),
+    'CREATE TRIGGER webapp_person_search_insert AFTER INSERT ON webapp_person BEGIN {} END'.format(INSERT),
+    'CREATE TRIGGER webapp_person_search_delete AFTER DELETE ON webapp_person BEGIN {} END'.format(DELETE),
+    'CREATE TRIGGER webapp_person_search_update AFTER UPDATE OF {} ON webapp_person BEGIN {} {} END'.format(
+        COLUMNS, DELETE, INSERT),
+    "INSERT INTO webapp_person_search(webapp_person_search) VALUES ('rebuild')",
+]
+SQLITE_REVERSE = [
+    'DROP TRIGGER IF EXISTS webapp_person_search_insert',
+    'DROP TRIGGER IF EXISTS webapp_person_search_delete',
+    'DROP TRIGGER IF EXISTS webapp_person_search_update',
+    'DROP TABLE IF EXISTS webapp_person_search',
+]
+POSTGRESQL = [
+    'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+    "CREATE INDEX IF NOT EXISTS person_search_trgm_idx ON webapp_person USING gin ((first_name || ' ' || last_name "
+    "|| ' ' || maiden_name || ' ' || manual_paternal_name || ' ' || manual_maternal_name) gin_trgm_ops)",
+]
+POSTGRESQL_REVERSE = [
+    'DROP INDEX IF EXISTS person_search_trgm_idx',
+]
+
+
+def create_person_search(apps, schema_editor):
+    statements = {'sqlite': SQLITE, 'postgresql': POSTGRESQL}.get(schema_editor.connection.vendor, [])
+    try:
+        # so a failure (such as SQLite without FTS5, or a user who can't create extensions) leaves the transaction
+        # usable, and the search falls back to scanning
+        with transaction.atomic(using=schema_editor.connection.alias):
+            for sql in statements:
+                schema_editor.execute(sql)
+    except DatabaseError:
+        pass
+
+
+def drop_person_search(apps, schema_editor):
+    for sql in {'sqlite': SQLITE_REVERSE, 'postgresql': POSTGRESQL_REVERSE}.get(schema_editor.connection.vendor, []):
+        schema_editor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('webapp', '0009_person_gregorian_bar_mitzvah_date'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_person_search, drop_person_search),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 2.2.28 on 2026-10-17 20:27
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('webapp', '0010_person_search'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AliyaScheduleUpdate',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('person_id', models.IntegerField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('synagogue', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='webapp.Synagogue')),
+            ],
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.28 on 2026-10-17 20:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('webapp', '0011_aliya_schedule_update'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='outgoingemail',
+            name='claimed_by',
+            field=models.TextField(blank=True),
+        ),
+    ]
@@ -1,16 +1,22 @@
-import math
-from datetime import date
-
 from django.contrib.auth.models import User
-from django.db import models
-from django.db.models.query import QuerySet
+from django.db import models, transaction
+from django.db.models import F, Q, OuterRef, Subquery, Case, When, Value
+from django.db.models.query import QuerySet, RawQuerySet
+from django.utils import timezone
 from django_enumfield import enum
 from pyluach.dates import HebrewDate
-from pyluach.parshios import PARSHIOS, getparsha
-from typing import Tuple, Set, List, Dict, Optional
+from pyluach.parshios import PARSHIOS
+from datetime import date
+from typing import Any, Tuple, Set, List, Dict, Optional, Mapping, Iterable, TYPE_CHECKING
+
+from .lib.date_utils import nth_anniversary_of, to_hebrew_date, next_anniversary_of, TorahReadingOccasion, \
+    anniversary_key, anniversary_keys_between, nth_gregorian_anniversary_of
+from .lib.occasion_index import TorahReadingOccasionIndex, get_occasion_index
+from .lib.parasha_index import get_parasha_index
+from .lib.timing import timed
 
-from .lib.date_utils import nth_anniversary_of, to_hebrew_date, next_anniversary_of, \
-    make_torah_reading_occasions_table, TorahReadingOccasion
+if TYPE_CHECKING:
+    from .family import FamilyGraph  # noqa: F401
 
 
 class Gender(enum.Enum):
@@ -40,18 +46,29 @@ class Synagogue(models.Model):
     member_creator = models.ForeignKey(User, on_delete=models.CASCADE)
     in_israel = models.BooleanField(default=True)
     in_jerusalem = models.BooleanField(default=False)
+    # changed on every write of the synagogue or its people, to answer conditional requests
+    version = models.PositiveIntegerField(default=0, editable=False)
+    modified_at = models.DateTimeField(default=timezone.now, editable=False)
+
+    @staticmethod
+    def touch(synagogue_id: int) -> None:
+        """Mark the synagogue as changed, without loading it (or racing with other writers)."""
+        Synagogue.objects.filter(pk=synagogue_id).update(version=F('version') + 1, modified_at=timezone.now())
+
+    @property
+    def torah_reading_occasions(self) -> TorahReadingOccasionIndex:
+        return get_occasion_index(self.in_israel, self.in_jerusalem)
 
-    def get_torah_reading_occasions_table(self, year: int) -> Dict[HebrewDate, TorahReadingOccasion]:
-        return make_torah_reading_occasions_table(year, self.in_israel, self.in_jerusalem)
+    # the occasions are looked up in the occasion index, which make_torah_reading_occasions_table builds
+    @timed('torah_reading_occasions_table')
+    def get_torah_reading_occasions_table(self, year: int) -> Mapping[HebrewDate, TorahReadingOccasion]:
+        return get_occasion_index(self.in_israel, self.in_jerusalem, year).table_for_year(year)
 
-    def get_olim(self, on_date: HebrewDate) -> List[Tuple['Person', AliyaPrecedenceReason]]:
-        suggested_olim: List[Tuple[Person, AliyaPrecedenceReason]] = []
-        for male_member in self.male_members.all():
-            if male_member.can_get_aliya:
-                suggested_olim.append((male_member, male_member.get_aliya_precedence(on_date)))
-        suggested_olim.sort(key=lambda suggestion: (suggestion[1] or math.inf,
-                                                    suggestion[0].last_aliya_date or date.min))
-        return suggested_olim
+    @timed('get_olim')
+    def get_olim(self, on_date: HebrewDate) -> List[Tuple['Person', Optional[int]]]:
+        # imported here since the engine is built on top of the models
+        from .aliya import AliyaPrecedenceEngine
+        return AliyaPrecedenceEngine(self).get_olim(on_date)
 
     @property
     def people(self) -> QuerySet:
@@ -69,6 +86,144 @@ class Synagogue(models.Model):
         return self.name
 
 
+class SubqueryCount(Subquery):
+    template = '(SELECT COUNT(*) FROM (%(subquery)s) _count)'
+    output_field = models.IntegerField()
+
+
+# the relatives which each of the Person properties describing the family follows
+FAMILY_PROPERTY_RELATIONS = {
+    'father_json': 'father',
+    'paternal_name': 'father',
+    'mother_json': 'mother',
+    'maternal_name': 'mother',
+    'wife_json': 'wife',
+    'husband_json': 'husband',
+}
+
+
+class PersonQuerySet(models.QuerySet):
+    def with_family_details(self, fields: Optional[Iterable[str]] = None) -> 'PersonQuerySet':
+        """
+        Join the relatives and count the children in SQL, so serializing a list doesn't query per person.
+
+        If fields are given, only what is needed for those of the Person properties is joined or counted.
+        """
+        if fields is None:
+            fields = set(FAMILY_PROPERTY_RELATIONS) | {'num_of_children'}
+        queryset = self.select_related(*{FAMILY_PROPERTY_RELATIONS[field] for field in fields
+                                         if field in FAMILY_PROPERTY_RELATIONS})
+        if 'num_of_children' in fields:
+            children = Person.objects.filter(Q(father=OuterRef('pk')) | Q(mother=OuterRef('pk'))).order_by()
+            queryset = queryset.annotate(children_count=SubqueryCount(children.values('pk')))
+        return queryset
+
+    @staticmethod
+    def _anniversary_between(prefix: str, start: HebrewDate, end: HebrewDate) -> Q:
+        condition = Q()
+        for year, keys in anniversary_keys_between(start, end).items():
+            # the anniversaries of a date are only in the following years
+            condition |= Q(**{prefix + '_anniversary__in': keys, prefix + '_year__lt': year})
+        return condition
+
+    def with_yahrzeit_between(self, start: HebrewDate, end: HebrewDate) -> 'PersonQuerySet':
+        condition = self._anniversary_between('hebrew_death', start, end)
+        return self.filter(condition) if condition else self.none()
+
+    def with_birthday_between(self, start: HebrewDate, end: HebrewDate) -> 'PersonQuerySet':
+        condition = self._anniversary_between('hebrew_birth', start, end)
+        return self.filter(condition) if condition else self.none()
+
+    @staticmethod
+    def _eligible_for_aliya(on_date: Optional[date]) -> Q:
+        # only men with a date of birth have a bar mitzvah date
+        return Q(gregorian_bar_mitzvah_date__lte=on_date or date.today(), date_of_death__isnull=True,
+                 cannot_get_aliya=False)
+
+    def eligible_for_aliya(self, on_date: Optional[date] = None) -> 'PersonQuerySet':
+        """The people who can get an aliya on the date (today by default), like Person.can_get_aliya."""
+        return self.filter(self._eligible_for_aliya(on_date))
+
+    def with_aliya_eligibility(self, on_date: Optional[date] = None) -> 'PersonQuerySet':
+        """Annotate everyone with is_eligible_for_aliya, so the people who can't get one are still loaded."""
+        return self.annotate(is_eligible_for_aliya=Case(When(self._eligible_for_aliya(on_date), then=Value(True)),
+                                                        default=Value(False), output_field=models.BooleanField()))
+
+    def update_derived_fields(self) -> None:
+        """Set the derived fields of the people from their dates, as saving them does."""
+        people = list(self.only('pk', *DERIVED_FROM_FIELDS))
+        for person in people:
+            person.update_derived_fields()
+        Person.objects.using(self.db).bulk_update(people, DERIVED_FIELDS, batch_size=1000)
+
+    def update(self, **kwargs: Any) -> int:
+        """Like QuerySet.update, which doesn't call save(), and also update the fields derived from the changed ones."""
+        if not set(DERIVED_FROM_FIELDS) & set(kwargs):
+            return super().update(**kwargs)
+        with transaction.atomic(using=self.db):
+            # the people are selected before the update, which may change what the filters match
+            person_ids = list(self.values_list('pk', flat=True))
+            rows = super().update(**kwargs)
+            Person.objects.using(self.db).filter(pk__in=person_ids).update_derived_fields()
+        return rows
+
+    def bulk_update(self, objs: Iterable['Person'], fields: Iterable[str], batch_size: Optional[int] = None) -> None:
+        """Like QuerySet.bulk_update, which doesn't call save(), and also update the fields derived from these ones."""
+        fields = list(fields)
+        if not set(DERIVED_FROM_FIELDS) & set(fields):
+            return super().bulk_update(objs, fields, batch_size)
+        objs = list(objs)
+        with transaction.atomic(using=self.db):
+            super().bulk_update(objs, fields, batch_size)
+            # from the database, since the given people may only have the given fields set
+            Person.objects.using(self.db).filter(pk__in=[obj.pk for obj in objs]).update_derived_fields()
+
+    def _family_tree(self, relative_join: str, person_id: int, synagogue_id: int, max_depth: int) -> RawQuerySet:
+        # the path of ids from the root is kept so a corrupt tree with a cycle doesn't recurse until the depth limit
+        table = Person._meta.db_table
+        return self.raw('''
+            WITH RECURSIVE tree (id, depth, path) AS (
+                SELECT id, 0, '/' || CAST(id AS TEXT) || '/'
+                FROM {table}
+                WHERE id = %s AND synagogue_id = %s
+              UNION ALL
+                SELECT relative.id, tree.depth + 1, tree.path || CAST(relative.id AS TEXT) || '/'
+                FROM tree
+                JOIN {table} person ON person.id = tree.id
+                JOIN {table} relative ON {relative_join}
+                WHERE tree.depth < %s AND relative.synagogue_id = %s
+                  AND tree.path NOT LIKE '%%/' || CAST(relative.id AS TEXT) || '/%%'
+            )
+            SELECT {table}.*, closest.depth
+            FROM (SELECT id, MIN(depth) AS depth FROM tree GROUP BY id) closest
+            JOIN {table} ON {table}.id = closest.id
+            ORDER BY closest.depth, {table}.id
+        '''.format(table=table, relative_join=relative_join), [person_id, synagogue_id, max_depth, synagogue_id])
+
+    def ancestors_of(self, person_id: int, synagogue_id: int, max_depth: int) -> RawQuerySet:
+        """
+        Return the person and their ancestors up to max_depth generations back, in a single query.
+
+        Each person is annotated with depth, the number of generations from the given person (who is at depth 0).
+        """
+        return self._family_tree('relative.id IN (person.father_id, person.mother_id)',
+                                 person_id, synagogue_id, max_depth)
+
+    def descendants_of(self, person_id: int, synagogue_id: int, max_depth: int) -> RawQuerySet:
+        """Like ancestors_of, with the person's descendants."""
+        return self._family_tree('person.id IN (relative.father_id, relative.mother_id)',
+                                 person_id, synagogue_id, max_depth)
+
+
+BAR_MITZVAH_AGE = 13
+# the fields which Person.gregorian_bar_mitzvah_date is derived from
+BAR_MITZVAH_DATE_FIELDS = ('gender', 'date_of_birth', 'date_of_birth_after_sunset')
+# the fields which Person.update_derived_fields sets, and all of the fields they are derived from
+DERIVED_FIELDS = ('hebrew_birth_year', 'hebrew_birth_anniversary', 'hebrew_death_year', 'hebrew_death_anniversary',
+                  'gregorian_bar_mitzvah_date')
+DERIVED_FROM_FIELDS = BAR_MITZVAH_DATE_FIELDS + ('date_of_death', 'date_of_death_after_sunset')
+
+
 class Person(models.Model):
     synagogue = models.ForeignKey(Synagogue, on_delete=models.CASCADE)
 
@@ -105,8 +260,89 @@ class Person(models.Model):
                                related_name='children_of_mother')
     wife = models.OneToOneField('self', null=True, blank=True, on_delete=models.SET_NULL, related_name='husband')
 
+    # the id of the person in the database they were imported from
+    external_id = models.TextField(null=True, blank=True, editable=False)
+
+    # derived from the dates above on save, so anniversaries can be looked up with an indexed query
+    hebrew_birth_year = models.IntegerField(null=True, blank=True, editable=False)
+    hebrew_birth_anniversary = models.IntegerField(null=True, blank=True, editable=False)
+    hebrew_death_year = models.IntegerField(null=True, blank=True, editable=False)
+    hebrew_death_anniversary = models.IntegerField(null=True, blank=True, editable=False)
+    # the day of the bar mitzvah of a man with a date of birth, so whether he can get aliyot is a filter
+    gregorian_bar_mitzvah_date = models.DateField(null=True, blank=True, editable=False)
+
+    objects = PersonQuerySet.as_manager()
+
     class Meta:
         verbose_name_plural = 'people'
+        indexes = [
+            models.Index(fields=['synagogue', 'hebrew_birth_anniversary'], name='person_birth_anniversary_idx'),
+            models.Index(fields=['synagogue', 'hebrew_death_anniversary'], name='person_death_anniversary_idx'),
+            # Synagogue.members and male_members, in order of the last aliya
+            models.Index(fields=['synagogue', 'is_member', 'gender', 'last_aliya_date'], name='person_member_idx'),
+            # only the members who may get aliyot, in order of the last aliya
+            models.Index(fields=['synagogue', 'last_aliya_date'], name='person_aliya_candidates_idx',
+                         condition=Q(is_member=True, cannot_get_aliya=False)),
+            # the living members who may get aliyot, by the day of their bar mitzvah
+            models.Index(fields=['synagogue', 'gregorian_bar_mitzvah_date'], name='person_bar_mitzvah_idx',
+                         condition=Q(is_member=True, cannot_get_aliya=False, date_of_death__isnull=True)),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['synagogue', 'external_id'], name='person_unique_external_id'),
+        ]
+
+    # the fields which the aliya schedule depends on
+    ALIYA_SCHEDULE_FIELDS = ('synagogue_id', 'date_of_birth', 'date_of_birth_after_sunset', 'date_of_death',
+                             'date_of_death_after_sunset', 'gender', 'is_member', 'cannot_get_aliya',
+                             'bar_mitzvah_parasha', 'father_id', 'mother_id', 'wife_id')
+
+    @classmethod
+    def from_db(cls, db: Any, field_names: List[str], values: List[Any]) -> 'Person':
+        instance = super().from_db(db, field_names, values)
+        # so saving can tell what changed
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
+    @property
+    def loaded_values(self) -> Dict[str, Any]:
+        """The values of the fields (by attname) when the person was loaded from the database."""
+        return getattr(self, '_loaded_values', {})
+
+    def changed_fields(self, field_names: Iterable[str]) -> Set[str]:
+        """Return which of the fields (by attname) differ from when the person was loaded, or all if it wasn't."""
+        loaded_values = self.loaded_values
+        return {field_name for field_name in field_names
+                if field_name not in loaded_values or loaded_values[field_name] != getattr(self, field_name)}
+
+    def save(self, *args: Any, **kwargs: Any) -> None:
+        self.update_derived_fields()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            update_fields = set(update_fields)
+            if update_fields & set(DERIVED_FROM_FIELDS):
+                # so the derived fields aren't left stale in the database
+                update_fields |= set(DERIVED_FIELDS)
+            kwargs['update_fields'] = update_fields
+        super().save(*args, **kwargs)
+        # after the post_save signal, which still sees the values from before, and only of the fields which were saved
+        self._loaded_values = dict(self.loaded_values)
+        for field in self._meta.concrete_fields:
+            if update_fields is None or field.name in update_fields or field.attname in update_fields:
+                self._loaded_values[field.attname] = getattr(self, field.attname)
+
+    def update_derived_fields(self) -> None:
+        hebrew_date_of_birth = self.hebrew_date_of_birth
+        self.hebrew_birth_year = None if hebrew_date_of_birth is None else hebrew_date_of_birth.year
+        self.hebrew_birth_anniversary = None if hebrew_date_of_birth is None else anniversary_key(hebrew_date_of_birth)
+        hebrew_date_of_death = self.hebrew_date_of_death
+        self.hebrew_death_year = None if hebrew_date_of_death is None else hebrew_date_of_death.year
+        self.hebrew_death_anniversary = None if hebrew_date_of_death is None else anniversary_key(hebrew_date_of_death)
+        self.gregorian_bar_mitzvah_date = self._gregorian_bar_mitzvah_date()
+
+    def _gregorian_bar_mitzvah_date(self) -> Optional[date]:
+        if self.gender != Gender.MALE:
+            return None
+        return nth_gregorian_anniversary_of(self.date_of_birth, self.date_of_birth_after_sunset, BAR_MITZVAH_AGE)
 
     @property
     def full_name(self) -> str:
@@ -172,6 +408,9 @@ class Person(models.Model):
 
     @property
     def is_married_woman(self) -> bool:
+        family_graph = self._family_graph
+        if family_graph is not None:
+            return family_graph.husband_of(self.pk) is not None
         return hasattr(self, 'husband')
 
     @property
@@ -179,12 +418,27 @@ class Person(models.Model):
         return ((self.gender == Gender.MALE and self.is_married_man) or
                 (self.gender == Gender.FEMALE and self.is_married_woman))
 
+    @property
+    def _family_graph(self) -> Optional['FamilyGraph']:
+        # imported here since the graph is built on top of the models
+        from .family import cached_family_graph
+        # the graph is only known to be up to date as of a loaded synagogue's state
+        if self.pk is None or not Person.synagogue.is_cached(self):
+            return None
+        return cached_family_graph(self.synagogue_id, (self.synagogue.version, self.synagogue.modified_at))
+
     @property
     def children(self) -> QuerySet:
+        family_graph = self._family_graph
+        if family_graph is not None:
+            return Person.objects.filter(pk__in=family_graph.children_of(self.pk))
         return self.children_of_father.all() | self.children_of_mother.all()
 
     @property
     def immediate_family_members(self) -> Set['Person']:
+        family_graph = self._family_graph
+        if family_graph is not None:
+            return set(Person.objects.filter(pk__in=family_graph.family_member_ids(self.pk)))
         family_members = set()
         # parents and siblings
         if self.father:
@@ -207,22 +461,28 @@ class Person(models.Model):
     @property
     def bar_mitzvah_date(self) -> Optional[HebrewDate]:
         if self.gender == Gender.MALE and self.date_of_birth is not None:
-            return nth_anniversary_of(self.hebrew_date_of_birth, 13)
+            return nth_anniversary_of(self.hebrew_date_of_birth, BAR_MITZVAH_AGE)
         else:
             return None
 
     @property
     def is_bar_mitzvah(self) -> bool:
-        bar_mitzvah_date = self.bar_mitzvah_date
-        if bar_mitzvah_date is None:
-            return False
+        if self.changed_fields(BAR_MITZVAH_DATE_FIELDS):
+            # the stored date is only up to date as of the last save
+            bar_mitzvah_date = self._gregorian_bar_mitzvah_date()
         else:
-            return HebrewDate.today() >= self.bar_mitzvah_date
+            bar_mitzvah_date = self.gregorian_bar_mitzvah_date
+        return bar_mitzvah_date is not None and date.today() >= bar_mitzvah_date
 
     @property
     def can_get_aliya(self) -> bool:
         return self.is_bar_mitzvah and not self.is_deceased and not self.cannot_get_aliya
 
+    def can_get_aliya_on(self, on_date: date) -> bool:
+        """Like can_get_aliya, on another date, from the stored bar mitzvah date (like PersonQuerySet)."""
+        return (self.gregorian_bar_mitzvah_date is not None and self.gregorian_bar_mitzvah_date <= on_date and
+                not self.is_deceased and not self.cannot_get_aliya)
+
     @property
     def bar_mitzvah_parasha_name(self) -> Optional[str]:
         if self.bar_mitzvah_parasha is None:
@@ -234,13 +494,14 @@ class Person(models.Model):
     def last_aliya_hebrew_date(self) -> Optional[HebrewDate]:
         return to_hebrew_date(self.last_aliya_date, False)
 
-    def is_bar_mitzvah_parasha_shabbat(self, on_date: HebrewDate) -> bool:
+    def is_bar_mitzvah_parasha_shabbat(self, on_date: HebrewDate, israel: Optional[bool] = None) -> bool:
         if self.bar_mitzvah_parasha is None:
             return False
         if on_date.weekday() != 7:
             return False
-        parshiot = getparsha(on_date, israel=True)
-        return parshiot is not None and self.bar_mitzvah_parasha in parshiot
+        if israel is None:
+            israel = self.synagogue.in_israel
+        return get_parasha_index(israel, on_date.year).is_read_on(self.bar_mitzvah_parasha, on_date)
 
     def needs_yahrzeit_aliya(self, on_date: HebrewDate) -> bool:
         for family_member in self.immediate_family_members:
@@ -306,9 +567,83 @@ class Person(models.Model):
 
     @property
     def num_of_children(self) -> int:
+        if hasattr(self, 'children_count'):
+            # annotated by PersonQuerySet.with_family_details
+            return self.children_count
+        family_graph = self._family_graph
+        if family_graph is not None:
+            return len(family_graph.children_of(self.pk))
         return len(self.children)
 
 
 class UserToSynagogue(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
     synagogue = models.ForeignKey(Synagogue, on_delete=models.CASCADE)
+
+
+class OutgoingEmail(models.Model):
+    """An email waiting to be sent by the send_queued_mail command (see webapp.mail)."""
+    to_email = models.EmailField()
+    from_email = models.EmailField()
+    subject = models.TextField()
+    html_message = models.TextField()
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+    attempts = models.IntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    # the sender which claimed the email, until its next_attempt_at
+    claimed_by = models.TextField(blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['sent_at', 'next_attempt_at'], name='outgoing_email_due_idx'),
+        ]
+
+    def __str__(self) -> str:
+        return '{} to {}'.format(self.subject, self.to_email)
+
+
+class AliyaSchedule(models.Model):
+    """The aliya precedence of a synagogue's members on every Torah reading occasion in a year."""
+    synagogue = models.ForeignKey(Synagogue, on_delete=models.CASCADE)
+    year = models.IntegerField()
+    built_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['synagogue', 'year'], name='aliya_schedule_unique_year'),
+        ]
+
+    def __str__(self) -> str:
+        return '{} {}'.format(self.synagogue, self.year)
+
+
+class AliyaScheduleEntry(models.Model):
+    # only the members with a precedence reason on the date are stored
+    schedule = models.ForeignKey(AliyaSchedule, on_delete=models.CASCADE, related_name='entries')
+    person = models.ForeignKey(Person, on_delete=models.CASCADE)
+    date = models.DateField()
+    reason = enum.EnumField(AliyaPrecedenceReason)
+
+    class Meta:
+        verbose_name_plural = 'aliya schedule entries'
+        indexes = [
+            models.Index(fields=['schedule', 'date'], name='aliya_schedule_date_idx'),
+            models.Index(fields=['schedule', 'person'], name='aliya_schedule_person_idx'),
+        ]
+
+
+class AliyaScheduleUpdate(models.Model):
+    """
+    A changed person, whose and whose family's aliya schedule entries wait to be recomputed by the
+    update_aliya_schedules command (see webapp.schedule).
+    """
+    synagogue = models.ForeignKey(Synagogue, on_delete=models.CASCADE)
+    # not a foreign key, since the person may have been deleted or moved, and their family still needs recomputing
+    person_id = models.IntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self) -> str:
+        return '{} in {}'.format(self.person_id, self.synagogue_id)
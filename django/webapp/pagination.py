@@ -0,0 +1,16 @@
+from rest_framework.pagination import CursorPagination
+
+
+class PersonCursorPagination(CursorPagination):
+    # the primary key only grows, so pages stay stable when people are added concurrently
+    ordering = 'pk'
+    page_size = 100
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+
+    def paginate_queryset(self, queryset, request, view=None):
+        # clients which don't ask for pages get the whole list, as before
+        if (self.cursor_query_param not in request.query_params and
+                self.page_size_query_param not in request.query_params):
+            return None
+        return super().paginate_queryset(queryset, request, view)
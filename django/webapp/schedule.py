@@ -0,0 +1,122 @@
+"""
+The aliya schedule: who has precedence for an aliya on every Torah reading occasion in a year.
+
+A schedule is built for a whole year at once by the build_aliya_schedule command, with a single engine which loads
+the synagogue's people once. After that, saving or deleting a person only queues an AliyaScheduleUpdate, in the same
+transaction (so it is dropped if the change is rolled back). The update_aliya_schedules command then recomputes the
+entries of the people whose precedence depends on the queued ones, loading only them and their families.
+
+Eligibility (being bar mitzvah) is evaluated on the date of every occasion, so a boy is a candidate from his bar
+mitzvah on.
+"""
+from collections import defaultdict
+from typing import Collection, Dict, Iterable, Iterator, List, Set
+
+from django.db import transaction
+from django.db.models import Q
+
+from .aliya import AliyaPrecedenceEngine
+from .family import get_family_graph
+from .models import AliyaSchedule, AliyaScheduleEntry, AliyaScheduleUpdate, Person, Synagogue
+
+# how many queued updates are recomputed together
+BATCH_SIZE = 1000
+
+
+def _entries(schedule: AliyaSchedule, engine: AliyaPrecedenceEngine,
+             members: List[Person]) -> Iterator[AliyaScheduleEntry]:
+    table = schedule.synagogue.get_torah_reading_occasions_table(schedule.year)
+    for hebrew_date in sorted(table):
+        gregorian_date = hebrew_date.to_pydate()
+        candidates = [member for member in members if member.can_get_aliya_on(gregorian_date)]
+        for person, reason in engine.get_precedence_reasons(hebrew_date, candidates):
+            if reason is not None:
+                yield AliyaScheduleEntry(schedule=schedule, person=person, date=gregorian_date, reason=reason)
+
+
+def build_aliya_schedule(synagogue: Synagogue, year: int) -> AliyaSchedule:
+    engine = AliyaPrecedenceEngine(synagogue)
+    with transaction.atomic():
+        schedule, created = AliyaSchedule.objects.get_or_create(synagogue=synagogue, year=year)
+        schedule.entries.all().delete()
+        AliyaScheduleEntry.objects.bulk_create(_entries(schedule, engine, engine.members), batch_size=1000)
+        # to update built_at
+        schedule.save()
+    return schedule
+
+
+def update_aliya_schedules(synagogue_id: int, person_ids: Iterable[int]) -> None:
+    """Recompute the entries of the given people and their families in all of the synagogue's schedules."""
+    with transaction.atomic():
+        # locked, so two workers don't interleave the entries they computed from different versions of the people
+        schedules = list(AliyaSchedule.objects.select_for_update().filter(synagogue_id=synagogue_id)
+                         .select_related('synagogue').order_by('pk'))
+        if not schedules:
+            return
+        family_graph = get_family_graph(synagogue_id)
+        affected = set(person_ids)
+        for person_id in list(affected):
+            affected |= family_graph.family_member_ids(person_id)
+        engine = AliyaPrecedenceEngine(schedules[0].synagogue, affected)
+        for schedule in schedules:
+            # including the people who are no longer in the synagogue
+            schedule.entries.filter(person_id__in=affected).delete()
+            AliyaScheduleEntry.objects.bulk_create(_entries(schedule, engine, engine.members), batch_size=1000)
+
+
+def process_aliya_schedule_updates(batch_size: int = BATCH_SIZE) -> int:
+    """
+    Recompute the entries of a batch of the queued updates, and remove them from the queue. Return how many there were.
+
+    The updates are claimed with row locks which other workers skip, so several of them can run at once.
+    """
+    with transaction.atomic():
+        updates = list(AliyaScheduleUpdate.objects.select_for_update(skip_locked=True).order_by('pk')[:batch_size])
+        person_ids: Dict[int, Set[int]] = defaultdict(set)
+        for update in updates:
+            person_ids[update.synagogue_id].add(update.person_id)
+        for synagogue_id in sorted(person_ids):
+            update_aliya_schedules(synagogue_id, person_ids[synagogue_id])
+        AliyaScheduleUpdate.objects.filter(pk__in=[update.pk for update in updates]).delete()
+    return len(updates)
+
+
+def queue_aliya_schedule_updates(synagogue_id: int, person_ids: Collection[int]) -> None:
+    """Queue the recomputation of the people's entries, if the synagogue has any schedules."""
+    if person_ids and AliyaSchedule.objects.filter(synagogue_id=synagogue_id).exists():
+        AliyaScheduleUpdate.objects.bulk_create((AliyaScheduleUpdate(synagogue_id=synagogue_id, person_id=person_id)
+                                                 for person_id in person_ids), batch_size=BATCH_SIZE)
+
+
+def _previous_family(person: Person) -> Set[int]:
+    """
+    The people the person's own links pointed to when it was loaded. Their families (the person's previous siblings
+    among them) are recomputed along with the person's current one.
+    """
+    loaded_values = person.loaded_values
+    previous_family = set()
+    for field in ('father_id', 'mother_id', 'wife_id'):
+        person_id = loaded_values.get(field, getattr(person, field))
+        if person_id is not None:
+            previous_family.add(person_id)
+    return previous_family
+
+
+def person_saved(person: Person) -> None:
+    if not person.changed_fields(Person.ALIYA_SCHEDULE_FIELDS):
+        return
+    old_synagogue_id = person.loaded_values.get('synagogue_id')
+    if old_synagogue_id is not None and old_synagogue_id != person.synagogue_id:
+        # the person's entries and their previous family in the synagogue they moved out of
+        queue_aliya_schedule_updates(old_synagogue_id, {person.pk} | _previous_family(person))
+        queue_aliya_schedule_updates(person.synagogue_id, {person.pk})
+    else:
+        queue_aliya_schedule_updates(person.synagogue_id, {person.pk} | _previous_family(person))
+
+
+def person_deleting(person: Person) -> None:
+    # the links to the person are only known before the database removes them
+    family = _previous_family(person)
+    family.update(Person.objects.filter(Q(father_id=person.pk) | Q(mother_id=person.pk) | Q(wife_id=person.pk))
+                  .values_list('pk', flat=True))
+    queue_aliya_schedule_updates(person.synagogue_id, family)
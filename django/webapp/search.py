@@ -0,0 +1,168 @@
+"""
+Searching people by name, as the user types.
+
+Every word of the query has to match the start of a word in one of the names (in any script, Hebrew included). On
+SQLite the names are indexed by an FTS5 table, and on PostgreSQL by a trigram index, both created by the person search
+migration and kept in sync by the database itself (so bulk_create and bulk_update are covered too). Where neither is
+available, the names are scanned with icontains.
+
+Migrations which remake the person table on SQLite (as altering a column does there) drop its triggers, so after
+every migrate, ensure_search() creates whatever is missing again.
+"""
+import re
+from typing import Any, Dict, List, Tuple
+
+from django.db import connections, transaction
+from django.db.backends.base.base import BaseDatabaseWrapper
+from django.db.backends.base.schema import BaseDatabaseSchemaEditor
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+from django.db.utils import DatabaseError
+
+from .models import Person, PersonQuerySet
+
+SEARCH_FIELDS = ('first_name', 'last_name', 'maiden_name', 'manual_paternal_name', 'manual_maternal_name')
+
+FTS_TABLE = 'webapp_person_search'
+FTS_TRIGGERS = tuple('{}_{}'.format(FTS_TABLE, trigger) for trigger in ('insert', 'delete', 'update'))
+TRIGRAM_INDEX = 'person_search_trgm_idx'
+
+# the longest query which is searched, in words
+MAX_TERMS = 5
+
+_TABLE = Person._meta.db_table
+_COLUMNS = ', '.join(SEARCH_FIELDS)
+
+
+def _names() -> str:
+    """The names as a single text, which the trigram index is built on, and which the queries must repeat exactly."""
+    return '({})'.format(" || ' ' || ".join(SEARCH_FIELDS))
+
+
+def create_sqlite_search(schema_editor: BaseDatabaseSchemaEditor) -> None:
+    """Create (or recreate) the FTS5 table of the names, and the triggers which keep it in sync with the people."""
+    new_columns = ', '.join('new.' + field for field in SEARCH_FIELDS)
+    old_columns = ', '.join('old.' + field for field in SEARCH_FIELDS)
+    delete = "INSERT INTO {fts}({fts}, rowid, {columns}) VALUES ('delete', old.id, {old});".format(
+        fts=FTS_TABLE, columns=_COLUMNS, old=old_columns)
+    insert = 'INSERT INTO {fts}(rowid, {columns}) VALUES (new.id, {new});'.format(
+        fts=FTS_TABLE, columns=_COLUMNS, new=new_columns)
+    drop_sqlite_search(schema_editor)
+    for sql in (
+            # prefixes of up to 3 letters are indexed, so the first keystrokes of a type-ahead don't scan the index
+            "CREATE VIRTUAL TABLE {fts} USING fts5({columns}, content='{table}', content_rowid='id', "
+            "tokenize='unicode61 remove_diacritics 2', prefix='1 2 3')",
+            'CREATE TRIGGER {fts}_insert AFTER INSERT ON {table} BEGIN ' + insert + ' END',
+            'CREATE TRIGGER {fts}_delete AFTER DELETE ON {table} BEGIN ' + delete + ' END',
+            'CREATE TRIGGER {fts}_update AFTER UPDATE OF {columns} ON {table} BEGIN ' + delete + ' ' + insert + ' END',
+            "INSERT INTO {fts}({fts}) VALUES ('rebuild')"):
+        schema_editor.execute(sql.format(fts=FTS_TABLE, table=_TABLE, columns=_COLUMNS))
+
+
+def drop_sqlite_search(schema_editor: BaseDatabaseSchemaEditor) -> None:
+    for trigger in FTS_TRIGGERS:
+        schema_editor.execute('DROP TRIGGER IF EXISTS {}'.format(trigger))
+    schema_editor.execute('DROP TABLE IF EXISTS {}'.format(FTS_TABLE))
+
+
+def create_postgresql_search(schema_editor: BaseDatabaseSchemaEditor) -> None:
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    schema_editor.execute('CREATE INDEX IF NOT EXISTS {} ON {} USING gin ({} gin_trgm_ops)'.format(
+        TRIGRAM_INDEX, _TABLE, _names()))
+
+
+def drop_postgresql_search(schema_editor: BaseDatabaseSchemaEditor) -> None:
+    schema_editor.execute('DROP INDEX IF EXISTS {}'.format(TRIGRAM_INDEX))
+
+
+def create_search(schema_editor: BaseDatabaseSchemaEditor) -> None:
+    """Create the search index for the database, if it supports one."""
+    create = {'sqlite': create_sqlite_search, 'postgresql': create_postgresql_search}.get(
+        schema_editor.connection.vendor)
+    if create is None:
+        return
+    try:
+        # so a failure (such as SQLite without FTS5, or a user who can't create extensions) leaves the transaction
+        # usable, and the search falls back to scanning
+        with transaction.atomic(using=schema_editor.connection.alias):
+            create(schema_editor)
+    except DatabaseError:
+        pass
+
+
+def drop_search(schema_editor: BaseDatabaseSchemaEditor) -> None:
+    drop = {'sqlite': drop_sqlite_search, 'postgresql': drop_postgresql_search}.get(schema_editor.connection.vendor)
+    if drop is not None:
+        drop(schema_editor)
+
+
+def missing_search(connection: BaseDatabaseWrapper) -> Tuple[str, ...]:
+    """Return the names of the parts of the search index which the database supports but doesn't have."""
+    if connection.vendor == 'sqlite':
+        expected: Tuple[str, ...] = (FTS_TABLE,) + FTS_TRIGGERS
+        sql = 'SELECT name FROM sqlite_master WHERE name IN ({})'.format(', '.join(['%s'] * len(expected)))
+    elif connection.vendor == 'postgresql':
+        expected = (TRIGRAM_INDEX,)
+        sql = 'SELECT indexname FROM pg_indexes WHERE indexname = %s'
+    else:
+        return ()
+    with connection.cursor() as cursor:
+        cursor.execute(sql, expected)
+        existing = {row[0] for row in cursor.fetchall()}
+    return tuple(name for name in expected if name not in existing)
+
+
+def ensure_search(connection: BaseDatabaseWrapper) -> None:
+    """Create the search index again if any of it is missing, such as the triggers of a remade table."""
+    if missing_search(connection):
+        with connection.schema_editor() as schema_editor:
+            create_search(schema_editor)
+        _has_index.pop(connection.alias, None)
+
+
+# the database aliases to whether they have the search index, which only changes when migrating
+_has_index: Dict[str, bool] = {}
+
+
+def _search_index(alias: str) -> bool:
+    if alias not in _has_index:
+        connection = connections[alias]
+        # the index itself, which searching needs (the triggers only keep it up to date)
+        index = {'sqlite': FTS_TABLE, 'postgresql': TRIGRAM_INDEX}.get(connection.vendor)
+        _has_index[alias] = index is not None and index not in missing_search(connection)
+    return _has_index[alias]
+
+
+class _RawSubquery(RawSQL):
+    """A raw subquery for an __in lookup, which RawSQL would put in a second pair of parentheses (a scalar subquery)."""
+
+    def as_sql(self, compiler: Any, connection: BaseDatabaseWrapper) -> Tuple[str, List[Any]]:
+        return self.sql, list(self.params)
+
+
+def query_terms(query: str) -> List[str]:
+    """The words of the query, without the characters which FTS5 and LIKE give a meaning to."""
+    return re.findall(r'[^\W_]+', query)[:MAX_TERMS]
+
+
+def search(queryset: PersonQuerySet, query: str) -> PersonQuerySet:
+    """Filter the people to those with a name which starts with every word of the query."""
+    terms = query_terms(query)
+    if not terms:
+        return queryset.none()
+    vendor = connections[queryset.db].vendor
+    if _search_index(queryset.db):
+        if vendor == 'sqlite':
+            match = ' '.join('"{}"*'.format(term) for term in terms)
+            return queryset.filter(pk__in=_RawSubquery(
+                'SELECT rowid FROM {fts} WHERE {fts} MATCH %s'.format(fts=FTS_TABLE), [match]))
+        # the trigram index finds the names containing the words, which are then matched at the start of a word
+        condition = ' AND '.join(['{} ILIKE %s'.format(_names())] * len(terms))
+        queryset = queryset.filter(pk__in=_RawSubquery('SELECT id FROM {} WHERE {}'.format(_TABLE, condition),
+                                                       ['%{}%'.format(term) for term in terms]))
+    for term in terms:
+        condition = Q()
+        for field in SEARCH_FIELDS:
+            condition |= Q(**{field + '__istartswith': term}) | Q(**{field + '__icontains': ' ' + term})
+        queryset = queryset.filter(condition)
+    return queryset
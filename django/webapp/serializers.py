@@ -1,9 +1,10 @@
 from django.contrib.auth.models import User
-from rest_framework.serializers import ModelSerializer, CharField, Serializer
+from rest_framework.serializers import ModelSerializer, CharField, Serializer, IntegerField
 from rest_framework.exceptions import ValidationError
+from rest_framework.permissions import SAFE_METHODS
 
 from webapp.models import Synagogue, Person, UserToSynagogue
-from webapp.utils import request_to_synagogue, request_has_synagogue
+from webapp.utils import request_to_synagogue, request_has_synagogue, set_request_synagogue
 
 
 def add_user_to_synagogue(user, synagogue):
@@ -40,6 +41,7 @@ class SynagogueSerializer(ModelSerializer):
 
         synagogue = Synagogue.objects.create(**validated_data)
         add_user_to_synagogue(request.user, synagogue)
+        set_request_synagogue(request, synagogue)
 
         return synagogue
 
@@ -55,7 +57,36 @@ class PersonSerializer(ModelSerializer):
         fields = ('pk', 'first_name', 'last_name', 'gender_name', 'paternal_name', 'maternal_name', 'yichus_name',
                   'father_json', 'mother_json', 'wife_json', 'husband_json', 'num_of_children')
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        requested_fields = self.requested_fields(self.context.get('request'))
+        if requested_fields is not None:
+            for field_name in set(self.fields) - requested_fields:
+                self.fields.pop(field_name)
+
+    @classmethod
+    def requested_fields(cls, request):
+        """
+        Return the fields asked for with ?fields=a,b,c when reading, or None for all of them (also when none are named).
+        """
+        if request is None or request.method not in SAFE_METHODS:
+            return None
+        requested_fields = set(request.query_params.get('fields', '').split(',')) - {''}
+        unknown_fields = requested_fields - set(cls.Meta.fields)
+        if unknown_fields:
+            raise ValidationError({'fields': 'unknown fields: {}'.format(', '.join(sorted(unknown_fields)))})
+        return requested_fields or None
+
     def create(self, validated_data):
         request = self.context['request']
         validated_data['synagogue'] = request_to_synagogue(request)
         return Person.objects.create(**validated_data)
+
+
+class FamilyTreeSerializer(ModelSerializer):
+    depth = IntegerField(read_only=True)
+
+    class Meta:
+        model = Person
+        # only the parents' ids, so the tree can be put together without querying for each person
+        fields = ('pk', 'first_name', 'last_name', 'gender_name', 'depth', 'father', 'mother')
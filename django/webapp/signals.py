@@ -1,9 +1,16 @@
 import logging
 
+from django.contrib.auth.models import User
+from django.db import connections, transaction
+from django.db.models.signals import post_migrate, post_save, post_delete, pre_delete, pre_save
 from django.dispatch import receiver
-from django_rest_passwordreset.signals import reset_password_token_created
+from django_rest_passwordreset.signals import reset_password_token_created, post_password_reset
+from rest_framework.authtoken.models import Token
 
+from webapp import family, schedule, search
+from webapp.authentication import invalidate_credentials, invalidate_token
 from webapp.mail import send_mail
+from webapp.models import Person, Synagogue
 
 logger = logging.getLogger('yaamod.webapp.signals')
 
@@ -23,3 +30,76 @@ def password_reset_token_created(sender, reset_password_token, *args, **kwargs):
               'החלפת סיסמא לאתר יעמוד',
               'webapp/password_reset.html',
               context)
+
+
+@receiver(post_save, sender=Person)
+@receiver(post_delete, sender=Person)
+def touch_person_synagogue(sender, instance, **kwargs):
+    Synagogue.touch(instance.synagogue_id)
+    old_synagogue_id = instance.loaded_values.get('synagogue_id')
+    if old_synagogue_id is not None and old_synagogue_id != instance.synagogue_id:
+        # the person moved out of it
+        Synagogue.touch(old_synagogue_id)
+
+
+@receiver(post_save, sender=Synagogue)
+def touch_synagogue(sender, instance, created, raw, **kwargs):
+    if not created and not raw:
+        Synagogue.touch(instance.pk)
+
+
+@receiver(pre_save, sender=Person)
+@receiver(pre_delete, sender=Person)
+def remember_family_graph_state(sender, instance, **kwargs):
+    family.person_changing(instance)
+
+
+# registered after touching the synagogue, which the graph is patched to the new state of
+@receiver(post_save, sender=Person)
+def update_family_graph(sender, instance, **kwargs):
+    family.person_saved(instance)
+
+
+@receiver(post_delete, sender=Person)
+def remove_from_family_graph(sender, instance, **kwargs):
+    family.person_deleted(instance)
+
+
+@receiver(post_save, sender=Person)
+def queue_aliya_schedule_update(sender, instance, raw, **kwargs):
+    if not raw:
+        schedule.person_saved(instance)
+
+
+@receiver(pre_delete, sender=Person)
+def queue_aliya_schedule_update_on_delete(sender, instance, **kwargs):
+    schedule.person_deleting(instance)
+
+
+@receiver(post_migrate)
+def ensure_person_search(sender, using, **kwargs):
+    # a migration which remade the person table on SQLite dropped the search triggers with it
+    if sender.name == 'webapp':
+        search.ensure_search(connections[using])
+
+
+@receiver(post_delete, sender=Synagogue)
+def drop_family_graph(sender, instance, **kwargs):
+    synagogue_id = instance.pk
+    transaction.on_commit(lambda: family.drop_family_graph(synagogue_id))
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_cached_credentials(sender, instance, **kwargs):
+    invalidate_credentials(instance.username)
+
+
+@receiver(post_password_reset)
+def invalidate_reset_credentials(sender, user, **kwargs):
+    invalidate_credentials(user.username)
+
+
+@receiver(post_delete, sender=Token)
+def invalidate_deleted_token(sender, instance, **kwargs):
+    invalidate_token(instance)
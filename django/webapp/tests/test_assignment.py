@@ -0,0 +1,84 @@
+from datetime import date
+
+from django.contrib.auth.models import User
+from django.test import TestCase
+from pyluach.dates import HebrewDate
+
+from webapp.assignment import assign_aliyot, assign_aliyot_on, aliyot_of
+from webapp.benchmarks.assignment import synthetic_suggestions
+from webapp.lib.date_utils import TorahReadingOccasion
+from webapp.models import Person, Yichus, AliyaPrecedenceReason, Synagogue, Gender
+
+SHABBAT = TorahReadingOccasion('Shabbat', 7, 3)
+WEEKDAY = TorahReadingOccasion('Weekday', 3)
+
+
+def suggestion(name, yichus=Yichus.ISRAEL, reason=None):
+    return Person(first_name=name, yichus=yichus), reason
+
+
+def names(assignments):
+    return {assignment.aliya.name: assignment.person and assignment.person.first_name for assignment in assignments}
+
+
+class TestAssignAliyot(TestCase):
+    def test_aliyot(self):
+        self.assertEqual([aliya.name for aliya in aliyot_of(SHABBAT)],
+                         ['shacharit {}'.format(i) for i in range(1, 8)] + ['shacharit maftir'] +
+                         ['mincha 1', 'mincha 2', 'mincha 3'])
+        self.assertEqual([aliya.yichus for aliya in aliyot_of(SHABBAT)][:8],
+                         [Yichus.COHEN, Yichus.LEVI] + [Yichus.ISRAEL] * 5 + [None])
+
+    def test_precedence_moves_earlier_olim(self):
+        # the Cohen with the yahrzeit gets the Cohen's aliya before the other Cohen, who doesn't get any, and the Levi
+        # with the birthday gets the Levi's aliya before the other Levi
+        suggestions = [suggestion('yahrzeit cohen', Yichus.COHEN, AliyaPrecedenceReason.YAHRZEIT),
+                       suggestion('birthday levi', Yichus.LEVI, AliyaPrecedenceReason.BIRTHDAY),
+                       suggestion('cohen', Yichus.COHEN), suggestion('israel'), suggestion('levi', Yichus.LEVI)]
+        assignments = names(assign_aliyot(WEEKDAY, suggestions))
+        self.assertEqual(assignments, {'shacharit 1': 'yahrzeit cohen', 'shacharit 2': 'birthday levi',
+                                       'shacharit 3': 'israel'})
+
+    def test_maftir_for_anyone(self):
+        suggestions = [suggestion('cohen {}'.format(i), Yichus.COHEN) for i in range(3)] + \
+            [suggestion('israel {}'.format(i)) for i in range(8)] + [suggestion('levi', Yichus.LEVI)]
+        assignments = assign_aliyot(SHABBAT, suggestions)
+        by_name = names(assignments)
+        self.assertEqual(by_name['shacharit 1'], 'cohen 0')
+        self.assertEqual(by_name['shacharit maftir'], 'cohen 1')
+        self.assertEqual(by_name['mincha 1'], 'cohen 2')
+        self.assertEqual(by_name['shacharit 2'], 'levi')
+        # the Cohen of mincha gets the Levi's aliya too, since there is only one Levi
+        self.assertEqual(by_name['mincha 2'], 'cohen 2')
+        people = [assignment.person for assignment in assignments if assignment.aliya.name != 'mincha 2']
+        self.assertEqual(len(people), len(set(map(id, people))))
+
+    def test_no_cohen(self):
+        suggestions = [suggestion('levi', Yichus.LEVI), suggestion('israel 1'), suggestion('israel 2'),
+                       suggestion('israel 3', None)]
+        self.assertEqual(names(assign_aliyot(WEEKDAY, suggestions)), {
+            'shacharit 1': 'israel 2', 'shacharit 2': 'levi', 'shacharit 3': 'israel 1'})
+
+    def test_not_enough_olim(self):
+        assignments = names(assign_aliyot(WEEKDAY, [suggestion('cohen', Yichus.COHEN)]))
+        self.assertEqual(assignments, {'shacharit 1': 'cohen', 'shacharit 2': 'cohen', 'shacharit 3': None})
+
+    def test_large_synagogue(self):
+        suggestions = synthetic_suggestions(20000)
+        assignments = assign_aliyot(SHABBAT, suggestions)
+        self.assertTrue(all(assignment.person is not None for assignment in assignments))
+        # everyone with a reason who could get an aliya got one
+        with_reason = [person for person, reason in suggestions if reason is not None]
+        assigned = {id(assignment.person) for assignment in assignments}
+        israelim_with_reason = [person for person in with_reason if person.yichus in (Yichus.ISRAEL, None)]
+        self.assertTrue(all(id(person) in assigned for person in israelim_with_reason[:5]))
+
+    def test_on_date(self):
+        synagogue = Synagogue.objects.create(name='Klal Yisrael', member_creator=User.objects.create(username='blah'))
+        for i, yichus in enumerate((Yichus.COHEN, Yichus.LEVI, Yichus.ISRAEL, Yichus.ISRAEL)):
+            Person.objects.create(synagogue=synagogue, first_name=str(i), gender=Gender.MALE, is_member=True,
+                                  date_of_birth=date(1980, 1, 1), yichus=yichus)
+        # Chanukah
+        self.assertEqual(names(assign_aliyot_on(synagogue, HebrewDate(5780, 9, 25))),
+                         {'shacharit 1': '0', 'shacharit 2': '1', 'shacharit 3': '2'})
+        self.assertEqual(assign_aliyot_on(synagogue, HebrewDate(5780, 9, 24)), [])
@@ -0,0 +1,150 @@
+import base64
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.test import TestCase, override_settings
+from django_rest_passwordreset.signals import post_password_reset
+from rest_framework import status
+from rest_framework.authtoken.models import Token
+
+from webapp import authentication
+from webapp.lib.ttl_cache import TTLCache
+from webapp.models import Synagogue, UserToSynagogue, Person
+
+
+class TestTTLCache(TestCase):
+    def test_expiry(self):
+        now = [0]
+        cache = TTLCache(10, 5, clock=lambda: now[0])
+        cache.set('a', 1)
+        now[0] = 4
+        self.assertEqual(cache.get('a'), 1)
+        now[0] = 5
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(len(cache), 0)
+
+    def test_least_recently_used_eviction(self):
+        cache = TTLCache(2, 100)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual((cache.get('a'), cache.get('c')), (1, 3))
+
+
+class TestCachedBasicAuthentication(TestCase):
+    USERNAME = 'john'
+    PASSWORD = 'doe'
+
+    def setUp(self):
+        self.user = User.objects.create_user(self.USERNAME, password=self.PASSWORD)
+        self.check_password = mock.patch.object(User, 'check_password', autospec=True,
+                                                side_effect=User.check_password).start()
+        self.addCleanup(mock.patch.stopall)
+
+    def request(self, password=PASSWORD, username=USERNAME):
+        credentials = base64.b64encode('{}:{}'.format(username, password).encode()).decode()
+        # a view which needs an authenticated user
+        return self.client.post('/logout', HTTP_AUTHORIZATION='Basic ' + credentials).status_code
+
+    def test_password_hashed_once(self):
+        for i in range(3):
+            self.assertEqual(self.request(), status.HTTP_200_OK)
+        self.assertEqual(self.check_password.call_count, 1)
+
+    def test_wrong_password(self):
+        self.assertEqual(self.request(), status.HTTP_200_OK)
+        self.assertEqual(self.request('wrong'), status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(self.request(username='jane'), status.HTTP_401_UNAUTHORIZED)
+
+    def test_password_change(self):
+        self.assertEqual(self.request(), status.HTTP_200_OK)
+        self.user.set_password('new')
+        self.user.save()
+        self.assertEqual(self.request(), status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(self.request('new'), status.HTTP_200_OK)
+
+    def test_password_changed_without_signals(self):
+        self.assertEqual(self.request(), status.HTTP_200_OK)
+        # as when changed by another process
+        user = User(pk=self.user.pk)
+        user.set_password('new')
+        User.objects.filter(pk=self.user.pk).update(password=user.password)
+        self.assertEqual(self.request(), status.HTTP_401_UNAUTHORIZED)
+
+    def test_deactivated(self):
+        self.assertEqual(self.request(), status.HTTP_200_OK)
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+        self.assertEqual(self.request(), status.HTTP_401_UNAUTHORIZED)
+
+    def test_password_reset(self):
+        self.assertEqual(self.request(), status.HTTP_200_OK)
+        post_password_reset.send(sender=self.__class__, user=self.user)
+        self.assertEqual(self.request(), status.HTTP_200_OK)
+        self.assertEqual(self.check_password.call_count, 2)
+
+
+class TestSynagogueTokenAuthentication(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('john', password='doe')
+        self.synagogue = Synagogue.objects.create(name='Klal Yisrael',
+                                                  member_creator=User.objects.create(username='blah'))
+        UserToSynagogue.objects.create(user=self.user, synagogue=self.synagogue)
+        Person.objects.create(synagogue=self.synagogue, first_name='a')
+        self.token = Token.objects.create(user=self.user)
+        self.key = self.token.key
+        # the keys cached by the other tests, whose users may have the same ids
+        self.addCleanup(authentication._member_creator_tokens._local.clear)
+
+    def request(self, url='/person', method='get'):
+        return getattr(self.client, method)(url, HTTP_AUTHORIZATION='Token ' + self.key)
+
+    def test_single_query(self):
+        # the token with its user and synagogue, the synagogue's version and the list of people
+        with self.assertNumQueries(3):
+            response = self.request()
+        self.assertEqual([person['first_name'] for person in response.json()], ['a'])
+
+    def test_deleted_token(self):
+        self.assertEqual(self.request().status_code, status.HTTP_200_OK)
+        # as by another process
+        Token.objects.filter(key=self.key).update(key='other')
+        self.assertEqual(self.request().status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_deactivated_user(self):
+        self.assertEqual(self.request().status_code, status.HTTP_200_OK)
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+        self.assertEqual(self.request().status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_revoked_staff(self):
+        User.objects.filter(pk=self.user.pk).update(is_staff=True)
+        self.assertEqual(self.request('/timings').status_code, status.HTTP_200_OK)
+        User.objects.filter(pk=self.user.pk).update(is_staff=False)
+        self.assertEqual(self.request('/timings').status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_left_synagogue(self):
+        self.assertEqual(self.request().status_code, status.HTTP_200_OK)
+        UserToSynagogue.objects.get(user=self.user).delete()
+        self.assertEqual(self.request().status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_member_creator_token(self):
+        key = self.request('/member_creator_token', 'post').json()['token']
+        with self.assertNumQueries(1):
+            # only the authentication
+            self.assertEqual(self.request('/member_creator_token', 'post').json()['token'], key)
+        Token.objects.get(key=key).delete()
+        self.assertNotEqual(self.request('/member_creator_token', 'post').json()['token'], key)
+
+    @override_settings(TOKEN_CACHE_ALIAS='tokens', CACHES={
+        'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+        'tokens': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'tokens'},
+    })
+    def test_shared_cache(self):
+        key = self.request('/member_creator_token', 'post').json()['token']
+        # only the key is shared, and only there, so a key invalidated by another process isn't used by this one
+        self.assertEqual(caches['tokens'].get('webapp.token.{}'.format(self.synagogue.member_creator_id)), key)
+        self.assertIsNone(authentication._member_creator_tokens._local.get(self.synagogue.member_creator_id))
+        Token.objects.get(key=key).delete()
+        self.assertIsNone(caches['tokens'].get('webapp.token.{}'.format(self.synagogue.member_creator_id)))
@@ -0,0 +1,35 @@
+import os
+import tempfile
+
+from django.contrib.auth.models import User
+from django.test import TestCase
+
+from webapp.benchmarks import suite
+
+
+class TestBenchmarkSuite(TestCase):
+    def test_measure(self):
+        result = suite.measure(suite.Benchmark('users', lambda: list(User.objects.all()), repeat=3))
+        self.assertEqual(result.name, 'users')
+        self.assertEqual(result.queries, 1)
+        self.assertLessEqual(result.best_seconds, result.median_seconds)
+        self.assertGreater(result.peak_memory, 0)
+
+    def test_compare(self):
+        baseline = {'a': suite.Result('a', 1.0, 1.0, 2, 1000), 'b': suite.Result('b', 1.0, 1.0, 2, 1000)}
+        results = [
+            suite.Result('a', 1.1, 1.5, 2, 1100),
+            suite.Result('b', 2.0, 2.0, 3, 2000),
+            # not in the baseline
+            suite.Result('c', 9.0, 9.0, 9, 9000),
+        ]
+        regressions = suite.compare(results, baseline, tolerance=0.25)
+        self.assertEqual(len(regressions), 3)
+        self.assertTrue(all(regression.startswith('b: ') for regression in regressions))
+
+    def test_save_and_load(self):
+        results = [suite.Result('a', 1.0, 2.0, 3, 4)]
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'baseline.json')
+            suite.save(results, path)
+            self.assertEqual(suite.load(path), {'a': results[0]})
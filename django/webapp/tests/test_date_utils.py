@@ -1,11 +1,22 @@
-from datetime import date
+import os
+import tempfile
+from array import array
+from datetime import date, timedelta
+from random import Random
 from unittest import TestCase
 
 from pyluach.dates import HebrewDate
-from pyluach.hebrewcal import Year, holiday
+from pyluach.hebrewcal import Year, Month, holiday, _adjust_postponed
+from pyluach.parshios import parshatable
+
+from webapp.lib import hebrew_calendar, occasion_index
+from webapp.lib.parasha_index import ParashaIndex
+from webapp.lib.occasion_index import TorahReadingOccasionIndex, dump_occasion_indexes, load_occasion_indexes, \
+    get_occasion_index
 
 from webapp.lib.date_utils import to_hebrew_date, nth_anniversary_of, next_anniversary_of, next_reading_of_parasha, \
-    make_torah_reading_occasions_table
+    make_torah_reading_occasions_table, anniversary_key, anniversary_keys_between, nth_anniversaries_of, \
+    next_anniversaries_of
 
 
 class TestHebrewDate(TestCase):
@@ -15,6 +26,65 @@ class TestHebrewDate(TestCase):
         self.assertEquals(to_hebrew_date(date(1989, 11, 28), True), HebrewDate(5750, 9, 1))
 
 
+def pyluach_nth_anniversary_of(original_date, number_of_years):
+    # the original implementation using pyluach's Year and Month, as a reference
+    original_year = Year(original_date.year)
+    anniversary_year = Year(original_date.year + number_of_years)
+    month = original_date.month
+    if not original_year.leap and anniversary_year.leap and month == 12:
+        month = 13
+    elif original_year.leap and not anniversary_year.leap and month == 13:
+        month = 12
+    anniversary_month = Month(anniversary_year.year, month)
+    if original_date.day > len(anniversary_month):
+        if month == 12:
+            return HebrewDate(anniversary_year.year, 1, 1)
+        return HebrewDate(anniversary_year.year, month + 1, 1)
+    return HebrewDate(anniversary_year.year, month, original_date.day)
+
+
+class TestHebrewCalendar(TestCase):
+    FIRST_YEAR = 5500
+    LAST_YEAR = 5900
+
+    def test_years_and_months(self):
+        for year in range(self.FIRST_YEAR, self.LAST_YEAR):
+            self.assertEquals(hebrew_calendar.is_leap(year), Year(year).leap)
+            self.assertEquals(hebrew_calendar.year_length(year), len(Year(year)))
+            self.assertEquals(hebrew_calendar.months_of_year(year), tuple(Year(year)))
+            for month in Year(year):
+                self.assertEquals(hebrew_calendar.month_length(year, month), len(Month(year, month)))
+                first_day = HebrewDate(year, month, 1)
+                self.assertEquals(hebrew_calendar.to_day_number(year, month, 1), first_day.to_pydate().toordinal())
+
+    def test_day_numbers(self):
+        day = HebrewDate(self.FIRST_YEAR, 7, 1)
+        while day.year < self.LAST_YEAR:
+            day_number = day.to_pydate().toordinal()
+            self.assertEquals(hebrew_calendar.from_day_number(day_number), day.tuple())
+            self.assertEquals(hebrew_calendar.to_day_number(*day.tuple()), day_number)
+            self.assertEquals(hebrew_calendar.weekday(day_number), day.weekday())
+            self.assertEquals(hebrew_calendar.shabbat_on_or_after(day_number), day.shabbos().to_pydate().toordinal())
+            day += 5
+
+    def test_postponed_fasts(self):
+        for year in range(self.FIRST_YEAR, self.LAST_YEAR):
+            for month, day in ((7, 3), (10, 10), (13 if Year(year).leap else 12, 13), (4, 17), (5, 9)):
+                fast = _adjust_postponed(HebrewDate(year, month, day))
+                self.assertEquals(hebrew_calendar.adjust_postponed(hebrew_calendar.to_day_number(year, month, day),
+                                                                   month),
+                                  fast.to_pydate().toordinal())
+
+    def test_anniversaries(self):
+        for year in range(self.FIRST_YEAR, self.LAST_YEAR, 7):
+            for month in Year(year):
+                for day in {1, 29, len(Month(year, month))}:
+                    original_date = HebrewDate(year, month, day)
+                    for number_of_years in (1, 2, 3, 13, 19, 50):
+                        self.assertEquals(nth_anniversary_of(original_date, number_of_years).tuple(),
+                                          pyluach_nth_anniversary_of(original_date, number_of_years).tuple())
+
+
 class TestNthAnniversaryOf(TestCase):
     def test_adar_bar_mitzvah_paradox(self):
         older_kids_birthday = HebrewDate(5746, 12, 16)
@@ -67,6 +137,63 @@ class TestNextAnniversaryOf(TestCase):
         self.assertEquals(next_anniversary_of(original_date, original_date + 1), next_anniversary)
 
 
+class TestAnniversaryKeys(TestCase):
+    def test_adar_keys(self):
+        self.assertEquals(anniversary_key(HebrewDate(5745, 12, 16)), 1316)
+        self.assertEquals(anniversary_key(HebrewDate(5746, 12, 16)), 1216)
+        self.assertEquals(anniversary_key(HebrewDate(5746, 13, 16)), 1316)
+        self.assertEquals(anniversary_key(HebrewDate(5750, 8, 30)), 830)
+
+    def test_keys_between_match_anniversaries(self):
+        original_dates = [HebrewDate(5745, 12, 16), HebrewDate(5746, 12, 30), HebrewDate(5746, 13, 2),
+                          HebrewDate(5750, 8, 30), HebrewDate(5750, 9, 30), HebrewDate(5750, 7, 1),
+                          HebrewDate(5750, 6, 29)]
+        start = HebrewDate(5750, 1, 1)
+        end = HebrewDate(5760, 1, 1)
+        keys_by_year = anniversary_keys_between(start, end)
+        for original_date in original_dates:
+            for year in range(5751, 5760):
+                anniversary = nth_anniversary_of(original_date, year - original_date.year)
+                self.assertIn(anniversary_key(original_date), keys_by_year[anniversary.year])
+                self.assertEquals(anniversary_keys_between(anniversary, anniversary)[anniversary.year] &
+                                  {anniversary_key(original_date)}, {anniversary_key(original_date)})
+                self.assertNotIn(anniversary_key(original_date),
+                                 anniversary_keys_between(anniversary + 1, anniversary + 1).get(year, set()))
+
+    def test_short_month_anniversaries(self):
+        # 5751 has a short Cheshvan, so the anniversary of 30 Cheshvan is on 1 Kislev
+        self.assertEquals(anniversary_keys_between(HebrewDate(5751, 9, 1), HebrewDate(5751, 9, 1)),
+                          {5751: {830, 901}})
+
+
+class TestAnniversaryArrays(TestCase):
+    def setUp(self):
+        random = Random(613)
+        self.original_dates = [HebrewDate(5746, 12, 30), HebrewDate(5746, 13, 29), HebrewDate(5745, 12, 29),
+                               HebrewDate(5750, 8, 30), HebrewDate(5750, 9, 30)]
+        self.original_dates += [to_hebrew_date(date(1900, 1, 1) + timedelta(days=random.randrange(40000)), False)
+                                for _ in range(1000)]
+        self.years = array('i', (original_date.year for original_date in self.original_dates))
+        self.months = array('i', (original_date.month for original_date in self.original_dates))
+        self.days = array('i', (original_date.day for original_date in self.original_dates))
+
+    def test_nth_anniversaries(self):
+        for number_of_years in (1, 13, 30):
+            anniversaries = zip(*nth_anniversaries_of(self.years, self.months, self.days, number_of_years))
+            for original_date, anniversary in zip(self.original_dates, anniversaries):
+                self.assertEquals(anniversary, nth_anniversary_of(original_date, number_of_years).tuple())
+
+    def test_next_anniversaries(self):
+        for reference_date in (HebrewDate(5790, 1, 1), HebrewDate(5790, 12, 30), HebrewDate(5791, 9, 1)):
+            anniversaries = zip(*next_anniversaries_of(self.years, self.months, self.days, reference_date))
+            for original_date, anniversary in zip(self.original_dates, anniversaries):
+                self.assertEquals(anniversary, next_anniversary_of(original_date, reference_date).tuple())
+
+    def test_invalid_reference_date(self):
+        with self.assertRaises(ValueError):
+            next_anniversaries_of(self.years, self.months, self.days, HebrewDate(5700, 1, 1))
+
+
 class TestNextReadingOfParasha(TestCase):
     def test_next_reading_is_today(self):
         self.assertEquals(next_reading_of_parasha(2, HebrewDate(5780, 8, 11)), HebrewDate(5780, 8, 11))
@@ -85,6 +212,25 @@ class TestNextReadingOfParasha(TestCase):
                           next_reading_of_parasha(21, HebrewDate(5780, 8, 1)))
 
 
+class TestParashaIndex(TestCase):
+    def test_same_as_pyluach(self):
+        for israel in (True, False):
+            index = ParashaIndex(5770, 5790, israel)
+            for year in range(5770, 5791):
+                for shabbat, parshiot in parshatable(year, israel).items():
+                    self.assertEquals(index.parshiot_on(shabbat), None if parshiot is None else tuple(parshiot))
+                    for parasha_number in range(54):
+                        self.assertEquals(index.is_read_on(parasha_number, shabbat),
+                                          parshiot is not None and parasha_number in parshiot)
+                        self.assertFalse(index.is_read_on(parasha_number, shabbat + 1))
+
+    def test_israel_and_diaspora(self):
+        # the eighth day of Pesach was on Shabbat, so Acharei Mos was read a week earlier in Israel
+        self.assertTrue(ParashaIndex(5779, 5779, israel=True).is_read_on(28, HebrewDate(5779, 1, 22)))
+        self.assertFalse(ParashaIndex(5779, 5779, israel=False).is_read_on(28, HebrewDate(5779, 1, 22)))
+        self.assertEquals(next_reading_of_parasha(28, HebrewDate(5779, 1, 16), israel=False), HebrewDate(5779, 1, 29))
+
+
 class TestTorahReadingOccasions(TestCase):
     def test_occasions(self):
         for year in (5779, 5780):
@@ -114,3 +260,71 @@ class TestTorahReadingOccasions(TestCase):
                 self.assertEquals(number_of_shabbatot, expected_number_of_shabbatot)
                 self.assertEquals(len(set(rosh_chodesh_months)), 13 if Year(year).leap else 12)
                 self.assertEquals(holidays_count, 32 if israel else 35)
+
+
+class TestTorahReadingOccasionIndex(TestCase):
+    def setUp(self):
+        self.index = TorahReadingOccasionIndex.build(5779, 5781, israel=True, jerusalem=False)
+
+    def test_tables(self):
+        for year in (5779, 5780, 5781):
+            table = self.index.table_for_year(year)
+            self.assertEquals(dict(table), dict(make_torah_reading_occasions_table(year, True, False)))
+            self.assertEquals(list(table), sorted(table))
+            with self.assertRaises(TypeError):
+                table[HebrewDate(year, 7, 1)] = None
+        # outside of the index
+        for year in (5778, 5782):
+            self.assertEquals(dict(self.index.table_for_year(year)),
+                              dict(make_torah_reading_occasions_table(year, True, False)))
+            self.assertEquals(list(self.index.table_for_year(year)), sorted(self.index.table_for_year(year)))
+
+    def test_occasions_between(self):
+        start, end = HebrewDate(5780, 6, 20), HebrewDate(5781, 7, 3)
+        occasions = self.index.occasions_between(start, end)
+        expected = [(day, occasion) for year in (5780, 5781)
+                    for day, occasion in make_torah_reading_occasions_table(year, True, False).items()
+                    if start <= day <= end]
+        self.assertEquals(occasions, sorted(expected))
+        self.assertEquals(occasions[-1], (HebrewDate(5781, 7, 3), make_torah_reading_occasions_table(
+            5781, True, False)[HebrewDate(5781, 7, 3)]))
+
+        # partly outside of the index, on both sides
+        start, end = HebrewDate(5777, 12, 1), HebrewDate(5782, 7, 3)
+        expected = [(day, occasion) for year in range(5777, 5783)
+                    for day, occasion in make_torah_reading_occasions_table(year, True, False).items()
+                    if start <= day <= end]
+        self.assertEquals(self.index.occasions_between(start, end), sorted(expected))
+        # entirely outside of it
+        start, end = HebrewDate(5790, 7, 1), HebrewDate(5790, 7, 30)
+        self.assertEquals(self.index.occasions_between(start, end),
+                          sorted((day, occasion) for day, occasion in
+                                 make_torah_reading_occasions_table(5790, True, False).items() if start <= day <= end))
+
+    def test_next_occasion(self):
+        self.assertEquals(self.index.next_occasion(HebrewDate(5780, 7, 1)),
+                          (HebrewDate(5780, 7, 2), make_torah_reading_occasions_table(5780, True, False)[
+                              HebrewDate(5780, 7, 2)]))
+        day, occasion = self.index.next_occasion(HebrewDate(5780, 11, 16))
+        self.assertEquals(occasion.description, 'Shabbat')
+        # past the end of the index, and before its start
+        self.assertEquals(self.index.next_occasion(HebrewDate(5781, 6, 29)),
+                          (HebrewDate(5782, 7, 1), make_torah_reading_occasions_table(5782, True, False)[
+                              HebrewDate(5782, 7, 1)]))
+        self.assertEquals(self.index.next_occasion(HebrewDate(5778, 6, 29))[0], HebrewDate(5779, 7, 1))
+        day, occasion = self.index.next_occasion(HebrewDate(5770, 7, 3))
+        self.assertEquals(day, min(day for day in make_torah_reading_occasions_table(5770, True, False)
+                                   if day > HebrewDate(5770, 7, 3)))
+
+    def test_serialization(self):
+        # loading installs the index for the whole process, so the ones installed before are put back afterwards
+        self.addCleanup(occasion_index._indexes.update, dict(occasion_index._indexes))
+        self.addCleanup(occasion_index._indexes.clear)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'occasions.json')
+            dump_occasion_indexes(path, [self.index])
+            load_occasion_indexes(path)
+        loaded_index = get_occasion_index(israel=True, jerusalem=False, year=5780)
+        self.assertIsNot(loaded_index, self.index)
+        self.assertEquals((loaded_index.first_year, loaded_index.last_year), (5779, 5781))
+        self.assertEquals(dict(loaded_index.table_for_year(5780)), dict(self.index.table_for_year(5780)))
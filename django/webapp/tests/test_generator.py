@@ -0,0 +1,65 @@
+from datetime import date
+from io import StringIO
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import TestCase
+
+from webapp.generator import generate_people
+from webapp.models import Synagogue, Person, Gender
+
+TODAY = date(2020, 1, 1)
+
+
+class TestGenerator(TestCase):
+    def setUp(self):
+        self.synagogue = Synagogue.objects.create(name='Klal Yisrael',
+                                                  member_creator=User.objects.create(username='blah'))
+
+    def fields(self, people):
+        return [(person.first_name, person.last_name, person.date_of_birth, person.date_of_birth_after_sunset,
+                 person.date_of_death, person.yichus, person.bar_mitzvah_parasha, person.father_id is None,
+                 person.wife_id is None) for person in people]
+
+    def test_generate(self):
+        generate_people(self.synagogue, 500, seed=1, batch_size=100, today=TODAY)
+        people = {person.pk: person for person in self.synagogue.people}
+        self.assertEqual(len(people), 500)
+        for person in people.values():
+            # the links only point at the generated people
+            for relative_id in (person.father_id, person.mother_id, person.wife_id):
+                self.assertTrue(relative_id is None or relative_id in people)
+            if person.father_id is not None:
+                self.assertEqual(people[person.father_id].gender, Gender.MALE)
+                self.assertEqual(person.yichus, people[person.father_id].yichus)
+                self.assertLess(people[person.mother_id].date_of_birth, person.date_of_birth)
+            self.assertLessEqual(person.date_of_birth, TODAY)
+        self.assertTrue(any(person.father_id is not None and people[person.father_id].father_id is not None
+                            for person in people.values()))
+        self.assertTrue(any(person.bar_mitzvah_parasha is not None for person in people.values()))
+        self.assertTrue(any(person.date_of_birth_after_sunset for person in people.values()))
+
+        # the keys after the generated ones are still free
+        self.assertGreater(Person.objects.create(synagogue=self.synagogue, first_name='a').pk, max(people))
+
+    def test_deterministic(self):
+        first = generate_people(self.synagogue, 200, seed=2, today=TODAY)
+        second = generate_people(self.synagogue, 200, seed=2, today=TODAY)
+        self.assertEqual(self.fields(first), self.fields(second))
+        self.assertNotEqual(self.fields(first), self.fields(generate_people(self.synagogue, 200, seed=3, today=TODAY)))
+
+    def test_command(self):
+        out = StringIO()
+        call_command('generate_synagogue', '50', '--name', 'generated', stdout=out)
+        self.assertIn('with seed 0 as of 2020-01-01', out.getvalue())
+        self.assertEqual(Synagogue.objects.get(name='generated').people.count(), 50)
+        # the default day is fixed
+        self.assertEqual(self.fields(Synagogue.objects.get(name='generated').people.order_by('pk')),
+                         self.fields(generate_people(self.synagogue, 50, today=TODAY)))
+        Person.objects.filter(synagogue=self.synagogue).delete()
+
+        call_command('generate_synagogue', '50', '--name', 'later', '--today', '2030-01-01', stdout=StringIO())
+        self.assertGreater(Synagogue.objects.get(name='later').people.order_by('date_of_birth').last().date_of_birth,
+                           TODAY)
+        call_command('generate_synagogue', '20', '--synagogue', self.synagogue.pk, stdout=StringIO())
+        self.assertEqual(self.synagogue.people.count(), 20)
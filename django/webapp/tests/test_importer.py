@@ -0,0 +1,131 @@
+import csv
+from io import StringIO
+import os
+import sqlite3
+import tempfile
+from datetime import date
+
+from django.contrib.auth.models import User
+from django.core.management import call_command, CommandError
+from django.test import TestCase
+
+from webapp.importer import MemberImporter, rows_from_cursor
+from webapp.models import Synagogue, Person, Gender, Yichus, AliyaScheduleEntry, AliyaPrecedenceReason, \
+    AliyaScheduleUpdate
+from webapp.schedule import build_aliya_schedule, process_aliya_schedule_updates
+
+COLUMNS = ['ID', 'first_name', 'last_name', 'gender', 'date_of_birth', 'is_member', 'yichus', 'father', 'mother',
+           'wife']
+
+
+class TestImportMembers(TestCase):
+    def setUp(self):
+        self.synagogue = Synagogue.objects.create(name='Klal Yisrael',
+                                                  member_creator=User.objects.create(username='blah'))
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'members.csv')
+        self.rows = [
+            ['1', 'Dad', 'Levi', 'male', '1950-01-01 00:00:00', '0', 'levi', '', '', '2'],
+            ['2', 'Mom', 'Levi', 'female', '1952-03-03', '0', '', '', '', ''],
+        ]
+        for i in range(3, 30):
+            self.rows.append([str(i), 'Child {}'.format(i), 'Levi', '1', '1980-01-{:02}'.format(i), '-1', '2', '1',
+                              '2', ''])
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write_csv(self, rows):
+        with open(self.path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(COLUMNS)
+            writer.writerows(rows)
+
+    def import_members(self):
+        call_command('import_members', self.synagogue.pk, self.path, '--map', 'ID=external_id', '--batch-size', '5',
+                     stdout=StringIO())
+
+    def check_imported(self):
+        self.assertEqual(self.synagogue.people.count(), 29)
+        dad = Person.objects.get(external_id='1')
+        mom = Person.objects.get(external_id='2')
+        self.assertEqual(dad.wife, mom)
+        self.assertEqual(dad.yichus, Yichus.LEVI)
+        self.assertEqual(dad.date_of_birth, date(1950, 1, 1))
+        self.assertFalse(dad.is_member)
+        self.assertEqual(len(dad.children), 27)
+        child = Person.objects.get(external_id='3')
+        self.assertEqual((child.father, child.mother, child.gender, child.is_member), (dad, mom, Gender.MALE, True))
+        # bulk_create doesn't call save(), so the derived fields are set by the importer
+        self.assertEqual(child.hebrew_birth_year, 5740)
+
+    def test_import(self):
+        self.write_csv(self.rows)
+        self.import_members()
+        self.check_imported()
+        self.assertFalse(os.path.exists(self.path + '.checkpoint'))
+        # changed once for every batch, although bulk_create and bulk_update don't send signals
+        self.synagogue.refresh_from_db()
+        self.assertEqual(self.synagogue.version, 12)
+
+    def test_resume(self):
+        bad_rows = list(self.rows)
+        bad_rows[12] = bad_rows[12][:4] + ['not a date'] + bad_rows[12][5:]
+        self.write_csv(bad_rows)
+        with self.assertRaises(CommandError):
+            self.import_members()
+        # the batches before the bad row were imported
+        self.assertEqual(self.synagogue.people.count(), 10)
+        self.assertTrue(os.path.exists(self.path + '.checkpoint'))
+
+        self.write_csv(self.rows)
+        self.import_members()
+        self.check_imported()
+
+    def test_interrupted_before_checkpoint(self):
+        # the first batch was inserted, but the import was interrupted before saving the checkpoint
+        MemberImporter(self.synagogue, {'ID': 'external_id'}, batch_size=5).import_people(
+            {column: value for column, value in zip(COLUMNS, row)} for row in self.rows[:5])
+        self.write_csv(self.rows)
+        self.import_members()
+        self.check_imported()
+
+    def test_duplicates(self):
+        self.write_csv(self.rows[:3] + [self.rows[1]])
+        with self.assertRaisesRegex(CommandError, 'rows 2 and 4 have the same external_id 2'):
+            self.import_members()
+        self.assertEqual(self.synagogue.people.count(), 0)
+
+        # in different batches
+        self.write_csv(self.rows + [self.rows[1]])
+        with self.assertRaisesRegex(CommandError, 'row 30: there is already a person with the external_id 2'):
+            self.import_members()
+        self.assertEqual(self.synagogue.people.count(), 25)
+
+    def test_aliya_schedules(self):
+        build_aliya_schedule(self.synagogue, 5780)
+        self.write_csv(self.rows)
+        self.import_members()
+        self.assertEqual(process_aliya_schedule_updates(), 29)
+        # Child 7 was born on 18 Tevet, the Shabbat before which is 14 Tevet
+        self.assertEqual(list(AliyaScheduleEntry.objects.filter(person__external_id='7').values_list('date', 'reason')),
+                         [(date(2020, 1, 11), AliyaPrecedenceReason.BIRTHDAY)])
+
+    def test_aliya_schedules_of_earlier_import(self):
+        # imported before, and not in this export
+        earlier = Person.objects.create(synagogue=self.synagogue, first_name='Earlier', external_id='100')
+        build_aliya_schedule(self.synagogue, 5780)
+        process_aliya_schedule_updates()
+        self.write_csv(self.rows)
+        self.import_members()
+        self.assertFalse(AliyaScheduleUpdate.objects.filter(person_id=earlier.pk).exists())
+        self.assertEqual(process_aliya_schedule_updates(), 29)
+
+    def test_cursor(self):
+        connection = sqlite3.connect(':memory:')
+        connection.execute('CREATE TABLE members ({})'.format(', '.join(COLUMNS)))
+        connection.executemany('INSERT INTO members VALUES ({})'.format(', '.join('?' * len(COLUMNS))), self.rows)
+        importer = MemberImporter(self.synagogue, {'ID': 'external_id'}, batch_size=7)
+        importer.import_people(rows_from_cursor(connection.execute('SELECT * FROM members'), 4))
+        importer.link_family(rows_from_cursor(connection.execute('SELECT * FROM members'), 4))
+        self.check_imported()
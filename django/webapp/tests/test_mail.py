@@ -0,0 +1,78 @@
+from datetime import timedelta
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core import mail
+from django.test import TestCase
+from django.utils import timezone
+from rest_framework import status
+
+from webapp.mail import send_queued_mail, send_mail, _claim, MAX_ATTEMPTS
+from webapp.models import OutgoingEmail
+
+
+class TestMailQueue(TestCase):
+    def queue(self, count):
+        for i in range(count):
+            send_mail('user{}@example.com'.format(i), 'subject', 'webapp/password_reset.html',
+                      {'username': 'user', 'reset_password_url': 'url'})
+
+    def test_password_reset_is_queued(self):
+        User.objects.create_user('john', 'jd@gmail.com', 'doe')
+        response = self.client.post('/password_reset/', {'email': 'jd@gmail.com'}, HTTP_USER_AGENT='test')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(mail.outbox), 0)
+        email = OutgoingEmail.objects.get()
+        self.assertEqual(email.to_email, 'jd@gmail.com')
+        self.assertIn('reset', email.html_message)
+
+        self.assertEqual(send_queued_mail(), 1)
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ['jd@gmail.com'])
+        self.assertEqual(mail.outbox[0].alternatives[0][1], 'text/html')
+        # sent only once
+        self.assertEqual(send_queued_mail(), 0)
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_one_connection_per_batch(self):
+        self.queue(5)
+        with mock.patch('django.core.mail.backends.locmem.EmailBackend.open') as open_connection:
+            self.assertEqual(send_queued_mail(batch_size=3), 3)
+        self.assertEqual(open_connection.call_count, 1)
+        self.assertEqual(send_queued_mail(batch_size=3), 2)
+        self.assertEqual(len(mail.outbox), 5)
+
+    def test_retry_with_backoff(self):
+        self.queue(2)
+        with mock.patch('django.core.mail.backends.locmem.EmailBackend.send_messages', side_effect=OSError('down')), \
+                self.assertLogs('yaamod.webapp.mail', 'ERROR'):
+            self.assertEqual(send_queued_mail(), 0)
+        email = OutgoingEmail.objects.first()
+        self.assertEqual(email.attempts, 1)
+        self.assertIn('down', email.last_error)
+        self.assertGreater(email.next_attempt_at, timezone.now())
+        # not retried before it is due
+        self.assertEqual(send_queued_mail(), 0)
+
+        OutgoingEmail.objects.update(next_attempt_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(send_queued_mail(), 2)
+        self.assertEqual(len(mail.outbox), 2)
+
+    def test_claims(self):
+        self.queue(3)
+        # a sender which claimed two and died before sending them
+        self.assertEqual(len(_claim(batch_size=2)), 2)
+        self.assertEqual(send_queued_mail(), 1)
+        self.assertEqual(send_queued_mail(), 0)
+
+        # they are due again once the claim expires
+        OutgoingEmail.objects.filter(sent_at=None).update(next_attempt_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(send_queued_mail(), 2)
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertEqual(OutgoingEmail.objects.filter(attempts=1).count(), 3)
+
+    def test_give_up(self):
+        self.queue(1)
+        OutgoingEmail.objects.update(attempts=MAX_ATTEMPTS)
+        self.assertEqual(send_queued_mail(), 0)
+        self.assertEqual(len(mail.outbox), 0)
@@ -1,15 +1,25 @@
-from datetime import date
+import importlib
+import math
+from datetime import date, timedelta
+from unittest import skipUnless
 
 from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError
-from django.test import TestCase
+from django.db import connection, transaction
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
 from pyluach.dates import HebrewDate
 
-from webapp.lib.date_utils import nth_anniversary_of, next_anniversary_of
-from webapp.models import Synagogue, Person, Yichus, AliyaPrecedenceReason, Gender
+from webapp import family
+from webapp.aliya import AliyaPrecedenceEngine
+from webapp.family import get_family_graph, drop_family_graph
+from webapp.lib.date_utils import nth_anniversary_of, next_anniversary_of, to_hebrew_date, anniversary_key, \
+    nth_gregorian_anniversary_of
+from webapp.models import Synagogue, Person, Yichus, AliyaPrecedenceReason, Gender, AliyaScheduleEntry, \
+    AliyaScheduleUpdate
+from webapp.schedule import build_aliya_schedule, process_aliya_schedule_updates
 
 
-class MembersTestCase(TestCase):
+class MembersMixin:
     def setUp(self):
         self.synagogue = Synagogue.objects.create(name='Klal Yisrael',
                                                   member_creator=User.objects.create(username='blah'))
@@ -42,6 +52,10 @@ class MembersTestCase(TestCase):
             manual_paternal_name='משה בן שמואל')
 
 
+class MembersTestCase(MembersMixin, TestCase):
+    pass
+
+
 class TestSynagogue(MembersTestCase):
     def test_members(self):
         self.assertEquals(self.synagogue.people.count(), 10)
@@ -56,6 +70,25 @@ class TestSynagogue(MembersTestCase):
 
         self.assertIn(HebrewDate(5780, 7, 1), self.synagogue.get_torah_reading_occasions_table(5780))
 
+    @skipUnless(connection.vendor == 'sqlite', 'the query plan is SQLite specific')
+    def test_member_queries_use_indexes(self):
+        def query_plan(queryset):
+            sql, params = queryset.query.sql_with_params()
+            with connection.cursor() as cursor:
+                cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+                return ' '.join(row[-1] for row in cursor.fetchall())
+
+        self.assertIn('USING INDEX person_member_idx (synagogue_id=? AND is_member=?)',
+                      query_plan(self.synagogue.members))
+        # sorted by the index, without a temporary b-tree
+        plan = query_plan(self.synagogue.male_members.order_by('last_aliya_date'))
+        self.assertIn('USING INDEX person_member_idx (synagogue_id=? AND is_member=? AND gender=?)', plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+        self.assertIn('USING INDEX person_aliya_candidates_idx',
+                      query_plan(self.synagogue.members.filter(cannot_get_aliya=False).order_by('last_aliya_date')))
+        self.assertIn('USING INDEX person_bar_mitzvah_idx',
+                      query_plan(self.synagogue.male_members.eligible_for_aliya()))
+
 
 class TestPerson(MembersTestCase):
     def test_sanity(self):
@@ -131,6 +164,37 @@ class TestPerson(MembersTestCase):
                                                                 self.brother_in_law, self.baby})
         self.assertEquals(self.brother_in_law.immediate_family_members, {self.wife.mother, self.wife.father, self.wife})
 
+    def test_hebrew_anniversaries(self):
+        self.assertEquals((self.father.hebrew_death_year, self.father.hebrew_death_anniversary), (5779, 903))
+        self.assertIsNone(self.father.hebrew_birth_anniversary)
+        self.assertEquals((self.reuven.hebrew_birth_year, self.reuven.hebrew_birth_anniversary), (5741, 1008))
+
+        self.reuven.date_of_birth_after_sunset = True
+        self.reuven.save()
+        self.reuven.refresh_from_db()
+        self.assertEquals(self.reuven.hebrew_birth_anniversary, 1009)
+
+    def test_with_yahrzeit_between(self):
+        people = self.synagogue.people
+        yahrzeit = HebrewDate(5780, 9, 3)
+        self.assertEquals(set(people.with_yahrzeit_between(yahrzeit, yahrzeit)), {self.father})
+        self.assertEquals(set(people.with_yahrzeit_between(yahrzeit - 6, yahrzeit)), {self.father})
+        self.assertFalse(people.with_yahrzeit_between(yahrzeit + 1, yahrzeit + 50).exists())
+        # no yahrzeit in the year of death
+        self.assertFalse(people.with_yahrzeit_between(HebrewDate(5779, 9, 3), HebrewDate(5779, 9, 3)).exists())
+
+        for mother_yahrzeit in (next_anniversary_of(self.mother.hebrew_date_of_death, HebrewDate(5780, 1, 1)),
+                                next_anniversary_of(self.mother.hebrew_date_of_death, HebrewDate(5781, 1, 1))):
+            self.assertEquals(set(people.with_yahrzeit_between(mother_yahrzeit, mother_yahrzeit)), {self.mother})
+
+        with self.assertNumQueries(1):
+            self.assertEquals(set(people.with_yahrzeit_between(HebrewDate(5780, 1, 1), HebrewDate(5781, 1, 1))),
+                              {self.father, self.mother})
+
+    def test_with_birthday_between(self):
+        birthday = next_anniversary_of(self.reuven.hebrew_date_of_birth, HebrewDate(5780, 10, 1))
+        self.assertEquals(set(self.synagogue.members.with_birthday_between(birthday - 1, birthday)), {self.reuven})
+
     def test_can_get_aliya(self):
         self.assertEquals(self.reuven.bar_mitzvah_date, nth_anniversary_of(self.reuven.hebrew_date_of_birth, 13))
         self.assertTrue(self.reuven.is_bar_mitzvah)
@@ -152,6 +216,54 @@ class TestPerson(MembersTestCase):
         self.assertFalse(self.wife.is_bar_mitzvah)
         self.assertFalse(self.wife.can_get_aliya)
 
+    def test_eligible_for_aliya(self):
+        self.assertEquals(self.reuven.gregorian_bar_mitzvah_date, date(1993, 12, 22))
+        # the date of birth is after sunset, a day before the Hebrew date
+        self.reuven.date_of_birth_after_sunset = True
+        self.reuven.save()
+        self.assertEquals(self.reuven.gregorian_bar_mitzvah_date, date(1993, 12, 23))
+        self.assertIsNone(self.wife.gregorian_bar_mitzvah_date)
+
+        self.assertEquals(set(self.synagogue.male_members.eligible_for_aliya()),
+                          {member for member in self.synagogue.male_members if member.can_get_aliya})
+        self.assertEquals(set(self.synagogue.male_members.eligible_for_aliya()),
+                          {self.brother, self.reuven, self.brother_in_law})
+        self.assertNotIn(self.reuven, self.synagogue.male_members.eligible_for_aliya(date(1993, 12, 22)))
+
+        # not saved yet, so the stored date is stale
+        baby = Person.objects.get(pk=self.baby.pk)
+        baby.date_of_birth = date(2000, 1, 1)
+        self.assertTrue(baby.is_bar_mitzvah)
+
+    def test_save_update_fields(self):
+        self.baby.date_of_birth = date(2000, 1, 1)
+        self.baby.phone_number = '03-555-5555'
+        self.baby.save(update_fields=['date_of_birth'])
+        self.assertIn(self.baby, self.synagogue.male_members.eligible_for_aliya())
+        baby = Person.objects.get(pk=self.baby.pk)
+        self.assertEquals((baby.gregorian_bar_mitzvah_date, baby.hebrew_birth_year),
+                          (nth_gregorian_anniversary_of(date(2000, 1, 1), False, 13), 5760))
+        self.assertEquals(baby.phone_number, '')
+        # the phone number wasn't saved
+        self.assertEquals(self.baby.changed_fields(['date_of_birth', 'phone_number']), {'phone_number'})
+
+    def test_bulk_derived_fields(self):
+        # neither calls save()
+        self.synagogue.people.filter(pk=self.baby.pk).update(date_of_birth=date(2000, 1, 1))
+        self.assertIn(self.baby, self.synagogue.male_members.eligible_for_aliya())
+        self.reuven.date_of_birth_after_sunset = True
+        self.reuven.date_of_death = date(2019, 11, 11)
+        Person.objects.bulk_update([self.reuven], ['date_of_birth_after_sunset', 'date_of_death'])
+        self.reuven.refresh_from_db()
+        self.assertEquals((self.reuven.gregorian_bar_mitzvah_date, self.reuven.hebrew_birth_anniversary,
+                           self.reuven.hebrew_death_year), (date(1993, 12, 23), 1009, 5780))
+
+        self.synagogue.people.filter(pk=self.baby.pk).update(gender=Gender.FEMALE)
+        self.assertNotIn(self.baby, self.synagogue.male_members.eligible_for_aliya())
+        # nothing is derived from the other fields
+        with self.assertNumQueries(1):
+            self.synagogue.people.filter(pk=self.baby.pk).update(is_member=False)
+
 
 class TestAliyaPrecedence(MembersTestCase):
     def test_yahrzeit_aliya(self):
@@ -190,6 +302,14 @@ class TestAliyaPrecedence(MembersTestCase):
         # has no bar mitzvah parasha defined
         self.assertFalse(self.brother.is_bar_mitzvah_parasha_shabbat(HebrewDate(5780, 10, 21)))
 
+    def test_bar_mitzvah_parasha_shabbat_in_diaspora(self):
+        # the eighth day of Pesach was on Shabbat, so Acharei Mos was read a week later outside of Israel
+        self.brother.bar_mitzvah_parasha = 28
+        self.assertTrue(self.brother.is_bar_mitzvah_parasha_shabbat(HebrewDate(5779, 1, 22)))
+        self.synagogue.in_israel = False
+        self.assertFalse(self.brother.is_bar_mitzvah_parasha_shabbat(HebrewDate(5779, 1, 22)))
+        self.assertTrue(self.brother.is_bar_mitzvah_parasha_shabbat(HebrewDate(5779, 1, 29)))
+
     def test_aliya_precedence(self):
         self.assertEquals(self.reuven.get_aliya_precedence(HebrewDate(5780, 10, 21)),
                           AliyaPrecedenceReason.BAR_MITZVAH_PARASHA)
@@ -231,3 +351,227 @@ class TestAliyaPrecedence(MembersTestCase):
         assert olim[1][0].last_aliya_hebrew_date == HebrewDate(5780, 8, 4)
         assert olim[2][0].last_aliya_date == date(2019, 12, 7)
         assert olim[2][0].last_aliya_hebrew_date == HebrewDate(5780, 9, 9)
+
+
+class TestAliyaPrecedenceEngine(MembersTestCase):
+    def test_same_as_per_person_precedence(self):
+        # covers the yahrzeit, birthdays and bar mitzvah parasha of the test family
+        on_date = HebrewDate(5780, 8, 15)
+        while on_date < HebrewDate(5780, 11, 1):
+            expected = [(member, member.get_aliya_precedence(on_date))
+                        for member in self.synagogue.male_members.order_by('pk') if member.can_get_aliya]
+            expected.sort(key=lambda suggestion: (suggestion[1] or math.inf,
+                                                  suggestion[0].last_aliya_date or date.min))
+            self.assertEquals(self.synagogue.get_olim(on_date), expected)
+            on_date += 1
+
+    def test_number_of_queries(self):
+        with self.assertNumQueries(1):
+            self.synagogue.get_olim(HebrewDate(5780, 9, 2))
+
+        for i in range(20):
+            Person.objects.create(synagogue=self.synagogue, first_name='Son {}'.format(i), gender=Gender.MALE,
+                                  is_member=True, date_of_birth=date(1990, 1, i + 1), father=self.brother_in_law,
+                                  bar_mitzvah_parasha=i)
+        with self.assertNumQueries(1):
+            olim = self.synagogue.get_olim(HebrewDate(5780, 9, 2))
+        self.assertEquals(len(olim), 23)
+
+    def test_stale_bar_mitzvah_date(self):
+        # raw SQL doesn't update the bar mitzvah date, which is derived from the date of birth
+        with connection.cursor() as cursor:
+            cursor.execute('UPDATE webapp_person SET date_of_birth = NULL WHERE id = %s', [self.brother.pk])
+        self.assertNotIn(self.brother, [person for person, reason in self.synagogue.get_olim(HebrewDate(5780, 9, 2))])
+
+
+class TestFamilyGraph(MembersMixin, TransactionTestCase):
+    # the graphs are only cached once the transaction which built or patched them is committed
+    def setUp(self):
+        super().setUp()
+        self.addCleanup(family._graphs.clear)
+
+    def family_details(self):
+        return {person.pk: (person.immediate_family_members, set(person.children), person.num_of_children,
+                            person.is_married_woman)
+                for person in Person.objects.select_related('synagogue')}
+
+    def cached_graph(self):
+        return family._graphs.get(self.synagogue.pk)
+
+    def assertSameAsDatabase(self):
+        warm = self.family_details()
+        drop_family_graph(self.synagogue.pk)
+        cold = self.family_details()
+        get_family_graph(self.synagogue.pk)
+        self.assertEquals(warm, cold)
+
+    def test_same_as_database(self):
+        get_family_graph(self.synagogue.pk)
+        self.assertSameAsDatabase()
+
+    def test_edited_links(self):
+        graph = get_family_graph(self.synagogue.pk)
+        self.reuven.wife = None
+        self.reuven.save()
+        # patched rather than rebuilt
+        self.assertIs(get_family_graph(self.synagogue.pk), graph)
+        self.assertFalse(Person.objects.select_related('synagogue').get(pk=self.wife.pk).is_married_woman)
+        self.assertSameAsDatabase()
+
+        self.brother.wife = self.wife
+        self.brother.save()
+        self.baby.father = self.brother
+        self.baby.save()
+        self.assertIn(self.brother,
+                      Person.objects.select_related('synagogue').get(pk=self.wife.pk).immediate_family_members)
+        self.assertEquals(Person.objects.select_related('synagogue').get(pk=self.reuven.pk).num_of_children, 0)
+        self.assertSameAsDatabase()
+
+        self.mother.delete()
+        self.wife.delete()
+        self.assertSameAsDatabase()
+
+        Person.objects.create(synagogue=self.synagogue, first_name='New', father=self.reuven)
+        self.assertEquals(Person.objects.select_related('synagogue').get(pk=self.reuven.pk).num_of_children, 1)
+        self.assertSameAsDatabase()
+
+    def test_rolled_back_edit(self):
+        get_family_graph(self.synagogue.pk)
+        with self.assertRaises(ValueError):
+            with transaction.atomic():
+                Person.objects.create(synagogue=self.synagogue, first_name='Kid', father=self.brother)
+                raise ValueError
+        self.assertEquals(Person.objects.select_related('synagogue').get(pk=self.brother.pk).num_of_children, 0)
+        self.assertSameAsDatabase()
+
+    def test_stale_graph_is_rebuilt(self):
+        graph = get_family_graph(self.synagogue.pk)
+        # as another process would, whose signals don't reach this one's graph
+        self.assertEquals(Person.objects.filter(pk=self.baby.pk).update(father=self.brother), 1)
+        Synagogue.touch(self.synagogue.pk)
+        self.assertEquals(Person.objects.select_related('synagogue').get(pk=self.brother.pk).num_of_children, 1)
+        self.assertIsNot(get_family_graph(self.synagogue.pk), graph)
+        self.assertEquals(self.cached_graph().children_of(self.brother.pk), {self.baby.pk})
+
+    def test_deleted_synagogue_drops_graph(self):
+        get_family_graph(self.synagogue.pk)
+        self.synagogue.delete()
+        self.assertIsNone(self.cached_graph())
+
+    def test_number_of_queries(self):
+        get_family_graph(self.synagogue.pk)
+        wife = Person.objects.select_related('synagogue').get(pk=self.wife.pk)
+        with self.assertNumQueries(0):
+            self.assertTrue(wife.is_married_woman)
+            self.assertEquals(wife.num_of_children, 1)
+        with self.assertNumQueries(1):
+            self.assertEquals(len(wife.immediate_family_members), 5)
+
+
+class TestAliyaSchedule(MembersTestCase):
+    YEAR = 5780
+
+    def entries(self):
+        return set(AliyaScheduleEntry.objects.values_list('person', 'date', 'reason'))
+
+    def assertSameAsRebuilt(self):
+        process_aliya_schedule_updates()
+        self.assertFalse(AliyaScheduleUpdate.objects.exists())
+        entries = self.entries()
+        build_aliya_schedule(self.synagogue, self.YEAR)
+        self.assertEquals(entries, self.entries())
+
+    def test_same_as_get_olim(self):
+        build_aliya_schedule(self.synagogue, self.YEAR)
+        expected = set()
+        for hebrew_date in self.synagogue.get_torah_reading_occasions_table(self.YEAR):
+            for person, reason in self.synagogue.get_olim(hebrew_date):
+                if reason is not None:
+                    expected.add((person.pk, hebrew_date.to_pydate(), reason))
+        self.assertTrue(expected)
+        self.assertEquals(self.entries(), expected)
+
+    def test_incremental_updates(self):
+        build_aliya_schedule(self.synagogue, self.YEAR)
+
+        self.mother.date_of_death = date(2017, 6, 6)
+        self.mother.save()
+        self.assertSameAsRebuilt()
+
+        self.brother.father = None
+        self.brother.save()
+        self.assertSameAsRebuilt()
+
+        self.reuven.bar_mitzvah_parasha = 30
+        self.reuven.save()
+        self.assertSameAsRebuilt()
+
+        Person.objects.get(pk=self.father.pk).delete()
+        self.assertSameAsRebuilt()
+
+    def test_updates_are_queued(self):
+        build_aliya_schedule(self.synagogue, self.YEAR)
+        entries = self.entries()
+        self.mother.date_of_death = date(2017, 6, 6)
+        # the update, the synagogue's version, and queueing the change (without recomputing anything)
+        with self.assertNumQueries(4):
+            self.mother.save()
+        self.assertEquals(self.entries(), entries)
+        self.assertEquals(set(AliyaScheduleUpdate.objects.values_list('person_id', flat=True)), {self.mother.pk})
+
+        with self.assertRaises(ValueError):
+            with transaction.atomic():
+                self.father.date_of_death = date(2018, 6, 6)
+                self.father.save()
+                raise ValueError
+        self.assertEquals(AliyaScheduleUpdate.objects.count(), 1)
+
+        # only the mother's family is loaded
+        engine = AliyaPrecedenceEngine(self.synagogue, {self.mother.pk})
+        self.assertEquals(set(engine.people), {self.mother.pk, self.sister.pk, self.brother.pk, self.reuven.pk})
+        self.assertEquals(set(engine.members), set())
+        self.assertSameAsRebuilt()
+
+    def test_bar_mitzvah_during_the_year(self):
+        # his bar mitzvah is on 6 Shvat 5780 (February 1st 2020), after his father's yahrzeit (3 Kislev 5780) and
+        # before his mother's (5 Adar 5780)
+        boy = Person.objects.create(synagogue=self.synagogue, first_name='Boy', gender=Gender.MALE, is_member=True,
+                                    date_of_birth=date(2007, 1, 25), father=self.father, mother=self.mother)
+        build_aliya_schedule(self.synagogue, self.YEAR)
+        entries = AliyaScheduleEntry.objects.filter(person=boy)
+        self.assertTrue(entries.exists())
+        self.assertFalse(entries.filter(date__lt=boy.gregorian_bar_mitzvah_date).exists())
+        self.assertTrue(AliyaScheduleEntry.objects.filter(person=self.reuven,
+                                                          date__lt=boy.gregorian_bar_mitzvah_date).exists())
+
+    def test_irrelevant_change(self):
+        build_aliya_schedule(self.synagogue, self.YEAR)
+        reuven = Person.objects.get(pk=self.reuven.pk)
+        reuven.phone_number = '03-555-5555'
+        # only the update itself, and the synagogue's version
+        with self.assertNumQueries(2):
+            reuven.save()
+
+
+class TestMigrations(SimpleTestCase):
+    """The data migrations have their own copies of the calculations, which must give the same results as the app's."""
+
+    def dates(self):
+        day = date(1900, 1, 1)
+        while day < date(2040, 1, 1):
+            for after_sunset in (False, True):
+                yield day, after_sunset
+            day += timedelta(days=3)
+
+    def test_hebrew_anniversaries(self):
+        migration = importlib.import_module('webapp.migrations.0003_hebrew_anniversaries')
+        for day, after_sunset in self.dates():
+            hebrew_date = migration.to_hebrew_date(day, after_sunset)
+            self.assertEqual(hebrew_date, to_hebrew_date(day, after_sunset))
+            self.assertEqual(migration.anniversary_key(hebrew_date), anniversary_key(hebrew_date))
+
+    def test_bar_mitzvah_dates(self):
+        migration = importlib.import_module('webapp.migrations.0009_person_gregorian_bar_mitzvah_date')
+        for day, after_sunset in self.dates():
+            self.assertEqual(migration.nth_gregorian_anniversary_of(day, after_sunset, 13),
+                             nth_gregorian_anniversary_of(day, after_sunset, 13))
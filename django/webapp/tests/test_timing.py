@@ -0,0 +1,74 @@
+from django.contrib.auth.models import User
+from django.test import TestCase
+from rest_framework import status
+
+from webapp.lib import timing
+from webapp.models import Synagogue, UserToSynagogue
+from webapp.schedule import build_aliya_schedule
+
+
+class TestTiming(TestCase):
+    def test_spans(self):
+        @timing.timed('double')
+        def double(x):
+            return x * 2
+
+        # nothing is recorded outside of a request
+        self.assertEqual(double(1), 2)
+        timings = timing.start_request()
+        try:
+            double(1)
+            double(2)
+            with timing.span('block'):
+                pass
+            timings.add_query('SELECT 1', 0.5)
+            timings.add_query('SELECT 2', 0.25)
+        finally:
+            self.assertIs(timing.finish_request(), timings)
+        self.assertEqual(set(timings.spans), {'double', 'block'})
+        self.assertEqual((timings.queries, timings.db_seconds), (2, 0.75))
+        self.assertEqual(timings.server_timing(1.0).split(', ')[:3],
+                         ['total;dur=1000.0', 'db;dur=750.0;desc="2 queries"', 'python;dur=250.0'])
+
+    def test_percentiles(self):
+        values = [float(i) for i in range(1, 101)]
+        self.assertEqual([timing.percentile(values, fraction) for fraction in (0.5, 0.95, 0.99)], [50, 95, 99])
+        self.assertEqual(timing.percentile([], 0.5), 0)
+
+        stats = timing.ViewStats(window=10)
+        for i in range(20):
+            stats.add(timing.Sample(i, 0, 1), [(i, 'SELECT {}'.format(i))])
+        summary = stats.summary()
+        self.assertEqual(summary['count'], 20)
+        # only the latest requests
+        self.assertEqual(summary['total_ms']['p50'], 14000)
+        self.assertEqual([statement['sql'] for statement in summary['slowest_statements']],
+                         ['SELECT {}'.format(i) for i in range(19, 14, -1)])
+
+
+class TestTimingMiddleware(TestCase):
+    def setUp(self):
+        timing.aggregate.clear()
+        self.user = User.objects.create_user('john', password='doe')
+        self.synagogue = Synagogue.objects.create(name='Klal Yisrael',
+                                                  member_creator=User.objects.create(username='blah'))
+        UserToSynagogue.objects.create(user=self.user, synagogue=self.synagogue)
+        self.client.force_login(self.user)
+
+    def test_server_timing(self):
+        build_aliya_schedule(self.synagogue, 5780)
+        response = self.client.get('/aliya_schedule?year=5780')
+        metrics = {metric.split(';')[0] for metric in response['Server-Timing'].split(', ')}
+        self.assertEqual(metrics, {'total', 'db', 'python', 'torah_reading_occasions_table'})
+
+    def test_timings_endpoint(self):
+        self.client.get('/person')
+        self.client.get('/person/1')
+        self.assertEqual(self.client.get('/timings').status_code, status.HTTP_403_FORBIDDEN)
+        self.user.is_staff = True
+        self.user.save()
+        summary = self.client.get('/timings').json()
+        self.assertEqual(summary['GET person']['count'], 1)
+        self.assertEqual(summary['GET person/<int:pk>']['count'], 1)
+        self.assertGreater(summary['GET person']['queries']['p50'], 0)
+        self.assertTrue(summary['GET person']['slowest_statements'])
@@ -1,7 +1,22 @@
-from django.test import TestCase
+import csv
+import io
+import json
+from datetime import date
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
 from rest_framework import status
 from django.test.client import Client
 import os
+from unittest import mock, skipUnless
+
+from webapp.models import Person, Synagogue, Gender, AliyaPrecedenceReason
+from webapp.schedule import build_aliya_schedule
+from webapp.serializers import PersonSerializer
+from webapp import search
+from webapp.views import ConditionalGetMixin
 
 
 class RegularContentTypeClient(Client):
@@ -176,3 +191,380 @@ class TestPersonView(ViewTest):
         self.add_person(first_name='b')
         response = self.get_url('/person/1', method='get')
         self.check_response_is_person(response, 'a')
+
+
+class TestPersonListQueries(ViewTest):
+    def setUp(self):
+        self.add_user(login=True)
+        self.add_synagogue()
+        self.synagogue = Synagogue.objects.get()
+
+    def add_family(self, name):
+        father = Person.objects.create(synagogue=self.synagogue, first_name=name + ' father', gender=Gender.MALE)
+        mother = Person.objects.create(synagogue=self.synagogue, first_name=name + ' mother', gender=Gender.FEMALE)
+        father.wife = mother
+        father.save()
+        for i in range(3):
+            Person.objects.create(synagogue=self.synagogue, first_name='{} child {}'.format(name, i),
+                                  gender=Gender.MALE, father=father, mother=mother)
+
+    def count_list_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.get_url('/person', 'get')
+        return len(queries), response.json()
+
+    def test_constant_number_of_queries(self):
+        self.add_family('a')
+        number_of_queries, people = self.count_list_queries()
+        self.assertEqual(len(people), 5)
+        for i in range(10):
+            self.add_family(str(i))
+        self.assertEqual(self.count_list_queries()[0], number_of_queries)
+
+    def test_family_details(self):
+        self.add_family('a')
+        people = {person['first_name']: person for person in self.count_list_queries()[1]}
+        father = people['a father']
+        self.assertEqual(father['num_of_children'], 3)
+        self.assertEqual(father['wife_json'], {'id': people['a mother']['pk'], 'name': 'a mother'})
+        self.assertIsNone(father['husband_json'])
+        self.assertEqual(people['a mother']['husband_json'], {'id': father['pk'], 'name': 'a father'})
+        self.assertEqual(people['a child 0']['father_json'], {'id': father['pk'], 'name': 'a father'})
+        self.assertEqual(people['a child 0']['num_of_children'], 0)
+        self.assertEqual(people['a child 0']['paternal_name'], 'a child 0 בן a father')
+
+    def test_pagination(self):
+        for i in range(3):
+            self.add_family(str(i))
+        self.assertEqual(len(self.get_url('/person', 'get').json()), 15)
+        names = []
+        url = '/person?page_size=4'
+        while url is not None:
+            page = self.get_url(url, 'get').json()
+            self.assertLessEqual(len(page['results']), 4)
+            names.extend(person['first_name'] for person in page['results'])
+            # a person added in the middle of the listing doesn't shift the pages
+            if len(names) == 4:
+                Person.objects.create(synagogue=self.synagogue, first_name='late', gender=Gender.MALE)
+            url = page['next']
+        self.assertEqual(len(names), 16)
+        self.assertEqual(len(set(names)), 16)
+
+    def test_sparse_fieldsets(self):
+        self.add_family('a')
+        with CaptureQueriesContext(connection) as queries:
+            people = self.get_url('/person?fields=pk,first_name,wife_json', 'get').json()
+        for person in people:
+            self.assertEqual(set(person), {'pk', 'first_name', 'wife_json'})
+        list_query = queries.captured_queries[-1]['sql']
+        self.assertNotIn('COUNT', list_query)
+        self.assertEqual(list_query.count('JOIN'), 1)
+        person = self.get_url('/person/{}?fields=num_of_children'.format(people[0]['pk']), 'get').json()
+        self.assertEqual(person, {'num_of_children': 3})
+
+    def test_sparse_fieldsets_without_valid_fields(self):
+        self.add_family('a')
+        people = self.get_url('/person?fields=', 'get').json()
+        self.assertEqual(set(people[0]), set(PersonSerializer.Meta.fields))
+        response = self.get_url('/person?fields=pk,nickname,age', 'get', expected_status=status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.json(), {'fields': 'unknown fields: age, nickname'})
+
+
+class TestFamilyTree(ViewTest):
+    def setUp(self):
+        self.add_user(login=True)
+        self.add_synagogue()
+        self.synagogue = Synagogue.objects.get()
+        # four generations, with the two great-grandchildren being siblings
+        self.generations = []
+        parent = None
+        for generation in range(4):
+            person = Person.objects.create(synagogue=self.synagogue, first_name='gen {}'.format(generation),
+                                           gender=Gender.MALE, father=parent)
+            self.generations.append(person)
+            parent = person
+        self.sibling = Person.objects.create(synagogue=self.synagogue, first_name='sibling', gender=Gender.FEMALE,
+                                             father=self.generations[2])
+
+    def get_tree(self, url, expected_status=status.HTTP_200_OK):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.get_url(url, 'get', expected_status=expected_status)
+        self.assertEqual(len([query for query in queries if 'RECURSIVE' in query['sql']]), 1)
+        return response.json()
+
+    def test_ancestors(self):
+        tree = self.get_tree('/person/{}/ancestors'.format(self.generations[3].pk))
+        self.assertEqual([(person['first_name'], person['depth']) for person in tree],
+                         [('gen 3', 0), ('gen 2', 1), ('gen 1', 2), ('gen 0', 3)])
+        self.assertEqual(tree[1]['father'], self.generations[1].pk)
+
+        tree = self.get_tree('/person/{}/ancestors?depth=1'.format(self.generations[3].pk))
+        self.assertEqual([person['first_name'] for person in tree], ['gen 3', 'gen 2'])
+
+    def test_descendants(self):
+        tree = self.get_tree('/person/{}/descendants'.format(self.generations[1].pk))
+        self.assertEqual([(person['first_name'], person['depth']) for person in tree],
+                         [('gen 1', 0), ('gen 2', 1), ('gen 3', 2), ('sibling', 2)])
+        tree = self.get_tree('/person/{}/descendants?depth=0'.format(self.generations[1].pk))
+        self.assertEqual(len(tree), 1)
+
+    def test_cycle(self):
+        # a corrupt tree in which someone is their own great-grandfather
+        Person.objects.filter(pk=self.generations[0].pk).update(father=self.generations[3])
+        tree = self.get_tree('/person/{}/ancestors?depth=20'.format(self.generations[3].pk))
+        self.assertEqual(len(tree), 4)
+
+    def test_other_synagogue(self):
+        other_synagogue = Synagogue.objects.create(name='other', member_creator=User.objects.create(username='x'))
+        stranger = Person.objects.create(synagogue=other_synagogue, first_name='stranger')
+        self.get_tree('/person/{}/ancestors'.format(stranger.pk), status.HTTP_404_NOT_FOUND)
+        self.get_url('/person/{}/ancestors?depth=x'.format(self.generations[0].pk), 'get',
+                     expected_status=status.HTTP_400_BAD_REQUEST)
+
+
+class TestPersonExport(ViewTest):
+    def setUp(self):
+        self.add_user(login=True)
+        self.add_synagogue()
+        self.synagogue = Synagogue.objects.get()
+        self.father = Person.objects.create(synagogue=self.synagogue, first_name='אברהם', last_name='כהן',
+                                            gender=Gender.MALE)
+        self.son = Person.objects.create(synagogue=self.synagogue, first_name='יצחק', gender=Gender.MALE,
+                                         father=self.father, date_of_birth=date(2000, 1, 1))
+
+    def export(self, export_format):
+        response = self.get_url('/person/export/' + export_format, 'get')
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content).decode('utf-8')
+
+    def test_csv(self):
+        rows = list(csv.DictReader(io.StringIO(self.export('csv').lstrip('\ufeff'))))
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(rows[1]['first_name'], 'יצחק')
+        self.assertEqual(rows[1]['father_id'], str(self.father.pk))
+        self.assertEqual(rows[1]['father_name'], 'אברהם כהן')
+        self.assertEqual(rows[1]['date_of_birth'], '2000-01-01')
+        self.assertEqual(rows[0]['father_name'], '')
+
+    def test_jsonl(self):
+        rows = [json.loads(line) for line in self.export('jsonl').splitlines()]
+        self.assertEqual([row['id'] for row in rows], [self.father.pk, self.son.pk])
+        self.assertEqual(rows[1]['father_name'], 'אברהם כהן')
+        self.assertIsNone(rows[0]['father_name'])
+
+    def test_constant_number_of_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.export('csv')
+        number_of_queries = len(queries)
+        for i in range(20):
+            Person.objects.create(synagogue=self.synagogue, first_name=str(i), father=self.son, mother=self.father)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(len(self.export('jsonl').splitlines()), 22)
+        self.assertEqual(len(queries), number_of_queries)
+
+    def test_unknown_format(self):
+        self.get_url('/person/export/xml', 'get', expected_status=status.HTTP_404_NOT_FOUND)
+
+
+class TestRequestSynagogueQueries(ViewTest):
+    def setUp(self):
+        self.add_user(login=True)
+        self.add_synagogue()
+        self.synagogue = Synagogue.objects.get()
+        self.person = Person.objects.create(synagogue=self.synagogue, first_name='a')
+
+    def assertSynagogueResolvedOnce(self, url, method, data=None, expected_status=status.HTTP_200_OK):
+        with CaptureQueriesContext(connection) as queries:
+            self.get_url(url, method, data, expected_status)
+        synagogue_queries = [query['sql'] for query in queries
+                             if query['sql'].startswith('SELECT "webapp_usertosynagogue"')]
+        self.assertEqual(len(synagogue_queries), 1)
+        self.assertIn('INNER JOIN "webapp_synagogue"', synagogue_queries[0])
+        return len(queries)
+
+    def test_number_of_queries(self):
+        # the session, the user, the synagogue, its version, and the view's own queries
+        self.assertEqual(self.assertSynagogueResolvedOnce('/person', 'get'), 5)
+        self.assertEqual(self.assertSynagogueResolvedOnce('/person/{}'.format(self.person.pk), 'get'), 5)
+        self.assertSynagogueResolvedOnce('/person', 'post', {'first_name': 'b'}, status.HTTP_201_CREATED)
+        self.assertSynagogueResolvedOnce('/synagogue/{}'.format(self.synagogue.pk), 'patch', {'name': 'def'})
+        self.assertSynagogueResolvedOnce('/member_creator_token', 'post')
+
+
+class TestAliyaScheduleView(ViewTest):
+    def setUp(self):
+        self.add_user(login=True)
+        self.add_synagogue()
+        self.synagogue = Synagogue.objects.get()
+        Person.objects.create(synagogue=self.synagogue, first_name='Reuven', gender=Gender.MALE, is_member=True,
+                              date_of_birth=date(1980, 12, 15))
+
+    def test_schedule(self):
+        self.get_url('/aliya_schedule?year=5780', 'get', expected_status=status.HTTP_404_NOT_FOUND)
+        build_aliya_schedule(self.synagogue, 5780)
+        with CaptureQueriesContext(connection) as queries:
+            schedule = self.get_url('/aliya_schedule?year=5780', 'get').json()
+        number_of_queries = len(queries)
+        self.assertEqual(len(schedule['occasions']), len(self.synagogue.get_torah_reading_occasions_table(5780)))
+        birthdays = [occasion for occasion in schedule['occasions'] if occasion['olim']]
+        # 7 Tevet, which is on Shabbat
+        self.assertEqual([occasion['date'] for occasion in birthdays], ['2020-01-04'])
+        self.assertEqual(birthdays[0]['olim'], [{'id': Person.objects.get().pk, 'name': 'Reuven',
+                                                 'reason': AliyaPrecedenceReason.BIRTHDAY}])
+
+        Person.objects.create(synagogue=self.synagogue, first_name='Shimon', gender=Gender.MALE, is_member=True,
+                              date_of_birth=date(1980, 12, 15))
+        with CaptureQueriesContext(connection) as queries:
+            self.get_url('/aliya_schedule?year=5780', 'get')
+        self.assertEqual(len(queries), number_of_queries)
+
+
+class TestConditionalGet(ViewTest):
+    def setUp(self):
+        self.add_user(login=True)
+        self.add_synagogue()
+        self.synagogue = Synagogue.objects.get()
+        self.person = Person.objects.create(synagogue=self.synagogue, first_name='Reuven')
+
+    def get_again(self, url, response, expected_status):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, expected_status)
+        return response, [query['sql'] for query in queries]
+
+    def test_person_list(self):
+        response = self.get_url('/person', 'get')
+        self.assertIn('no-cache', response['Cache-Control'])
+        not_modified, queries = self.get_again('/person', response, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(not_modified['ETag'], response['ETag'])
+        self.assertEqual(not_modified.content, b'')
+        self.assertFalse([query for query in queries if 'webapp_person' in query])
+
+        self.person.first_name = 'Shimon'
+        self.person.save()
+        modified, queries = self.get_again('/person', response, status.HTTP_200_OK)
+        self.assertNotEqual(modified['ETag'], response['ETag'])
+        self.assertEqual([person['first_name'] for person in modified.json()], ['Shimon'])
+
+    def test_person_detail(self):
+        url = '/person/{}'.format(self.person.pk)
+        response = self.get_url(url, 'get')
+        self.get_again(url, response, status.HTTP_304_NOT_MODIFIED)
+        # any change of the synagogue's people changes the version
+        Person.objects.create(synagogue=self.synagogue, first_name='Shimon')
+        response, queries = self.get_again(url, response, status.HTTP_200_OK)
+        self.get_url('/person/{}'.format(self.person.pk + 100), 'get', expected_status=status.HTTP_404_NOT_FOUND)
+        # even if the client's ETag matches
+        with mock.patch.object(ConditionalGetMixin, 'get_validators', return_value=(response['ETag'], 0)):
+            self.get_again('/person/{}'.format(self.person.pk + 100), response, status.HTTP_404_NOT_FOUND)
+
+    def test_query_string(self):
+        response = self.get_url('/person', 'get')
+        self.get_again('/person?fields=first_name', response, status.HTTP_200_OK)
+        other_person = Person.objects.create(synagogue=self.synagogue, first_name='Shimon')
+        url = '/person/{}'.format(other_person.pk)
+        response = self.get_url(url, 'get')
+        self.get_again('/person/{}'.format(self.person.pk), response, status.HTTP_200_OK)
+        self.get_again(url, response, status.HTTP_304_NOT_MODIFIED)
+
+    def test_synagogue_detail(self):
+        url = '/synagogue/{}'.format(self.synagogue.pk)
+        response = self.get_url(url, 'get')
+        self.assertIn('Last-Modified', response)
+        self.get_again(url, response, status.HTTP_304_NOT_MODIFIED)
+        self.get_url(url, 'patch', {'name': 'def'})
+        modified, queries = self.get_again(url, response, status.HTTP_200_OK)
+        self.assertEqual(modified.json(), {'name': 'def'})
+
+
+class TestPersonSearch(ViewTest):
+    def setUp(self):
+        self.add_user(login=True)
+        self.add_synagogue()
+        self.synagogue = Synagogue.objects.get()
+        self.avraham = Person.objects.create(synagogue=self.synagogue, first_name='Avraham', last_name='Cohen',
+                                             gender=Gender.MALE)
+        self.sarah = Person.objects.create(synagogue=self.synagogue, first_name='Sarah', last_name='Cohen',
+                                           maiden_name='Levi Ben David', gender=Gender.FEMALE)
+        self.yitzchak = Person.objects.create(synagogue=self.synagogue, first_name='יצחק', last_name='כהן',
+                                              manual_paternal_name='אברהם', gender=Gender.MALE)
+        other_synagogue = Synagogue.objects.create(name='other', member_creator=User.objects.create(username='other'))
+        Person.objects.create(synagogue=other_synagogue, first_name='Avraham', last_name='Cohen')
+
+    def search(self, query, **params):
+        response = self.get_url('/person/search', 'get', dict(q=query, **params))
+        return [person['pk'] for person in response.json()]
+
+    def test_prefixes(self):
+        self.check_prefixes()
+
+    def test_prefixes_without_index(self):
+        with mock.patch.dict(search._has_index, {connection.alias: False}):
+            with CaptureQueriesContext(connection) as queries:
+                self.check_prefixes()
+        self.assertFalse([query for query in queries if search.FTS_TABLE in query['sql']])
+
+    @skipUnless(connection.vendor == 'sqlite', 'the search table is SQLite specific')
+    def test_index_is_used(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.search('coh')
+        self.assertTrue([query for query in queries if search.FTS_TABLE in query['sql']])
+
+    def check_prefixes(self):
+        self.assertEqual(self.search('av'), [self.avraham.pk])
+        self.assertEqual(self.search('COH'), [self.avraham.pk, self.sarah.pk])
+        self.assertEqual(self.search('co sa'), [self.sarah.pk])
+        # every word must match
+        self.assertEqual(self.search('avraham levi'), [])
+        # not in the middle of a word
+        self.assertEqual(self.search('raham'), [])
+
+    def test_maiden_and_manual_names(self):
+        self.assertEqual(self.search('david'), [self.sarah.pk])
+        self.assertEqual(self.search('lev'), [self.sarah.pk])
+        self.assertEqual(self.search('אבר'), [self.yitzchak.pk])
+        self.assertEqual(self.search('כה יצ'), [self.yitzchak.pk])
+
+    def test_query_syntax_is_ignored(self):
+        self.assertEqual(self.search('"co* -sa:'), [self.sarah.pk])
+        self.assertEqual(self.search('% _'), [])
+        self.assertEqual(self.search(''), [])
+
+    def test_limit_and_fields(self):
+        self.assertEqual(self.search('cohen', limit=1), [self.avraham.pk])
+        response = self.get_url('/person/search', 'get', {'q': 'sarah', 'fields': 'pk,last_name'})
+        self.assertEqual(response.json(), [{'pk': self.sarah.pk, 'last_name': 'Cohen'}])
+        self.get_url('/person/search', 'get', {'q': 'a', 'limit': 'all'}, status.HTTP_400_BAD_REQUEST)
+        self.get_url('/person/search', 'get', {'q': 'a', 'limit': 0}, status.HTTP_400_BAD_REQUEST)
+
+    def test_index_is_kept_in_sync(self):
+        # bulk_create and update don't send signals
+        Person.objects.bulk_create([Person(synagogue=self.synagogue, first_name='Moshe', last_name='Katz')])
+        self.assertEqual(len(self.search('mosh')), 1)
+        Person.objects.filter(first_name='Moshe').update(first_name='Aharon')
+        self.assertEqual(self.search('mosh'), [])
+        self.assertEqual(len(self.search('ahar katz')), 1)
+        self.avraham.delete()
+        self.assertEqual(self.search('avraham'), [])
+
+
+@skipUnless(connection.vendor == 'sqlite', 'the search table is SQLite specific')
+class TestPersonSearchIndex(TransactionTestCase):
+    def search_schema(self):
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT name, sql FROM sqlite_master WHERE name LIKE %s', [search.FTS_TABLE + '%'])
+            return dict(cursor.fetchall())
+
+    def test_migrated(self):
+        self.assertEqual(search.missing_search(connection), ())
+
+    def test_recreated(self):
+        migrated = self.search_schema()
+        # as remaking the person table in a migration would
+        with connection.cursor() as cursor:
+            cursor.execute('DROP TRIGGER {}'.format(search.FTS_TRIGGERS[0]))
+        self.assertEqual(search.missing_search(connection), (search.FTS_TRIGGERS[0],))
+        search.ensure_search(connection)
+        self.assertEqual(search.missing_search(connection), ())
+        # the same as the migration created
+        self.assertEqual(self.search_schema(), migrated)
@@ -7,10 +7,17 @@ urlpatterns = [
     path('synagogue/<int:pk>', views.SynagogueDetailView.as_view()),
     path('person', views.PersonListCreateView.as_view()),
     path('person/<int:pk>', views.PersonDetailView.as_view()),
+    path('person/search', views.PersonSearchView.as_view()),
+    path('person/<int:pk>/ancestors', views.AncestorsView.as_view()),
+    path('person/<int:pk>/descendants', views.DescendantsView.as_view()),
+    # not ?format=, which is taken by rest framework's content negotiation
+    path('person/export/<str:export_format>', views.PersonExportView.as_view()),
+    path('aliya_schedule', views.AliyaScheduleView.as_view()),
     path('user', views.UserCreateAPIView.as_view()),
     path('login', views.LoginView.as_view()),
     path('logout', views.LogoutView.as_view()),
     path('member_creator_token', views.MakeAddMemberTokenView.as_view()),
+    path('timings', views.TimingsView.as_view()),
 
     path(r'password_reset/', include('django_rest_passwordreset.urls'))
 ]
@@ -1,15 +1,58 @@
 from rest_framework.exceptions import AuthenticationFailed
 import logging
 
+from webapp.models import UserToSynagogue
+
 logger = logging.getLogger('webapp.utils')
 
 
+def _django_request(request):
+    # rest framework wraps the django request, which lives as long as the whole request/response cycle
+    return getattr(request, '_request', request)
+
+
+def get_request_synagogue(request):
+    """
+    Return the synagogue of the request's user, or None if they don't have one.
+
+    The user's synagogue is looked up with a single query the first time it is needed, and kept on the request for the
+    filters, permissions, serializers and views which need it later on. It is kept along with the user it belongs to,
+    since logging in or out changes the request's user.
+    """
+    user = getattr(request, 'user', None)
+    if user is None or user.pk is None:
+        return None
+    django_request = _django_request(request)
+    cached = getattr(django_request, '_synagogue_cache', None)
+    if cached is not None and cached[0] == user.pk:
+        return cached[1]
+    user_to_synagogue = UserToSynagogue.objects.select_related('synagogue').filter(user=user).first()
+    synagogue = None
+    if user_to_synagogue is not None:
+        synagogue = user_to_synagogue.synagogue
+        # so code which follows the relation from the user doesn't query it again
+        user.usertosynagogue = user_to_synagogue
+    django_request._synagogue_cache = (user.pk, synagogue)
+    return synagogue
+
+
+def set_request_synagogue(request, synagogue, user=None):
+    """
+    Update the request's synagogue after adding the request's user to it, or set it for the given user when it is
+    already known while authenticating them.
+    """
+    if user is None:
+        user = request.user
+    _django_request(request)._synagogue_cache = (user.pk, synagogue)
+
+
 def request_to_synagogue(request):
-    if not request_has_synagogue(request):
+    synagogue = get_request_synagogue(request)
+    if synagogue is None:
         logger.info('user without synagogue approached')
         raise AuthenticationFailed("user doesn't have a synagogue")
-    return request.user.usertosynagogue.synagogue
+    return synagogue
 
 
 def request_has_synagogue(request):
-    return hasattr(request, 'user') and hasattr(request.user, 'usertosynagogue')
+    return get_request_synagogue(request) is not None
@@ -1,18 +1,33 @@
+from collections import defaultdict
+from datetime import date
+import hashlib
+
 from django.contrib.auth import authenticate, login
 from django.contrib.auth import logout
 from django.contrib.auth.models import User
 from django.core.exceptions import PermissionDenied
 from django.db.transaction import atomic
+from django.http import Http404, StreamingHttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
 from django.utils.decorators import method_decorator
-from rest_framework import generics
-from rest_framework.authtoken.models import Token
+from django.utils.http import http_date
+from pyluach.dates import HebrewDate
+from rest_framework import generics, status
+from rest_framework.exceptions import ValidationError, NotFound
+from rest_framework.permissions import IsAdminUser
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
-from webapp.models import Synagogue, Person
+from webapp.authentication import get_member_creator_token
+from webapp.export import EXPORT_FORMATS
+from webapp.models import Synagogue, Person, AliyaSchedule
 from webapp.permission import PostSynagoguePermission, IsGetOrAuthenticated
-from webapp.serializers import UserSerializer, SynagogueSerializer, LoginSerializer, PersonSerializer
+from webapp.serializers import UserSerializer, SynagogueSerializer, LoginSerializer, PersonSerializer, \
+    FamilyTreeSerializer
 from webapp.filters import FilterSynagogueBackend
+from webapp.lib import timing
+from webapp.pagination import PersonCursorPagination
+from webapp.search import search
 from webapp.utils import request_to_synagogue
 
 
@@ -30,22 +45,167 @@ class SynagogueListCreateView(generics.ListCreateAPIView):
     permission_classes = (IsGetOrAuthenticated,)
 
 
-class SynagogueDetailView(generics.RetrieveUpdateDestroyAPIView):
+class ConditionalGetMixin:
+    """
+    Answer a GET with 304 Not Modified when the client's copy is still up to date.
+
+    Everything such a view returns belongs to a single synagogue, whose version changes on every write of it or its
+    people, so the check only looks up the version, before anything is queried or serialized. The one thing looked up
+    before it is the object of a detail view, so a missing or forbidden object is never answered with 304.
+    """
+
+    def get_synagogue_id(self):
+        """The synagogue whose version the response depends on, by default the user's."""
+        return request_to_synagogue(self.request).pk
+
+    def get_validators(self):
+        """Return the ETag and the Last-Modified timestamp of the response, or Nones if there is no synagogue."""
+        version = Synagogue.objects.filter(pk=self.get_synagogue_id()).values_list('pk', 'version', 'modified_at') \
+            .first()
+        if version is None:
+            return None, None
+        synagogue_id, number, modified_at = version
+        # the same version is rendered differently by the browsable API, and for every path and query string (the
+        # fields, the cursor and the search)
+        variant = hashlib.sha1('{} {}'.format(self.request.accepted_renderer.format,
+                                              self.request.get_full_path()).encode()).hexdigest()[:16]
+        etag = '"{}-{}-{}"'.format(synagogue_id, number, variant)
+        return etag, int(modified_at.timestamp())
+
+    def get(self, request, *args, **kwargs):
+        instance = None
+        if (self.lookup_url_kwarg or self.lookup_field) in kwargs:
+            # a 404 or 403, whatever the client's copy
+            instance = self.get_object()
+        etag, last_modified = self.get_validators()
+        response = None
+        if etag is not None:
+            response = get_conditional_response(request._request, etag=etag, last_modified=last_modified)
+        if response is None:
+            if instance is not None:
+                # like retrieve(), without looking the object up again
+                response = Response(self.get_serializer(instance).data)
+            else:
+                response = super().get(request, *args, **kwargs)
+        if etag is not None and response.status_code in (status.HTTP_200_OK, status.HTTP_304_NOT_MODIFIED):
+            response['ETag'] = etag
+            response['Last-Modified'] = http_date(last_modified)
+            # the responses are the user's own, and the client must check they're up to date before using them
+            patch_cache_control(response, private=True, no_cache=True)
+        return response
+
+
+class SynagogueDetailView(ConditionalGetMixin, generics.RetrieveUpdateDestroyAPIView):
     queryset = Synagogue.objects.all()
     serializer_class = SynagogueSerializer
     permission_classes = (PostSynagoguePermission,)
 
+    def get_synagogue_id(self):
+        return self.kwargs['pk']
+
 
-class PersonListCreateView(generics.ListCreateAPIView):
-    queryset = Person.objects.all()
+class PersonQuerysetMixin(ConditionalGetMixin):
     serializer_class = PersonSerializer
     filter_backends = (FilterSynagogueBackend,)
 
+    def get_queryset(self):
+        # only join and count what the requested fields need
+        return Person.objects.with_family_details(PersonSerializer.requested_fields(self.request))
 
-class PersonDetailView(generics.RetrieveUpdateDestroyAPIView):
-    queryset = Person.objects.all()
-    serializer_class = PersonSerializer
-    filter_backends = (FilterSynagogueBackend,)
+
+class PersonListCreateView(PersonQuerysetMixin, generics.ListCreateAPIView):
+    pagination_class = PersonCursorPagination
+
+
+class PersonDetailView(PersonQuerysetMixin, generics.RetrieveUpdateDestroyAPIView):
+    pass
+
+
+class PersonSearchView(PersonQuerysetMixin, generics.ListAPIView):
+    """The people with a name which starts with every word of ?q=, for completing a name as it is typed."""
+    DEFAULT_LIMIT = 20
+    MAX_LIMIT = 100
+
+    def get_limit(self):
+        try:
+            limit = int(self.request.query_params.get('limit', self.DEFAULT_LIMIT))
+        except ValueError:
+            raise ValidationError({'limit': 'must be an integer'})
+        if not 0 < limit <= self.MAX_LIMIT:
+            raise ValidationError({'limit': 'must be between 1 and {}'.format(self.MAX_LIMIT)})
+        return limit
+
+    def filter_queryset(self, queryset):
+        queryset = search(super().filter_queryset(queryset), self.request.query_params.get('q', ''))
+        return queryset.order_by('last_name', 'first_name', 'pk')[:self.get_limit()]
+
+
+class FamilyTreeView(APIView):
+    # how many generations are returned when the request doesn't say, and at most
+    DEFAULT_DEPTH = 3
+    MAX_DEPTH = 20
+
+    direction = None
+
+    def get(self, request, pk):
+        try:
+            depth = max(0, min(int(request.query_params.get('depth', self.DEFAULT_DEPTH)), self.MAX_DEPTH))
+        except ValueError:
+            raise ValidationError({'depth': 'must be an integer'})
+        tree = getattr(Person.objects, self.direction + '_of')(pk, request_to_synagogue(request).pk, depth)
+        people = list(tree)
+        if not people:
+            # the root is always in the tree, unless it isn't one of the synagogue's people
+            raise Http404
+        return Response(FamilyTreeSerializer(people, many=True).data)
+
+
+class AncestorsView(FamilyTreeView):
+    direction = 'ancestors'
+
+
+class DescendantsView(FamilyTreeView):
+    direction = 'descendants'
+
+
+class PersonExportView(APIView):
+    def get(self, request, export_format):
+        if export_format not in EXPORT_FORMATS:
+            raise Http404
+        content_type, exporter = EXPORT_FORMATS[export_format]
+        response = StreamingHttpResponse(exporter(request_to_synagogue(request)), content_type=content_type)
+        response['Content-Disposition'] = 'attachment; filename="people.{}"'.format(export_format)
+        return response
+
+
+class AliyaScheduleView(APIView):
+    def get(self, request):
+        synagogue = request_to_synagogue(request)
+        try:
+            year = int(request.query_params.get('year', HebrewDate.today().year))
+        except ValueError:
+            raise ValidationError({'year': 'must be an integer'})
+        schedule = AliyaSchedule.objects.filter(synagogue=synagogue, year=year).first()
+        if schedule is None:
+            raise NotFound('the schedule of {} was not built yet'.format(year))
+
+        olim = defaultdict(list)
+        for entry in schedule.entries.select_related('person'):
+            olim[entry.date].append(entry)
+        occasions = []
+        for hebrew_date, occasion in sorted(synagogue.get_torah_reading_occasions_table(year).items()):
+            entries = olim[hebrew_date.to_pydate()]
+            # like Synagogue.get_olim
+            entries.sort(key=lambda entry: (entry.reason, entry.person.last_aliya_date or date.min))
+            occasions.append({
+                'date': hebrew_date.to_pydate(),
+                'description': occasion.description,
+                'shacharit_aliyot': occasion.shacharit_aliyot,
+                'mincha_aliyot': occasion.mincha_aliyot,
+                'olim': [{'id': entry.person_id, 'name': entry.person.full_name, 'reason': entry.reason}
+                         for entry in entries],
+            })
+        return Response({'year': year, 'built_at': schedule.built_at, 'occasions': occasions})
 
 
 class LoginView(APIView):
@@ -70,6 +230,12 @@ class LogoutView(APIView):
 
 class MakeAddMemberTokenView(APIView):
     def post(self, request):
-        synagogue = request_to_synagogue(request)
-        token, created = Token.objects.get_or_create(user=synagogue.member_creator)
-        return Response({'token': token.key})
+        return Response({'token': get_member_creator_token(request_to_synagogue(request))})
+
+
+class TimingsView(APIView):
+    """The percentiles of the latest requests to every view handled by this process, for the staff."""
+    permission_classes = (IsAdminUser,)
+
+    def get(self, request):
+        return Response(timing.aggregate.summary())
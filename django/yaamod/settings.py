@@ -51,6 +51,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # first, so the timings include the other middleware
+    'webapp.middleware.TimingMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -111,11 +113,16 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
+# the cache (in CACHES) which the keys of the member creators' tokens are shared in between processes, or None to keep
+# them in each process. Deployments with more than one process should set it, since a token deleted in one process is
+# otherwise still handed out by the others until their cached key expires.
+TOKEN_CACHE_ALIAS = None
+
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.BasicAuthentication',
+        'webapp.authentication.CachedBasicAuthentication',
         'rest_framework.authentication.SessionAuthentication',
-        'rest_framework.authentication.TokenAuthentication'
+        'webapp.authentication.SynagogueTokenAuthentication'
     ]
 }
 
@@ -140,6 +147,9 @@ USE_TZ = True
 STATIC_URL = '/static/'
 STATIC_ROOT = os.path.join(BASE_DIR, "static/")
 
+# precomputed by the build_occasion_index command, and loaded on startup if it exists
+TORAH_READING_OCCASION_INDEX_FILE = os.path.join(BASE_DIR, 'torah_reading_occasions.json')
+
 DEFAULT_FROM_EMAIL = 'noreply@yaamod.co.il'
 EMAIL_HOST = 'smtp.sendgrid.net'
 EMAIL_PORT = 465
@@ -2,16 +2,24 @@ import csv
 import pyodbc
 import sys
 
+# how many rows are read from the database at a time
+CHUNK_SIZE = 1000
+
 
 def main(db_path, output):
     conn = pyodbc.connect('Driver={Microsoft Access Driver (*.mdb, *.accdb)};DBQ=' + db_path)
     cur = conn.cursor()
-    data = cur.execute('select * from members').fetchall()
+    cur.execute('select * from members')
     columns = [r[0] for r in cur.description]
-    data = [columns] + data
-    with open(output, 'w') as f:
+    with open(output, 'w', newline='') as f:
         writer = csv.writer(f)
-        writer.writerows(data)
+        writer.writerow(columns)
+        # streamed in chunks, so a large database isn't read into memory at once
+        while True:
+            rows = cur.fetchmany(CHUNK_SIZE)
+            if not rows:
+                break
+            writer.writerows(rows)
 
 
 if __name__ == '__main__':